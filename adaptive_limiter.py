@@ -0,0 +1,157 @@
+"""Адаптивное ограничение числа одновременных запросов к БД (AIMD)."""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    Ограничитель конкурентности с подстройкой лимита по схеме AIMD:
+      - запрос уложился в latency_target_s при полной загрузке лимита — лимит += 1 / лимит
+        (в среднем +1 за «окно» из limit запросов);
+      - запрос медленнее цели — лимит *= max(backoff, target / latency);
+      - ошибка перегрузки (overload_errors) — лимит *= backoff.
+    Текущий лимит, число запросов в работе и ожидание в очереди пишутся в metrics.
+    Синхронные вызовы по умолчанию выполняются в пуле потоков (offload),
+    чтобы запросы разных пользователей действительно шли параллельно.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        latency_target_s: float = 0.5,
+        backoff: float = 0.7,
+        overload_errors: tuple[type[BaseException], ...] = (TimeoutError,),
+        offload: bool = True,
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_s = latency_target_s
+        self.backoff = backoff
+        self.overload_errors = overload_errors
+        self.offload = offload
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._publish()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _publish(self):
+        metrics.set_gauge(f"{self.name}.limiter_limit", round(self._limit, 2))
+        metrics.set_gauge(f"{self.name}.limiter_in_flight", self._in_flight)
+
+    def _wake(self):
+        free = self.limit - self._in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def acquire(self):
+        started = time.perf_counter()
+        while self._in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if not waiter.cancelled() and waiter.done():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._in_flight += 1
+        metrics.observe(
+            f"{self.name}.limiter_queue_wait", time.perf_counter() - started
+        )
+        self._publish()
+
+    def release(self):
+        self._in_flight -= 1
+        self._publish()
+        self._wake()
+
+    def on_success(self, latency_s: float, saturated: bool):
+        if latency_s > self.latency_target_s:
+            factor = max(self.backoff, self.latency_target_s / latency_s)
+            self._limit = max(self.min_limit, self._limit * factor)
+        elif saturated:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def on_overload(self):
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        metrics.incr(f"{self.name}.limiter_overloads")
+
+    def _record(self, started: float, saturated: bool):
+        latency = time.perf_counter() - started
+        metrics.observe(f"{self.name}.limiter_latency", latency)
+        self.on_success(latency, saturated)
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Выполнить синхронный запрос fn(*args, **kwargs) под лимитом.
+        Если ожидание отменено (срок этапа), а поток с запросом ещё работает,
+        это считается перегрузкой, и слот освобождается только по завершении потока.
+        """
+        await self.acquire()
+        saturated = self._in_flight >= self.limit
+        started = time.perf_counter()
+        if not self.offload:
+            try:
+                result = fn(*args, **kwargs)
+            except self.overload_errors:
+                self.on_overload()
+                raise
+            else:
+                self._record(started, saturated)
+                return result
+            finally:
+                self.release()
+
+        abandoned = False
+
+        def finished(task: asyncio.Future):
+            try:
+                if task.cancelled():
+                    return
+                error = task.exception()
+                if abandoned:
+                    return
+                if error is None:
+                    self._record(started, saturated)
+                elif isinstance(error, self.overload_errors):
+                    self.on_overload()
+            finally:
+                self.release()
+
+        task = asyncio.ensure_future(asyncio.to_thread(fn, *args, **kwargs))
+        task.add_done_callback(finished)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                abandoned = True
+                self.on_overload()
+                metrics.incr(f"{self.name}.limiter_abandoned")
+            raise
@@ -0,0 +1,282 @@
+"""Исторический пересчёт предсказаний на прошлые даты (as-of)."""
+
+import argparse
+import logging
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from datetime import time as day_time
+
+from sqlalchemy import or_
+from sqlalchemy.future import select
+
+from batch_predictions import ALL_FEATURES, DIAGNOSES, build_row, score_rows
+from features import compute_cohort_history
+from latest_predictions_cache import refresh_latest_predictions
+from ml_models.registry import model_registry
+from records_db.engine import records_db_engine
+from records_db.predictions import (
+    PredictionsSchemaError,
+    allocate_iterations,
+    check_predictions_schema,
+    prediction_row,
+    save_predictions,
+)
+from records_db.schemas import MLPredictionsRecords
+from stage_profiler import profile_stage, stage_profiler
+from users_db.demographics import get_users_demographics
+from users_db.engine import users_db_engine
+from users_db.schemas import Users
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def as_of_dates(start: date, end: date, step_days: int = 1) -> list[date]:
+    days = []
+    day = start
+    while day <= end:
+        days.append(day)
+        day += timedelta(days=step_days)
+    return days
+
+
+def iteration_datetime(day: date, now: datetime | None = None) -> datetime:
+    """
+    Итерация на дату d датируется концом суток d (UTC), но не позже текущего
+    момента: время из будущего заблокировало бы обновление latest_ml_predictions
+    и кэша последних предсказаний обычными запусками до конца суток.
+    """
+    now = now or datetime.now(timezone.utc)
+    return min(datetime.combine(day, day_time.max, tzinfo=timezone.utc), now)
+
+
+def _utc_date(moment: datetime) -> date:
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.date()
+
+
+def existing_days(
+    session, emails: list[str], days: list[date], versions: dict[str, str]
+) -> dict[tuple[str, str], set[date]]:
+    """
+    (email, диагноз) -> даты из days, на которые уже есть результат текущей
+    версии модели versions[диагноз]. Результаты прежних версий не мешают
+    пересчёту после обновления модели.
+    """
+    since = datetime.combine(min(days), day_time.min, tzinfo=timezone.utc)
+    until = datetime.combine(max(days), day_time.max, tzinfo=timezone.utc)
+    result = session.execute(
+        select(
+            MLPredictionsRecords.email,
+            MLPredictionsRecords.diagnosis_name,
+            MLPredictionsRecords.iteration_datetime,
+        )
+        .where(
+            MLPredictionsRecords.email.in_(emails),
+            MLPredictionsRecords.iteration_datetime.between(since, until),
+            or_(
+                *(
+                    (MLPredictionsRecords.diagnosis_name == name)
+                    & (MLPredictionsRecords.model_version == version)
+                    for name, version in versions.items()
+                )
+            ),
+        )
+        .distinct()
+    )
+    wanted = set(days)
+    existing = {}
+    for email, diagnosis_name, moment in result:
+        day = _utc_date(moment)
+        if day in wanted:
+            existing.setdefault((email, diagnosis_name), set()).add(day)
+    return existing
+
+
+def backfill_chunk(
+    records_db_session,
+    users_db_session,
+    emails: list[str],
+    days: list[date],
+    dry_run: bool = False,
+) -> int:
+    """
+    Пересчитать предсказания группы пользователей на все даты из days:
+    один проход по истории записей на таблицу, один predict_proba на диагноз
+    и одна пакетная вставка. Диагноз на дату пропускается, если на неё уже
+    есть результат текущей версии модели (прошлый backfill или обычный запуск):
+    повторный запуск того же диапазона не дублирует итерации, а после
+    обновления модели история пересчитывается. Номера итераций — отрицательные
+    (allocate_iterations(backfill=True)), чтобы не обгонять обычные запуски.
+    Возвращает число записанных строк.
+    """
+    with profile_stage("backfill.demographics"):
+        users = get_users_demographics(users_db_session, emails)
+    if not users:
+        return 0
+    with profile_stage("backfill.features"):
+        features = compute_cohort_history(
+            records_db_session, list(users), ALL_FEATURES, days
+        )
+
+    models = {
+        diagnosis.name: model_registry.get(diagnosis.name) for diagnosis in DIAGNOSES
+    }
+    existing = existing_days(
+        records_db_session,
+        list(users),
+        days,
+        {name: model.version for name, model in models.items()},
+    )
+    skipped = sum(len(dates) for dates in existing.values())
+    if skipped:
+        logger.info(
+            f"skipping {skipped} user-date-diagnoses already computed by the current models"
+        )
+
+    pending = {diagnosis.name: ([], []) for diagnosis in DIAGNOSES}
+    with profile_stage("backfill.build_input"):
+        for email, user in users.items():
+            user_features = features[email]
+            for idx, day in enumerate(days):
+                day_features = {
+                    name: values[idx] for name, values in user_features.items()
+                }
+                for diagnosis in DIAGNOSES:
+                    if day in existing.get((email, diagnosis.name), ()):
+                        continue
+                    row = build_row(diagnosis, user, day_features, day)
+                    if row is not None:
+                        rows, keys = pending[diagnosis.name]
+                        rows.append(row)
+                        keys.append((email, idx))
+
+    scored = []
+    for diagnosis in DIAGNOSES:
+        rows, keys = pending[diagnosis.name]
+        model = models[diagnosis.name]
+        with profile_stage(f"backfill.{diagnosis.name}.predict"):
+            results = score_rows(diagnosis, rows, model)
+        for (email, idx), result in zip(keys, results):
+            scored.append((email, idx, diagnosis.name, result, model.version))
+
+    # номера итераций выдаются подряд по датам, для которых есть хотя бы один результат
+    scored_days = {}
+    for email, idx, _, _, _ in scored:
+        scored_days.setdefault(email, set()).add(idx)
+    if dry_run:
+        allocated = {email: [0] * len(indices) for email, indices in scored_days.items()}
+    else:
+        allocated = allocate_iterations(
+            records_db_session,
+            {email: len(indices) for email, indices in scored_days.items()},
+            backfill=True,
+        )
+    iterations = {
+        (email, idx): number
+        for email, indices in scored_days.items()
+        for idx, number in zip(sorted(indices), allocated[email])
+    }
+
+    now = datetime.now(timezone.utc)
+    records = [
+        prediction_row(
+            email,
+            diagnosis_name,
+            iterations[(email, idx)],
+            result,
+            iteration_datetime(days[idx], now),
+            model_version,
+        )
+        for email, idx, diagnosis_name, result, model_version in scored
+    ]
+    if not dry_run:
+        with profile_stage("backfill.save"):
+            save_predictions(records_db_session, records)
+    return len(records)
+
+
+def load_cohort(users_db_session, args) -> list[str]:
+    if args.emails:
+        return [email.strip() for email in args.emails.split(",") if email.strip()]
+    if args.emails_file:
+        with open(args.emails_file, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    result = users_db_session.execute(select(Users.email).order_by(Users.email))
+    return list(result.scalars())
+
+
+def main(args):
+    days = as_of_dates(args.start, args.end, args.step_days)
+    records_db_session = records_db_engine.create_session()
+    users_db_session = users_db_engine.create_session()
+    try:
+        emails = load_cohort(users_db_session, args)
+        logger.info(
+            f"backfill {len(emails)} users x {len(days)} dates "
+            f"({args.start} .. {args.end}, step {args.step_days}d)"
+        )
+        started = time.monotonic()
+        written = 0
+        for offset in range(0, len(emails), args.chunk_size):
+            chunk = emails[offset : offset + args.chunk_size]
+            # новая опубликованная версия модели подхватывается со следующей порции
+            model_registry.reload()
+            chunk_written = backfill_chunk(
+                records_db_session, users_db_session, chunk, days, args.dry_run
+            )
+            if chunk_written and not args.dry_run:
+                refresh_latest_predictions(chunk)
+            written += chunk_written
+            done = offset + len(chunk)
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"backfill progress: {done}/{len(emails)} users, {written} predictions, "
+                f"{done / elapsed if elapsed else 0:.1f} users/s"
+            )
+    finally:
+        records_db_session.close()
+        users_db_session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute ML predictions as of past dates."
+    )
+    parser.add_argument("--start", required=True, type=date.fromisoformat)
+    parser.add_argument("--end", required=True, type=date.fromisoformat)
+    parser.add_argument("--step-days", type=int, default=1)
+    parser.add_argument("--emails", help="Comma-separated list of emails")
+    parser.add_argument("--emails-file", help="File with one email per line")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Compute without writing to DB"
+    )
+    parser.add_argument(
+        "--profile", metavar="DIR", help="Write per-stage pstats and collapsed stacks to DIR"
+    )
+    args = parser.parse_args()
+
+    if args.end < args.start or args.step_days < 1:
+        logger.error("Invalid date range")
+        sys.exit(1)
+    if not args.dry_run:
+        try:
+            check_predictions_schema(records_db_engine.engine)
+        except PredictionsSchemaError as e:
+            logger.error(str(e))
+            sys.exit(1)
+
+    if args.profile:
+        stage_profiler.enable(args.profile)
+    try:
+        main(args)
+    finally:
+        stage_profiler.finish()
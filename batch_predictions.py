@@ -0,0 +1,95 @@
+"""Пакетный расчёт предсказаний для многих пользователей и дат расчёта."""
+
+import logging
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable
+
+from make_predictions_funcs import (
+    INSOMNIA_APNEA_FEATURES,
+    HYPERTENSION_FEATURES,
+    DEPRESSION_FEATURES,
+    InputError,
+    build_insomnia_apnea_input,
+    build_hypertension_input,
+    build_depression_input,
+)
+from metrics import metrics
+from ml_models.depression import predict_depression_batch
+from ml_models.hypertension import predict_hypertension_batch
+from ml_models.insomnia_apnea import predict_sleep_disorder_batch
+from ml_models.registry import LoadedModel
+from users_db.demographics import UserDemographics
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Diagnosis:
+    name: str
+    features: tuple[str, ...]
+    build_input: Callable[[UserDemographics, dict, date | None], object]
+    to_row: Callable[[object], tuple]
+    predict_batch: Callable[[list[tuple], LoadedModel], list[str]]
+
+
+DIAGNOSES = (
+    Diagnosis(
+        name="insomnia_apnea",
+        features=INSOMNIA_APNEA_FEATURES,
+        build_input=build_insomnia_apnea_input,
+        to_row=lambda input_data: tuple(input_data.model_dump().values()),
+        predict_batch=lambda rows, model: [
+            output.model_dump_json()
+            for output in predict_sleep_disorder_batch(rows, model)
+        ],
+    ),
+    Diagnosis(
+        name="hypertension",
+        features=HYPERTENSION_FEATURES,
+        build_input=build_hypertension_input,
+        to_row=lambda input_data: tuple(input_data.values()),
+        predict_batch=predict_hypertension_batch,
+    ),
+    Diagnosis(
+        name="depression",
+        features=DEPRESSION_FEATURES,
+        build_input=build_depression_input,
+        to_row=lambda input_data: tuple(input_data.values()),
+        predict_batch=predict_depression_batch,
+    ),
+)
+
+ALL_FEATURES = tuple(
+    dict.fromkeys(name for diagnosis in DIAGNOSES for name in diagnosis.features)
+)
+
+
+def build_row(
+    diagnosis: Diagnosis, user: UserDemographics, features: dict, today: date | None
+) -> tuple | None:
+    """Вход модели в виде кортежа или None, если данных недостаточно."""
+    try:
+        return diagnosis.to_row(diagnosis.build_input(user, features, today))
+    except (InputError, ValueError) as e:
+        logger.debug(f"skip {diagnosis.name} for {user.email} on {today}: {e}")
+        return None
+
+
+def score_rows(
+    diagnosis: Diagnosis, rows: list[tuple], model: LoadedModel
+) -> list[str]:
+    """
+    Один вызов predict_proba на уникальные входы; повторяющиеся
+    кортежи признаков получают уже посчитанный результат.
+    model берётся вызывающим один раз на пакет, чтобы весь пакет
+    считался одной версией модели.
+    """
+    unique = list(dict.fromkeys(rows))
+    if not unique:
+        return []
+    results = dict(zip(unique, diagnosis.predict_batch(unique, model)))
+    metrics.incr(f"batch_predictions.{diagnosis.name}.rows", len(rows))
+    metrics.incr(f"batch_predictions.{diagnosis.name}.unique_rows", len(unique))
+    return [results[row] for row in rows]
@@ -0,0 +1,149 @@
+"""
+Стоимость исключения выбросов в запросах признаков: одинаковый расчёт
+когорты с exclude_outliers и без, p50/p99 и накладные расходы в процентах.
+
+    python bench_features.py [--users 200] [--repeats 20] [--explain] [--output bench.json]
+
+--mark-outliers 0.05 добавляет новую итерацию поиска выбросов, отмечая
+указанную долю записей, — только для тестовой БД.
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import func, insert, text
+from sqlalchemy.future import select
+
+from batch_predictions import ALL_FEATURES
+from features import compile_features, compute_cohort_features
+from records_db.engine import records_db_engine
+from records_db.outliers import OUTLIER_TABLES, ensure_outliers_indexes
+from records_db.schemas import ProcessedRecords
+
+
+def cohort_emails(session, users: int) -> list[str]:
+    result = session.execute(
+        select(ProcessedRecords.email)
+        .distinct()
+        .order_by(ProcessedRecords.email)
+        .limit(users)
+    )
+    return list(result.scalars())
+
+
+def mark_outliers(session, fraction: float) -> dict[str, int]:
+    """Новая итерация в обеих таблицах выбросов: случайная доля записей."""
+    rng = np.random.default_rng(0)
+    now = datetime.now(timezone.utc)
+    marked = {}
+    for table, (model, outliers, record_id) in OUTLIER_TABLES.items():
+        iteration = (
+            session.execute(
+                select(func.max(outliers.outliers_search_iteration_num))
+            ).scalar()
+            or 0
+        ) + 1
+        ids = np.array(session.execute(select(model.id)).scalars().all(), dtype=int)
+        chosen = ids[rng.random(ids.size) < fraction]
+        if chosen.size:
+            session.execute(
+                insert(outliers),
+                [
+                    {
+                        record_id.key: int(record),
+                        "outliers_search_iteration_num": iteration,
+                        "outliers_search_iteration_datetime": now,
+                    }
+                    for record in chosen
+                ],
+            )
+        marked[table] = int(chosen.size)
+    session.commit()
+    return marked
+
+
+def time_mode(session, emails: list[str], exclude_outliers: bool, repeats: int) -> dict:
+    compute_cohort_features(session, emails, ALL_FEATURES, exclude_outliers=exclude_outliers)
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        compute_cohort_features(
+            session, emails, ALL_FEATURES, exclude_outliers=exclude_outliers
+        )
+        latencies.append(time.perf_counter() - started)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+    }
+
+
+def explain(session, emails: list[str]) -> dict[str, list[str]]:
+    """План запроса окна для каждой таблицы с исключением выбросов (PostgreSQL)."""
+    plan = compile_features(ALL_FEATURES, True)
+    plans = {}
+    for table in plan.by_table:
+        statement = plan.window_statement(table, emails, datetime.now().date(), None)
+        compiled = statement.compile(
+            dialect=session.get_bind().dialect, compile_kwargs={"literal_binds": True}
+        )
+        rows = session.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {compiled}"))
+        plans[table] = [row[0] for row in rows]
+    return plans
+
+
+def main(args) -> dict:
+    with records_db_engine.create_session() as session:
+        ensure_outliers_indexes(records_db_engine.engine)
+        report = {}
+        if args.mark_outliers:
+            report["marked"] = mark_outliers(session, args.mark_outliers)
+
+        emails = cohort_emails(session, args.users)
+        plain = time_mode(session, emails, False, args.repeats)
+        excluding = time_mode(session, emails, True, args.repeats)
+        report.update(
+            {
+                "users": len(emails),
+                "features": len(ALL_FEATURES),
+                "repeats": args.repeats,
+                "plain": plain,
+                "exclude_outliers": excluding,
+                "overhead_pct": (
+                    round((excluding["p50_ms"] / plain["p50_ms"] - 1) * 100, 1)
+                    if plain["p50_ms"]
+                    else None
+                ),
+            }
+        )
+        if args.explain and session.get_bind().dialect.name == "postgresql":
+            report["explain"] = explain(session, emails)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark feature queries with and without outlier exclusion."
+    )
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument(
+        "--mark-outliers",
+        type=float,
+        metavar="FRACTION",
+        help="Insert a new outliers iteration flagging this share of records (test DB only)",
+    )
+    parser.add_argument(
+        "--explain", action="store_true", help="Include EXPLAIN ANALYZE (PostgreSQL)"
+    )
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = main(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,233 @@
+"""
+Микробенчмарк моделей: холодный и прогретый вызов, одиночные строки
+и пакеты 1/10/100/10000 на синтетических корректных входах.
+
+    python bench_models.py [--diagnoses insomnia_apnea,depression] [--repeats 50] [--output bench.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from ml_models.registry import model_registry
+
+
+BATCH_SIZES = (1, 10, 100, 10_000)
+MAX_ROWS_PER_SIZE = 100_000
+
+
+def insomnia_apnea_rows(artifact: dict, count: int, rng) -> list[tuple]:
+    genders = list(artifact["gender_encoder"].classes_)
+    bmi_categories = list(artifact["bmi_encoder"].classes_)
+    return [
+        (
+            str(rng.choice(genders)),
+            int(rng.integers(18, 80)),
+            round(float(rng.uniform(4, 10)), 1),
+            int(rng.integers(0, 120)),
+            str(rng.choice(bmi_categories)),
+            int(rng.integers(50, 100)),
+            int(rng.integers(1000, 15000)),
+        )
+        for _ in range(count)
+    ]
+
+
+def hypertension_rows(artifact: dict, count: int, rng) -> list[tuple]:
+    countries = list(artifact["country_encoder"].classes_)
+    activity_levels = list(artifact["physical_activity_level_encoder"].classes_)
+    genders = list(artifact["gender_encoder"].classes_)
+    return [
+        (
+            str(rng.choice(countries)),
+            int(rng.integers(18, 80)),
+            round(float(rng.uniform(17, 40)), 1),
+            str(rng.choice(activity_levels)),
+            round(float(rng.uniform(4, 10)), 1),
+            int(rng.integers(50, 100)),
+            str(rng.choice(genders)),
+        )
+        for _ in range(count)
+    ]
+
+
+def depression_rows(artifact: dict, count: int, rng) -> list[tuple]:
+    return [
+        (
+            int(rng.integers(50, 100)),
+            round(float(rng.uniform(4, 10)), 1),
+            int(rng.integers(1000, 15000)),
+        )
+        for _ in range(count)
+    ]
+
+
+def insomnia_apnea_calls():
+    from ml_models.insomnia_apnea import (
+        predict_sleep_disorder,
+        predict_sleep_disorder_batch,
+    )
+    from models import SleepDisorderInput
+
+    fields = list(SleepDisorderInput.model_fields)
+
+    def prepare_single(row):
+        return SleepDisorderInput(**dict(zip(fields, row)))
+
+    return prepare_single, predict_sleep_disorder, predict_sleep_disorder_batch
+
+
+def hypertension_calls():
+    from ml_models.hypertension import predict_hypertension, predict_hypertension_batch
+
+    return tuple, lambda row: predict_hypertension(*row), predict_hypertension_batch
+
+
+def depression_calls():
+    from ml_models.depression import predict_depression, predict_depression_batch
+
+    return tuple, lambda row: predict_depression(*row), predict_depression_batch
+
+
+BENCHMARKS = {
+    "insomnia_apnea": (insomnia_apnea_rows, insomnia_apnea_calls),
+    "hypertension": (hypertension_rows, hypertension_calls),
+    "depression": (depression_rows, depression_calls),
+}
+
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def summarize(latencies: list[float], rows_per_call: int) -> dict:
+    latencies_ms = np.array(latencies) * 1000
+    p50 = float(np.percentile(latencies_ms, 50))
+    return {
+        "calls": len(latencies),
+        "p50_ms": round(p50, 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "rows_per_s": round(rows_per_call * 1000 / p50, 1) if p50 else None,
+    }
+
+
+def cold_run(name: str, row: tuple) -> dict:
+    """
+    Первый вызов в свежем процессе: импорт модуля модели, загрузка артефакта, predict.
+    Входная строка готовится в родительском процессе, чтобы не трогать артефакт заранее.
+    """
+    _, calls = BENCHMARKS[name]
+    rss_before = peak_rss_mb()
+
+    started = time.perf_counter()
+    prepare_single, predict_single, _ = calls()
+    imported = time.perf_counter()
+    predict_single(prepare_single(row))
+    finished = time.perf_counter()
+    return {
+        "import_ms": round((imported - started) * 1000, 3),
+        "first_call_ms": round((finished - imported) * 1000, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+    }
+
+
+def cold_in_subprocess(name: str, row: tuple) -> dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--cold", name, "--row", json.dumps(row)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench_diagnosis(name: str, repeats: int, batch_sizes: tuple[int, ...]) -> dict:
+    make_rows, calls = BENCHMARKS[name]
+    try:
+        model = model_registry.get(name)
+    except FileNotFoundError as e:
+        return {"skipped": f"artifact not found: {e.filename}"}
+
+    rng = np.random.default_rng(0)
+    artifact = model.artifact
+    prepare_single, predict_single, predict_batch = calls()
+    result = {
+        "artifact": model.path,
+        "version": model.version,
+        "cold": cold_in_subprocess(name, make_rows(artifact, 1, rng)[0]),
+    }
+
+    single_inputs = [prepare_single(row) for row in make_rows(artifact, repeats, rng)]
+    predict_single(single_inputs[0])
+    latencies = []
+    for single_input in single_inputs:
+        started = time.perf_counter()
+        predict_single(single_input)
+        latencies.append(time.perf_counter() - started)
+    result["warm_single"] = summarize(latencies, 1)
+
+    result["batch"] = {}
+    for size in batch_sizes:
+        rows = make_rows(artifact, size, rng)
+        predict_batch(rows)
+        latencies = []
+        for _ in range(max(3, min(repeats, MAX_ROWS_PER_SIZE // size))):
+            started = time.perf_counter()
+            predict_batch(rows)
+            latencies.append(time.perf_counter() - started)
+        result["batch"][str(size)] = summarize(latencies, size)
+    return result
+
+
+def main(args) -> dict:
+    report = {
+        "python": sys.version.split()[0],
+        "repeats": args.repeats,
+        "diagnoses": {
+            name: bench_diagnosis(name, args.repeats, args.batch_sizes)
+            for name in args.diagnoses
+        },
+    }
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ML model inference.")
+    parser.add_argument(
+        "--diagnoses",
+        type=lambda value: value.split(","),
+        default=list(BENCHMARKS),
+        help="Comma-separated subset of: " + ", ".join(BENCHMARKS),
+    )
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument(
+        "--batch-sizes",
+        type=lambda value: tuple(int(size) for size in value.split(",")),
+        default=BATCH_SIZES,
+    )
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--cold", choices=list(BENCHMARKS), help=argparse.SUPPRESS)
+    parser.add_argument("--row", type=json.loads, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold:
+        print(json.dumps(cold_run(args.cold, tuple(args.row))))
+        sys.exit(0)
+
+    unknown = [name for name in args.diagnoses if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown diagnoses: {', '.join(unknown)}")
+
+    report = main(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,88 @@
+"""Автомат защиты (circuit breaker) для вызовов внешних сервисов."""
+
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    """Вызов отклонён без обращения к сервису: автомат разомкнут."""
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд автомат размыкается, и вызовы
+    сразу получают CircuitOpenError. Через reset_timeout_s пропускается один
+    пробный вызов (half-open): успех замыкает автомат, ошибка снова размыкает.
+    Ошибками считаются исключения, для которых is_failure возвращает True.
+    Состояние — гейдж `<name>.circuit_state` (0 closed, 1 half-open, 2 open).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout_s: float,
+        is_failure: Callable[[BaseException], bool] = lambda e: True,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"{self.name} circuit {self.state} -> {state}")
+            self.state = state
+        metrics.set_gauge(f"{self.name}.circuit_state", STATE_GAUGE[state])
+
+    def _before_call(self):
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout_s:
+                metrics.incr(f"{self.name}.circuit_rejected")
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                metrics.incr(f"{self.name}.circuit_rejected")
+                raise CircuitOpenError(f"{self.name} circuit is half-open, probe in flight")
+            self._probing = True
+
+    def _on_success(self):
+        self.failures = 0
+        self._probing = False
+        self._set_state(CLOSED)
+
+    def _on_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                metrics.incr(f"{self.name}.circuit_opened")
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        self._before_call()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            if self.is_failure(e):
+                self._on_failure()
+            else:
+                self._probing = False
+            raise
+        self._on_success()
+        return result
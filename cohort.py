@@ -0,0 +1,204 @@
+"""Запуск предсказаний для когорты пользователей с чекпоинтами в Redis."""
+
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from sqlalchemy.future import select
+
+from records_db.engine import records_db_engine, records_db_limiter
+from records_db.predictions import next_iteration_number
+from redis import redis_client
+from settings import settings
+from users_db.engine import users_db_engine
+from users_db.schemas import Users
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_cohort_emails(path: str | None = None) -> list[str]:
+    """Email из файла (по одному на строку) или всех пользователей users_db."""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    with users_db_engine.create_session() as session:
+        result = session.execute(select(Users.email).order_by(Users.email))
+        return list(result.scalars())
+
+
+class CohortCheckpoint:
+    """
+    Состояние запуска когорты в Redis:
+      <ns><run_id>            — процент выполнения 0–100, как у прогресс-баров сбора данных
+      <ns><run_id>:stats      — hash: done, total, failed, deferred, rate, eta_seconds, status, updated_at
+      <ns><run_id>:completed  — множество обработанных email
+      <ns><run_id>:iterations — hash email -> номер итерации, выданный в этом запуске
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        total: int,
+        namespace: str = settings.REDIS_ML_PREDICTIONS_PROGRESS_BAR_NAMESPACE,
+        ttl_seconds: int = settings.COHORT_CHECKPOINT_TTL_SECONDS,
+    ):
+        self.run_id = run_id
+        self.total = total
+        self.ttl_seconds = ttl_seconds
+        self.progress_key = f"{namespace}{run_id}"
+        self.stats_key = f"{self.progress_key}:stats"
+        self.completed_key = f"{self.progress_key}:completed"
+        self.iterations_key = f"{self.progress_key}:iterations"
+
+    async def completed(self) -> set[str]:
+        return set(await redis_client.smembers(self.completed_key))
+
+    async def iteration_for(self, email: str) -> int:
+        """
+        Номер итерации пользователя в этом запуске. При возобновлении
+        возвращается ранее выданный номер, а не max + 1.
+        """
+        stored = await redis_client.hget(self.iterations_key, email)
+        if stored is not None:
+            return int(stored)
+        iteration = await records_db_limiter.run(
+            records_db_engine.in_session, next_iteration_number, email
+        )
+        await redis_client.hsetnx(self.iterations_key, email, iteration)
+        await redis_client.expire(self.iterations_key, self.ttl_seconds)
+        return int(await redis_client.hget(self.iterations_key, email))
+
+    async def mark_done(self, email: str):
+        await redis_client.sadd(self.completed_key, email)
+        await redis_client.expire(self.completed_key, self.ttl_seconds)
+
+    async def publish(
+        self,
+        done: int,
+        failed: int,
+        rate: float,
+        status: str = "running",
+        deferred: int = 0,
+    ):
+        remaining = self.total - done
+        eta_seconds = round(remaining / rate) if rate else -1
+        percent = int(done * 100 / self.total) if self.total else 100
+        await redis_client.set(self.progress_key, percent, ex=self.ttl_seconds)
+        await redis_client.hset(
+            self.stats_key,
+            mapping={
+                "done": done,
+                "total": self.total,
+                "failed": failed,
+                "deferred": deferred,
+                "rate": round(rate, 3),
+                "eta_seconds": eta_seconds,
+                "status": status,
+                "updated_at": datetime.utcnow().isoformat(),
+            },
+        )
+        await redis_client.expire(self.stats_key, self.ttl_seconds)
+
+
+@dataclass
+class CohortRunResult:
+    run_id: str
+    done: int
+    failed: int
+    deferred: list[str] = field(default_factory=list)
+
+
+async def run_cohort(
+    emails: list[str],
+    process: Callable[[str, int], Awaitable[int | None]],
+    run_id: str | None = None,
+    concurrency: int = 1,
+    deadline: float | None = None,
+) -> CohortRunResult:
+    """
+    Обработать когорту: пропустить уже завершённых в этом run_id пользователей,
+    для остальных вызвать process(email, iteration_number) и отметить выполнение.
+    process возвращает номер итерации; None (запуск отброшен single-flight)
+    не отмечается в чекпоинте, и пользователь попадает в deferred.
+    Пользователи берутся в порядке emails. deadline — момент time.monotonic(),
+    после которого новые пользователи не начинаются: воркер останавливается,
+    если до него осталось меньше средней длительности одного пользователя.
+    Начатые пользователи дорабатывают; не начатые возвращаются в deferred.
+    """
+    run_id = run_id or uuid.uuid4().hex[:12]
+    await redis_client.connect()
+
+    checkpoint = CohortCheckpoint(run_id, len(emails))
+    completed = await checkpoint.completed()
+    queue = [email for email in emails if email not in completed]
+    pending = iter(queue)
+    logger.info(
+        f"cohort run {run_id}: {len(emails)} users, "
+        f"{len(completed & set(emails))} already done"
+    )
+
+    done = len(completed & set(emails))
+    processed = failed = 0
+    busy = 0.0  # суммарная длительность обработки пользователей
+    started = time.monotonic()
+    budget_exhausted = False
+    taken: set[str] = set()
+    dropped: list[str] = []
+
+    def out_of_budget() -> bool:
+        if deadline is None:
+            return False
+        average = busy / processed if processed else 0.0
+        return time.monotonic() + average > deadline
+
+    async def worker():
+        nonlocal done, processed, failed, busy, budget_exhausted
+        while not budget_exhausted:
+            if out_of_budget():
+                budget_exhausted = True
+                break
+            email = next(pending, None)
+            if email is None:
+                break
+            taken.add(email)
+            user_started = time.monotonic()
+            try:
+                iteration = await checkpoint.iteration_for(email)
+                if await process(email, iteration) is None:
+                    dropped.append(email)
+                    logger.warning(f"cohort run {run_id}: run for {email} was dropped")
+                else:
+                    await checkpoint.mark_done(email)
+                    done += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"cohort run {run_id}: failed for {email}: {e}")
+            processed += 1
+            busy += time.monotonic() - user_started
+            elapsed = time.monotonic() - started
+            await checkpoint.publish(done, failed, processed / elapsed if elapsed else 0.0)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    not_started = [email for email in queue if email not in taken]
+    deferred = dropped + not_started
+    elapsed = time.monotonic() - started
+    if not_started:
+        status = "budget_exhausted"
+    elif failed:
+        status = "finished_with_errors"
+    else:
+        status = "finished_with_deferred" if dropped else "finished"
+    await checkpoint.publish(
+        done, failed, processed / elapsed if elapsed else 0.0, status, len(deferred)
+    )
+    logger.info(
+        f"cohort run {run_id} {status}: {done}/{len(emails)} done, {failed} failed, "
+        f"{len(deferred)} deferred"
+    )
+    return CohortRunResult(run_id, done, failed, deferred)
@@ -0,0 +1,142 @@
+"""
+Порядок обработки когорты: сначала пользователи без предсказаний, затем
+те, у кого больше всего новых данных и самые старые предсказания.
+"""
+
+import json
+import logging
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import case, func
+from sqlalchemy.future import select
+
+from records_db.engine import records_db_engine
+from records_db.feasibility import FEASIBILITY_CHUNK_SIZE, cohort_values
+from records_db.schemas import MLPredictionsRecords, ProcessedRecords, RawRecords
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UserPriority:
+    email: str
+    last_prediction_at: datetime | None
+    new_records: int
+    score: float
+
+    @property
+    def never_predicted(self) -> bool:
+        return self.last_prediction_at is None
+
+    @property
+    def sort_key(self) -> tuple:
+        # без предсказаний -> с новыми данными -> по убыванию score
+        return (not self.never_predicted, self.new_records == 0, -self.score)
+
+    def to_dict(self) -> dict:
+        row = asdict(self)
+        row["last_prediction_at"] = (
+            self.last_prediction_at.isoformat() if self.last_prediction_at else None
+        )
+        row["score"] = round(self.score, 3)
+        return row
+
+
+def priority_score(
+    last_prediction_at: datetime | None,
+    new_records: int,
+    now: datetime,
+    new_record_weight: float = settings.COHORT_PRIORITY_NEW_RECORD_WEIGHT,
+) -> float:
+    """Давность последнего предсказания в днях плюс вес за каждую новую запись."""
+    if last_prediction_at is None:
+        staleness_days = 0.0
+    else:
+        if last_prediction_at.tzinfo is None:
+            last_prediction_at = last_prediction_at.replace(tzinfo=timezone.utc)
+        staleness_days = (now - last_prediction_at).total_seconds() / 86400
+    return staleness_days + new_record_weight * new_records
+
+
+def priority_statement(emails: list[str], dialect_name: str):
+    """
+    email, время последней итерации и число новых записей после неё
+    (вся история, если предсказаний нет) — коррелированные подзапросы
+    по индексам (email, ...) без агрегации по всей таблице.
+    Новые записи — большее из чисел raw_records и processed_records:
+    ещё не обработанные данные тоже поднимают пользователя, а одни и те же
+    данные в обеих таблицах не считаются дважды.
+    """
+    cohort = cohort_values(emails, dialect_name)
+    last = (
+        select(func.max(MLPredictionsRecords.iteration_datetime))
+        .where(MLPredictionsRecords.email == cohort.c.email)
+        .correlate(cohort)  # и внутри подзапроса new_records
+        .scalar_subquery()
+    )
+    raw, processed = (
+        select(func.count())
+        .select_from(model)
+        .where(model.email == cohort.c.email, last.is_(None) | (model.time > last))
+        .scalar_subquery()
+        for model in (RawRecords, ProcessedRecords)
+    )
+    new_records = case((raw > processed, raw), else_=processed)
+    return select(
+        cohort.c.email, last.label("last_prediction_at"), new_records.label("new_records")
+    ).execution_options(use_replica=True)
+
+
+def prioritize_cohort(
+    emails: list[str], now: datetime | None = None
+) -> list[UserPriority]:
+    """Пользователи когорты в порядке обработки (по FEASIBILITY_CHUNK_SIZE за запрос)."""
+    now = now or datetime.now(timezone.utc)
+    emails = list(dict.fromkeys(emails))
+    priorities = []
+    with records_db_engine.create_session() as session:
+        dialect_name = session.get_bind().dialect.name
+        for start in range(0, len(emails), FEASIBILITY_CHUNK_SIZE):
+            chunk = emails[start : start + FEASIBILITY_CHUNK_SIZE]
+            result = session.execute(priority_statement(chunk, dialect_name))
+            for email, last_prediction_at, new_records in result:
+                priorities.append(
+                    UserPriority(
+                        email,
+                        last_prediction_at,
+                        new_records,
+                        priority_score(last_prediction_at, new_records, now),
+                    )
+                )
+    priorities.sort(key=lambda priority: priority.sort_key)
+    never = sum(priority.never_predicted for priority in priorities)
+    idle = sum(
+        priority.new_records == 0 and not priority.never_predicted
+        for priority in priorities
+    )
+    logger.info(
+        f"cohort priority: {len(priorities)} users, {never} never predicted, "
+        f"{idle} without new data"
+    )
+    return priorities
+
+
+def write_deferred_report(
+    path: str, run_id: str, priorities: list[UserPriority], deferred: list[str]
+):
+    """JSON-отчёт об отложенных пользователях в порядке приоритета."""
+    deferred = set(deferred)
+    report = {
+        "run_id": run_id,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "total": len(priorities),
+        "deferred": [
+            priority.to_dict() for priority in priorities if priority.email in deferred
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"deferred report for {len(deferred)} users written to {path}")
@@ -0,0 +1,100 @@
+"""Настройка пулов соединений для DbEngine обеих баз."""
+
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+
+from metrics import metrics
+
+
+POOL_MODES = ("queue", "null", "pgbouncer")
+
+
+def timed_pool_class(name: str, base: type = QueuePool) -> type:
+    """
+    Подкласс пула, который пишет время ожидания соединения
+    в метрику `<name>.pool_checkout_wait`.
+    """
+
+    class TimedPool(base):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                metrics.observe(
+                    f"{name}.pool_checkout_wait", time.perf_counter() - started
+                )
+                if isinstance(self, QueuePool):
+                    metrics.set_gauge(f"{name}.pool_checked_out", self.checkedout())
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def engine_options(
+    name: str,
+    driver: str,
+    mode: str,
+    pool_size: int,
+    max_overflow: int,
+    pool_timeout: float,
+    pool_recycle: int,
+    pre_ping: bool,
+    statement_timeout_ms: int = 0,
+) -> dict:
+    """
+    Аргументы create_engine для выбранного режима пула:
+      - queue     : обычный QueuePool для долгоживущих воркеров
+      - null      : без пула, соединение на каждую сессию (короткий CLI-запуск)
+      - pgbouncer : без пула, для PgBouncer в режиме transaction pooling
+                    (psycopg2 не использует серверные prepared statements)
+    statement_timeout_ms (PostgreSQL) передаётся параметром подключения;
+    PgBouncer такие параметры не пропускает, там его ставит
+    watch_statement_timeouts() через SET LOCAL.
+    """
+    if mode not in POOL_MODES:
+        raise ValueError(f"pool mode must be one of {set(POOL_MODES)}")
+
+    connect_args = {}
+    if statement_timeout_ms and mode != "pgbouncer" and driver.startswith("postgresql"):
+        connect_args["options"] = f"-c statement_timeout={statement_timeout_ms}"
+
+    if mode == "queue":
+        options = {
+            "poolclass": timed_pool_class(name, QueuePool),
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": pool_timeout,
+            "pool_recycle": pool_recycle,
+            "pool_pre_ping": pre_ping,
+            "pool_use_lifo": True,
+        }
+    else:
+        options = {"poolclass": timed_pool_class(name, NullPool)}
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def watch_statement_timeouts(engine, name: str, mode: str, statement_timeout_ms: int):
+    """
+    В режиме pgbouncer — SET LOCAL statement_timeout в начале каждой транзакции.
+    Отменённые по таймауту запросы считаются в метрике `<name>.statement_timeouts`.
+    """
+    if not statement_timeout_ms or engine.dialect.name != "postgresql":
+        return
+
+    if mode == "pgbouncer":
+
+        @event.listens_for(engine, "begin")
+        def set_local_timeout(conn):
+            conn.exec_driver_sql(
+                f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}"
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def count_timeouts(context):
+        if "statement timeout" in str(context.original_exception):
+            metrics.incr(f"{name}.statement_timeouts")
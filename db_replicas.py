@@ -0,0 +1,163 @@
+"""Маршрутизация читающих запросов на реплики records_db."""
+
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# 0, если реплика догнала мастер (или это не реплика), иначе отставание в секундах
+PG_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+def replica_urls(value: str | None) -> list[str]:
+    """URL реплик из настройки через запятую."""
+    return [url.strip() for url in (value or "").split(",") if url.strip()]
+
+
+def replication_lag_seconds(engine: Engine) -> float:
+    """Отставание реплики; заодно проверка, что она доступна."""
+    with engine.connect() as conn:
+        if engine.dialect.name != "postgresql":
+            conn.execute(text("SELECT 1"))
+            return 0.0
+        return float(conn.execute(text(PG_LAG_SQL)).scalar() or 0.0)
+
+
+@dataclass
+class Replica:
+    name: str
+    engine: Engine
+    lag_s: float = 0.0
+    checked_at: float = float("-inf")
+    down_until: float = 0.0
+
+
+class ReplicaRouter:
+    """
+    Выбор реплики по кругу. Отставание каждой реплики проверяется не чаще
+    lag_check_interval_s; реплика с отставанием больше max_lag_s пропускается,
+    недоступная (проверка или запрос упали) — исключается на retry_after_s.
+    Если подходящей реплики нет, pick() возвращает None и запрос идёт на мастер.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        engines: list[Engine],
+        max_lag_s: float,
+        lag_check_interval_s: float,
+        retry_after_s: float,
+        lag_probe=replication_lag_seconds,
+    ):
+        self.name = name
+        self.replicas = [
+            Replica(f"{name}_replica{idx}", engine)
+            for idx, engine in enumerate(engines, start=1)
+        ]
+        self.max_lag_s = max_lag_s
+        self.lag_check_interval_s = lag_check_interval_s
+        self.retry_after_s = retry_after_s
+        self.lag_probe = lag_probe
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _mark_down(self, replica: Replica, now: float, error: Exception):
+        replica.down_until = now + self.retry_after_s
+        metrics.incr(f"{replica.name}.errors")
+        logger.warning(f"{replica.name} is unavailable, using primary: {error}")
+
+    def mark_down(self, engine: Engine, error: Exception):
+        """Исключить реплику, на которой упал запрос, на retry_after_s."""
+        for replica in self.replicas:
+            if replica.engine is engine:
+                self._mark_down(replica, time.monotonic(), error)
+
+    def _probe(self, replica: Replica, now: float):
+        try:
+            replica.lag_s = self.lag_probe(replica.engine)
+        except Exception as e:
+            self._mark_down(replica, now, e)
+        else:
+            metrics.set_gauge(f"{replica.name}.lag_seconds", replica.lag_s)
+            if replica.lag_s > self.max_lag_s:
+                logger.warning(
+                    f"{replica.name} lags {replica.lag_s:.1f}s "
+                    f"(max {self.max_lag_s}s), skipping"
+                )
+        finally:
+            replica.checked_at = now
+
+    def pick(self) -> Engine | None:
+        if not self.replicas:
+            return None
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._counter) % len(self.replicas)]
+            now = time.monotonic()
+            if replica.down_until > now:
+                continue
+            with self._lock:
+                if now - replica.checked_at >= self.lag_check_interval_s:
+                    self._probe(replica, now)
+            if replica.down_until <= now and replica.lag_s <= self.max_lag_s:
+                metrics.incr(f"{replica.name}.reads")
+                return replica.engine
+        metrics.incr(f"{self.name}.replica_fallbacks")
+        return None
+
+
+class RoutingSession(Session):
+    """
+    Сессия, которая отправляет SELECT с execution_options(use_replica=True)
+    на реплику из router; всё остальное (записи, выдача номеров итераций,
+    чтение без этой опции) идёт на мастер. Если запрос упал на реплике
+    с OperationalError, реплика исключается и запрос один раз повторяется на мастере.
+    """
+
+    def __init__(self, *args, router: ReplicaRouter | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+        self._replica: Engine | None = None
+
+    def execute(self, statement, *args, **kwargs):
+        self._replica = None
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except OperationalError as e:
+            replica, self._replica = self._replica, None
+            if replica is None:
+                raise
+            self.router.mark_down(replica, e)
+            metrics.incr(f"{self.router.name}.replica_retries")
+            return super().execute(
+                statement.execution_options(use_replica=False), *args, **kwargs
+            )
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if (
+            self.router is not None
+            and clause is not None
+            and getattr(clause, "is_select", False)
+            and clause.get_execution_options().get("use_replica")
+        ):
+            replica = self.router.pick()
+            if replica is not None:
+                self._replica = replica
+                return replica
+        return super().get_bind(mapper, clause=clause, **kwargs)
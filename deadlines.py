@@ -0,0 +1,51 @@
+"""Сроки этапов запуска (поиск пользователя, проверка данных, признаки, инференс, запись, уведомления)."""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable
+
+from metrics import metrics
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+STAGE_DEADLINES = {
+    "user_lookup": settings.STAGE_DEADLINE_USER_LOOKUP_SECONDS,
+    "feasibility": settings.STAGE_DEADLINE_FEASIBILITY_SECONDS,
+    "features": settings.STAGE_DEADLINE_FEATURES_SECONDS,
+    "inference": settings.STAGE_DEADLINE_INFERENCE_SECONDS,
+    "persist": settings.STAGE_DEADLINE_PERSIST_SECONDS,
+    "notify": settings.STAGE_DEADLINE_NOTIFY_SECONDS,
+}
+# этапы, чей запрос к БД продолжает выполняться в потоке после истечения срока
+# (до statement timeout, в своей сессии); после них остальные диагнозы
+# пользователя пропускаются
+DB_STAGES = frozenset({"user_lookup", "feasibility", "features", "persist"})
+
+
+class StageDeadlineExceeded(TimeoutError):
+    def __init__(self, stage: str, seconds: float):
+        super().__init__(f"stage '{stage}' exceeded its {seconds}s deadline")
+        self.stage = stage
+        self.seconds = seconds
+
+
+async def run_stage(stage: str, awaitable: Awaitable[Any]) -> Any:
+    """
+    Дождаться этапа не дольше его срока (asyncio.wait_for). Прерывается только
+    ожидание: синхронный код между await'ами срок не останавливает.
+    Длительность — таймер `stage.<stage>`, превышения — `stage.<stage>.deadline_exceeded`.
+    """
+    seconds = STAGE_DEADLINES[stage]
+    started = time.perf_counter()
+    try:
+        if seconds > 0:
+            return await asyncio.wait_for(awaitable, seconds)
+        return await awaitable
+    except asyncio.TimeoutError:
+        metrics.incr(f"stage.{stage}.deadline_exceeded")
+        raise StageDeadlineExceeded(stage, seconds) from None
+    finally:
+        metrics.observe(f"stage.{stage}", time.perf_counter() - started)
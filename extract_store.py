@@ -0,0 +1,267 @@
+"""Локальный колоночный снимок raw_records/processed_records в файлах .npy."""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy.future import select
+
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_BATCH_ROWS = 500_000
+# повторно читаемое окно id: строки транзакций, зафиксированных позже
+# строк с большими id, догружаются, пока их id не старше этого окна
+EXTRACT_ID_OVERLAP = 10_000
+
+
+class ExtractStore:
+    """
+    Снимок числовых записей, разбитый по таблице и data_type:
+
+        <root>/emails.json                          словарь email -> код
+        <root>/<table>/<data_type>/meta.json        max_id, recent_ids, первая часть,
+                                                    число частей и строк
+        <root>/<table>/<data_type>/part-00000/      email.npy, time.npy, value.npy
+
+    Каждая часть отсортирована по (email, time). Инкрементальное обновление
+    идёт по id (порядок вставки), а не по time: записи, пришедшие с опозданием
+    и старым временем, тоже догружаются. Окно EXTRACT_ID_OVERLAP перечитывается
+    каждый раз, уже выгруженные в нём id (recent_ids) отбрасываются.
+    Чтение — через memory map, без обращения к БД.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._emails: list[str] | None = None
+        self._email_codes: dict[str, int] | None = None
+        self._partitions: dict[tuple[str, str], tuple] = {}
+
+    # --- словарь email ---
+
+    def _load_emails(self):
+        if self._emails is None:
+            path = os.path.join(self.root, "emails.json")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    self._emails = json.load(f)
+            else:
+                self._emails = []
+            self._email_codes = {email: code for code, email in enumerate(self._emails)}
+
+    def _encode_email(self, email: str) -> int:
+        self._load_emails()
+        code = self._email_codes.get(email)
+        if code is None:
+            code = len(self._emails)
+            self._emails.append(email)
+            self._email_codes[email] = code
+        return code
+
+    def _save_emails(self):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, "emails.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._emails, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    # --- метаданные партиций ---
+
+    def partition_dir(self, table: str, data_type: str) -> str:
+        return os.path.join(self.root, table, data_type)
+
+    def read_meta(self, table: str, data_type: str) -> dict:
+        path = os.path.join(self.partition_dir(table, data_type), "meta.json")
+        if not os.path.exists(path):
+            return {"max_id": None, "recent_ids": [], "parts": 0, "rows": 0}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, table: str, data_type: str, meta: dict):
+        path = os.path.join(self.partition_dir(table, data_type), "meta.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def part_indices(meta: dict) -> range:
+        first = meta.get("first_part", 0)
+        return range(first, first + meta["parts"])
+
+    def _write_part(self, table: str, data_type: str, index: int, codes, times, values):
+        order = np.lexsort((times, codes))
+        part_dir = os.path.join(self.partition_dir(table, data_type), f"part-{index:05d}")
+        os.makedirs(part_dir, exist_ok=True)
+        np.save(os.path.join(part_dir, "email.npy"), codes[order])
+        np.save(os.path.join(part_dir, "time.npy"), times[order])
+        np.save(os.path.join(part_dir, "value.npy"), values[order])
+
+    # --- выгрузка из БД ---
+
+    def refresh(self, session, table: str, data_type: str) -> int:
+        """
+        Догрузить строки с id больше max_id - EXTRACT_ID_OVERLAP, которых ещё нет
+        в снимке. Возвращает число добавленных строк.
+        """
+        from features import TABLES, to_epoch
+
+        model = TABLES[table]
+        partition_dir = self.partition_dir(table, data_type)
+        meta = self.read_meta(table, data_type)
+        if meta["parts"] and "max_id" not in meta:
+            # снимок выгружен по max_time: без id его нельзя догружать без потерь
+            logger.warning(f"{table}/{data_type}: extract has no id watermark, re-extracting")
+            shutil.rmtree(partition_dir)
+            meta = self.read_meta(table, data_type)
+        os.makedirs(partition_dir, exist_ok=True)
+
+        stmt = select(model.id, model.email, model.time, model.value).where(
+            model.data_type == data_type
+        )
+        if meta["max_id"] is not None:
+            stmt = stmt.where(model.id > meta["max_id"] - EXTRACT_ID_OVERLAP)
+        result = session.execute(
+            stmt.order_by(model.id).execution_options(yield_per=EXTRACT_BATCH_ROWS)
+        )
+
+        recent = set(meta["recent_ids"])
+        added = 0
+        for rows in result.partitions(EXTRACT_BATCH_ROWS):
+            rows = [row for row in rows if row[0] not in recent]
+            if not rows:
+                continue
+            codes = np.fromiter(
+                (self._encode_email(row[1]) for row in rows), dtype=np.int32
+            )
+            times = np.fromiter((to_epoch(row[2]) for row in rows), dtype=np.float64)
+            values = np.asarray([row[3] for row in rows], dtype=np.float64)
+            self._save_emails()
+            index = self.part_indices(meta).stop
+            self._write_part(table, data_type, index, codes, times, values)
+            ids = [row[0] for row in rows]
+            meta["max_id"] = max(meta["max_id"] or 0, max(ids))
+            recent.update(ids)
+            recent = {id_ for id_ in recent if id_ > meta["max_id"] - EXTRACT_ID_OVERLAP}
+            meta["recent_ids"] = sorted(recent)
+            meta["parts"] += 1
+            meta["rows"] += len(rows)
+            self._write_meta(table, data_type, meta)
+            added += len(rows)
+
+        self._partitions.pop((table, data_type), None)
+        return added
+
+    def compact(self, table: str, data_type: str):
+        """
+        Слить все части партиции в одну, отсортированную по (email, time).
+        Слитая часть пишется под следующим свободным номером, и только запись
+        meta.json переключает на неё чтение; старые части удаляются после этого,
+        так что при сбое на любом шаге снимок остаётся согласованным.
+        """
+        meta = self.read_meta(table, data_type)
+        if meta["parts"] <= 1:
+            return
+        old_parts = self.part_indices(meta)
+        codes, times, values = self._load_partition(table, data_type)
+        self._write_part(table, data_type, old_parts.stop, codes, times, values)
+        self._partitions.pop((table, data_type), None)
+        meta["first_part"] = old_parts.stop
+        meta["parts"] = 1
+        self._write_meta(table, data_type, meta)
+        partition_dir = self.partition_dir(table, data_type)
+        for index in old_parts:
+            shutil.rmtree(os.path.join(partition_dir, f"part-{index:05d}"))
+
+    # --- чтение ---
+
+    def _load_partition(self, table: str, data_type: str):
+        key = (table, data_type)
+        if key not in self._partitions:
+            meta = self.read_meta(table, data_type)
+            parts = [
+                os.path.join(self.partition_dir(table, data_type), f"part-{index:05d}")
+                for index in self.part_indices(meta)
+            ]
+            columns = [
+                [np.load(os.path.join(part, name), mmap_mode="r") for part in parts]
+                for name in ("email.npy", "time.npy", "value.npy")
+            ]
+            if len(parts) == 1:
+                codes, times, values = (column[0] for column in columns)
+            elif parts:
+                codes, times, values = (np.concatenate(column) for column in columns)
+                order = np.lexsort((times, codes))
+                codes, times, values = codes[order], times[order], values[order]
+            else:
+                codes = np.empty(0, dtype=np.int32)
+                times = values = np.empty(0, dtype=np.float64)
+            self._partitions[key] = (codes, times, values)
+        return self._partitions[key]
+
+    def load_series(
+        self, table: str, data_types: Iterable[str], emails: Iterable[str]
+    ) -> dict[tuple[str, str], tuple[np.ndarray, np.ndarray]]:
+        """Ряды (times, values) по ключу (email, data_type), как features.rows_to_series."""
+        self._load_emails()
+        series = {}
+        for data_type in data_types:
+            codes, times, values = self._load_partition(table, data_type)
+            for email in emails:
+                code = self._email_codes.get(email)
+                if code is None:
+                    continue
+                start = np.searchsorted(codes, code, side="left")
+                end = np.searchsorted(codes, code, side="right")
+                if end > start:
+                    series[(email, data_type)] = (times[start:end], values[start:end])
+        return series
+
+
+if __name__ == "__main__":
+    from features import FEATURE_SPECS
+    from records_db.engine import records_db_engine
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(
+        description="Extract numeric records into a local columnar store."
+    )
+    parser.add_argument(
+        "--dir", default=settings.FEATURES_EXTRACT_DIR or "./extract_cache"
+    )
+    parser.add_argument(
+        "--data-types",
+        nargs="*",
+        help="Data types to extract (default: all used by registered features)",
+    )
+    parser.add_argument(
+        "--compact", action="store_true", help="Merge parts after refresh"
+    )
+    args = parser.parse_args()
+
+    partitions = sorted(
+        {
+            (spec.table, spec.data_type)
+            for spec in FEATURE_SPECS.values()
+            if not args.data_types or spec.data_type in args.data_types
+        }
+    )
+    store = ExtractStore(args.dir)
+    session = records_db_engine.create_session()
+    try:
+        for table, data_type in partitions:
+            added = store.refresh(session, table, data_type)
+            if args.compact:
+                store.compact(table, data_type)
+            logger.info(f"{table}/{data_type}: +{added} rows")
+    finally:
+        session.close()
@@ -0,0 +1,604 @@
+"""Декларативный реестр признаков и их вычисление поверх records_db."""
+
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from itertools import groupby
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy import or_, and_, func, tuple_
+from sqlalchemy.future import select
+
+from records_db.engine import records_db_engine, records_db_limiter
+from records_db.feasibility import Requirement, available_requirements
+from records_db.outliers import not_outlier
+from records_db.schemas import RawRecords, ProcessedRecords
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+TABLES = {
+    "raw_records": RawRecords,
+    "processed_records": ProcessedRecords,
+}
+AGGREGATIONS = ("mean", "median", "p90", "stddev", "last")
+WINDOWS_DAYS = (7, 30, 90)
+HISTORY_YIELD_PER = 20_000
+
+
+@dataclass(frozen=True)
+class FeatureSpec:
+    """
+    Описание одного признака:
+      - data_type      : тип записи (HeartRateRecord, StepsRecord, ...)
+      - table          : raw_records или processed_records
+      - window_days    : окно в днях до даты расчёта (None — вся история)
+      - aggregation    : mean / median / p90 / stddev / last
+      - scale          : множитель для перевода единиц (минуты сна -> часы)
+      - fallback_last_n: если окно пустое, агрегировать последние N записей
+      - default        : значение при полном отсутствии данных
+    """
+
+    name: str
+    data_type: str
+    table: str
+    window_days: int | None = 30
+    aggregation: str = "mean"
+    scale: float = 1.0
+    fallback_last_n: int | None = 30
+    default: float | None = 0.0
+
+    def __post_init__(self):
+        if self.table not in TABLES:
+            raise ValueError(f"table must be one of {set(TABLES)}")
+        if self.aggregation not in AGGREGATIONS:
+            raise ValueError(f"aggregation must be one of {set(AGGREGATIONS)}")
+
+
+FEATURE_SPECS: dict[str, FeatureSpec] = {}
+
+
+def register_feature(spec: FeatureSpec) -> FeatureSpec:
+    if spec.name in FEATURE_SPECS:
+        raise ValueError(f"feature '{spec.name}' is already registered")
+    FEATURE_SPECS[spec.name] = spec
+    return spec
+
+
+_SERIES = (
+    # (префикс имени, data_type, таблица, множитель)
+    ("heart_rate", "HeartRateRecord", "raw_records", 1.0),
+    ("sleep_hours", "SleepSessionTimeData", "processed_records", 1 / 60),
+    ("physical_activity_mins", "ActiveMinutesRecord", "processed_records", 1.0),
+    ("daily_steps", "StepsRecord", "processed_records", 1.0),
+)
+
+for _prefix, _data_type, _table, _scale in _SERIES:
+    for _aggregation in ("mean", "median", "p90", "stddev"):
+        for _window in WINDOWS_DAYS:
+            register_feature(
+                FeatureSpec(
+                    name=f"{_prefix}_{_aggregation}_{_window}d",
+                    data_type=_data_type,
+                    table=_table,
+                    window_days=_window,
+                    aggregation=_aggregation,
+                    scale=_scale,
+                )
+            )
+
+register_feature(
+    FeatureSpec(
+        name="weight_kg_last",
+        data_type="WeightRecord",
+        table="raw_records",
+        window_days=None,
+        aggregation="last",
+        fallback_last_n=None,
+        default=None,
+    )
+)
+register_feature(
+    FeatureSpec(
+        name="height_m_last",
+        data_type="HeightRecord",
+        table="raw_records",
+        window_days=None,
+        aggregation="last",
+        fallback_last_n=None,
+        default=None,
+    )
+)
+
+
+def day_start_ts(day: date) -> float:
+    """Начало суток (UTC) в секундах epoch."""
+    return datetime.combine(day, time.min, tzinfo=timezone.utc).timestamp()
+
+
+def to_epoch(moment: datetime) -> float:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _aggregate(aggregation: str, values: np.ndarray) -> float:
+    if aggregation == "mean":
+        return float(values.mean())
+    if aggregation == "median":
+        return float(np.median(values))
+    if aggregation == "p90":
+        return float(np.percentile(values, 90))
+    if aggregation == "stddev":
+        return float(values.std(ddof=1)) if values.size > 1 else 0.0
+    return float(values[-1])
+
+
+def evaluate_spec(
+    spec: FeatureSpec,
+    times: np.ndarray,
+    values: np.ndarray,
+    as_of: date,
+    until_ts: float | None = None,
+) -> float | None:
+    """
+    Вычислить признак по отсортированному по времени ряду (times — epoch секунды).
+    Учитываются только записи строго раньше until_ts, если он задан.
+    """
+    end = times.size if until_ts is None else int(np.searchsorted(times, until_ts))
+    if spec.window_days is None:
+        start = 0
+    else:
+        window_start = day_start_ts(as_of - timedelta(days=spec.window_days))
+        start = int(np.searchsorted(times[:end], window_start))
+
+    window = values[start:end]
+    if window.size == 0 and spec.fallback_last_n:
+        window = values[max(0, end - spec.fallback_last_n) : end]
+    if window.size == 0:
+        return spec.default
+    return _aggregate(spec.aggregation, window) * spec.scale
+
+
+def evaluate_spec_many(
+    spec: FeatureSpec, times: np.ndarray, values: np.ndarray, as_of_dates: list[date]
+) -> list[float | None]:
+    """
+    Значения признака на несколько дат расчёта за один проход по ряду:
+    границы окон находятся через searchsorted, среднее — через префиксные суммы.
+    На дату d учитываются записи строго до начала суток d + 1.
+    """
+    ends = np.searchsorted(
+        times, [day_start_ts(day + timedelta(days=1)) for day in as_of_dates]
+    )
+    if spec.window_days is None:
+        starts = np.zeros_like(ends)
+    else:
+        starts = np.searchsorted(
+            times,
+            [day_start_ts(day - timedelta(days=spec.window_days)) for day in as_of_dates],
+        )
+    if spec.fallback_last_n:
+        starts = np.where(
+            starts >= ends, np.maximum(ends - spec.fallback_last_n, 0), starts
+        )
+    counts = ends - starts
+
+    if spec.aggregation == "mean":
+        prefix = np.concatenate(([0.0], np.cumsum(values)))
+        aggregated = (prefix[ends] - prefix[starts]) / np.maximum(counts, 1)
+    else:
+        aggregated = [
+            _aggregate(spec.aggregation, values[start:end]) if end > start else 0.0
+            for start, end in zip(starts, ends)
+        ]
+    return [
+        float(value) * spec.scale if count else spec.default
+        for value, count in zip(aggregated, counts)
+    ]
+
+
+def _needs_tail(spec: FeatureSpec, times: np.ndarray, as_of: date) -> bool:
+    """Пустое окно, а загруженных строк меньше, чем нужно для fallback."""
+    if spec.window_days is None or not spec.fallback_last_n:
+        return False
+    window_start = day_start_ts(as_of - timedelta(days=spec.window_days))
+    if times.size and times[-1] >= window_start:
+        return False
+    return times.size < spec.fallback_last_n
+
+
+def rows_to_series(rows) -> dict[tuple[str, str], tuple[np.ndarray, np.ndarray]]:
+    """Строки (email, data_type, time, value), упорядоченные по ключу и времени."""
+    series = {}
+    for key, group in groupby(rows, key=lambda row: (row[0], row[1])):
+        group = list(group)
+        times = np.fromiter((to_epoch(row[2]) for row in group), dtype=np.float64)
+        values = np.asarray([row[3] for row in group], dtype=np.float64)
+        series[key] = (times, values)
+    return series
+
+
+class FeaturePlan:
+    """
+    Скомпилированный набор признаков: один запрос на таблицу
+    (плюс запрос хвостов только для пустых окон с fallback).
+    С exclude_outliers каждый запрос получает NOT EXISTS по выбросам
+    последней итерации, и отмеченные записи не выходят из БД.
+    """
+
+    def __init__(self, specs: Iterable[FeatureSpec], exclude_outliers: bool = False):
+        self.specs = tuple(specs)
+        self.exclude_outliers = exclude_outliers
+        self.by_table: dict[str, list[FeatureSpec]] = {}
+        for spec in self.specs:
+            self.by_table.setdefault(spec.table, []).append(spec)
+
+    @property
+    def data_types(self) -> set[str]:
+        return {spec.data_type for spec in self.specs}
+
+    @property
+    def requirements(self) -> set[Requirement]:
+        """
+        Данные, без которых признак не вычислить: у признаков без default
+        пустой ряд даёт None. Окно обязательно, только если нет fallback.
+        """
+        return {
+            Requirement(
+                spec.table,
+                spec.data_type,
+                spec.window_days if spec.fallback_last_n is None else None,
+            )
+            for spec in self.specs
+            if spec.default is None
+        }
+
+    def _filters(self, table: str) -> list:
+        return [not_outlier(table)] if self.exclude_outliers else []
+
+    @staticmethod
+    def _read(stmt):
+        """Запросы плана только читают: RoutingSession может отправить их на реплику."""
+        return stmt.execution_options(use_replica=True)
+
+    def window_statement(self, table: str, emails, as_of: date, until: datetime | None):
+        model = TABLES[table]
+        specs = self.by_table[table]
+        data_types = sorted({spec.data_type for spec in specs})
+        history_types = sorted(
+            {
+                spec.data_type
+                for spec in specs
+                if spec.window_days is None and spec.aggregation == "last"
+            }
+        )
+        full_history = any(
+            spec.window_days is None and spec.aggregation != "last" for spec in specs
+        )
+
+        where = [
+            model.email.in_(emails),
+            model.data_type.in_(data_types),
+            *self._filters(table),
+        ]
+        if until is not None:
+            where.append(model.time < until)
+        columns = (model.email, model.data_type, model.time, model.value)
+
+        if full_history:
+            stmt = select(*columns).where(*where)
+            return self._read(stmt.order_by(model.email, model.data_type, model.time))
+
+        windows = [spec.window_days for spec in specs if spec.window_days is not None]
+        window_cond = (
+            model.time >= as_of - timedelta(days=max(windows)) if windows else None
+        )
+        if not history_types:
+            stmt = select(*columns).where(*where, window_cond)
+            return self._read(stmt.order_by(model.email, model.data_type, model.time))
+
+        history_cond = model.data_type.in_(history_types)
+        rn = (
+            func.row_number()
+            .over(
+                partition_by=(model.email, model.data_type),
+                order_by=model.time.desc(),
+            )
+            .label("rn")
+        )
+        inner = (
+            select(*columns, rn)
+            .where(
+                *where,
+                history_cond if window_cond is None else or_(history_cond, window_cond),
+            )
+            .subquery()
+        )
+        outer_history = and_(inner.c.data_type.in_(history_types), inner.c.rn <= 1)
+        if window_cond is not None:
+            outer_history = or_(
+                outer_history, inner.c.time >= as_of - timedelta(days=max(windows))
+            )
+        stmt = select(inner.c.email, inner.c.data_type, inner.c.time, inner.c.value)
+        return self._read(
+            stmt.where(outer_history).order_by(
+                inner.c.email, inner.c.data_type, inner.c.time
+            )
+        )
+
+    def tail_statement(self, table: str, pairs, limit: int, until: datetime | None):
+        model = TABLES[table]
+        where = [
+            tuple_(model.email, model.data_type).in_(sorted(pairs)),
+            *self._filters(table),
+        ]
+        if until is not None:
+            where.append(model.time < until)
+        rn = (
+            func.row_number()
+            .over(
+                partition_by=(model.email, model.data_type),
+                order_by=model.time.desc(),
+            )
+            .label("rn")
+        )
+        inner = (
+            select(model.email, model.data_type, model.time, model.value, rn)
+            .where(*where)
+            .subquery()
+        )
+        stmt = select(inner.c.email, inner.c.data_type, inner.c.time, inner.c.value)
+        return self._read(
+            stmt.where(inner.c.rn <= limit).order_by(
+                inner.c.email, inner.c.data_type, inner.c.time
+            )
+        )
+
+    def history_statement(self, table: str, emails, until: datetime):
+        """Вся история нужных data_type до момента until — для пересчёта на прошлые даты."""
+        model = TABLES[table]
+        data_types = sorted({spec.data_type for spec in self.by_table[table]})
+        return (
+            select(model.email, model.data_type, model.time, model.value)
+            .where(
+                model.email.in_(emails),
+                model.data_type.in_(data_types),
+                model.time < until,
+                *self._filters(table),
+            )
+            .order_by(model.email, model.data_type, model.time)
+            .execution_options(yield_per=HISTORY_YIELD_PER, use_replica=True)
+        )
+
+    def evaluate_history(
+        self, series, emails: Iterable[str], as_of_dates: list[date]
+    ) -> dict[str, dict[str, list[float | None]]]:
+        """Признаки для каждой пары (email, дата) по заранее загруженным рядам."""
+        empty = (np.empty(0), np.empty(0))
+        results = {}
+        for email in emails:
+            results[email] = {
+                spec.name: evaluate_spec_many(
+                    spec, *series.get((email, spec.data_type), empty), as_of_dates
+                )
+                for spec in self.specs
+            }
+        return results
+
+    def execute_history(
+        self, session, emails: Iterable[str], as_of_dates: list[date]
+    ) -> dict[str, dict[str, list[float | None]]]:
+        emails = sorted(set(emails))
+        until = datetime.combine(
+            max(as_of_dates) + timedelta(days=1), time.min, tzinfo=timezone.utc
+        )
+        series = {}
+        for table in self.by_table:
+            series.update(
+                rows_to_series(
+                    session.execute(self.history_statement(table, emails, until))
+                )
+            )
+        return self.evaluate_history(series, emails, as_of_dates)
+
+    def execute_history_store(
+        self, store, emails: Iterable[str], as_of_dates: list[date]
+    ) -> dict[str, dict[str, list[float | None]]]:
+        emails = sorted(set(emails))
+        series = {}
+        for table, specs in self.by_table.items():
+            series.update(
+                store.load_series(table, {spec.data_type for spec in specs}, emails)
+            )
+        return self.evaluate_history(series, emails, as_of_dates)
+
+    def execute(
+        self, session, emails: Iterable[str], as_of: date | None = None
+    ) -> dict[str, dict[str, float | None]]:
+        emails = sorted(set(emails))
+        until = None
+        if as_of is None:
+            as_of = date.today()
+        else:
+            until = datetime.combine(
+                as_of + timedelta(days=1), time.min, tzinfo=timezone.utc
+            )
+        until_ts = until.timestamp() if until is not None else None
+        empty = (np.empty(0), np.empty(0))
+
+        series = {}
+        for table, specs in self.by_table.items():
+            table_series = rows_to_series(
+                session.execute(self.window_statement(table, emails, as_of, until))
+            )
+
+            tail_pairs, tail_limit = set(), 0
+            for email in emails:
+                for spec in specs:
+                    times, _ = table_series.get((email, spec.data_type), empty)
+                    if _needs_tail(spec, times, as_of):
+                        tail_pairs.add((email, spec.data_type))
+                        tail_limit = max(tail_limit, spec.fallback_last_n)
+            if tail_pairs:
+                table_series.update(
+                    rows_to_series(
+                        session.execute(
+                            self.tail_statement(table, tail_pairs, tail_limit, until)
+                        )
+                    )
+                )
+            series.update(table_series)
+        return self.evaluate(series, emails, as_of, until_ts)
+
+    def evaluate(
+        self, series, emails: Iterable[str], as_of: date, until_ts: float | None = None
+    ) -> dict[str, dict[str, float | None]]:
+        """Признаки на одну дату расчёта по заранее загруженным рядам."""
+        empty = (np.empty(0), np.empty(0))
+        return {
+            email: {
+                spec.name: evaluate_spec(
+                    spec,
+                    *series.get((email, spec.data_type), empty),
+                    as_of,
+                    until_ts,
+                )
+                for spec in self.specs
+            }
+            for email in emails
+        }
+
+    def execute_store(
+        self, store, emails: Iterable[str], as_of: date | None = None
+    ) -> dict[str, dict[str, float | None]]:
+        """То же, что execute(), но по локальному ExtractStore без обращения к БД."""
+        emails = sorted(set(emails))
+        until_ts = None
+        if as_of is None:
+            as_of = date.today()
+        else:
+            until_ts = day_start_ts(as_of + timedelta(days=1))
+        series = {}
+        for table, specs in self.by_table.items():
+            series.update(
+                store.load_series(table, {spec.data_type for spec in specs}, emails)
+            )
+        return self.evaluate(series, emails, as_of, until_ts)
+
+
+@lru_cache(maxsize=64)
+def compile_features(
+    names: tuple[str, ...], exclude_outliers: bool = False
+) -> FeaturePlan:
+    unknown = [name for name in names if name not in FEATURE_SPECS]
+    if unknown:
+        raise KeyError(f"unknown features: {', '.join(unknown)}")
+    return FeaturePlan((FEATURE_SPECS[name] for name in names), exclude_outliers)
+
+
+@lru_cache(maxsize=1)
+def default_extract_store():
+    """ExtractStore из FEATURES_EXTRACT_DIR, если признаки нужно считать без БД."""
+    if not settings.FEATURES_EXTRACT_DIR:
+        return None
+    from extract_store import ExtractStore
+
+    return ExtractStore(settings.FEATURES_EXTRACT_DIR)
+
+
+def _extract_store(exclude_outliers: bool):
+    """
+    ExtractStore не знает об отметках выбросов (они появляются после выгрузки),
+    поэтому признаки без выбросов всегда считаются по БД.
+    """
+    return None if exclude_outliers else default_extract_store()
+
+
+def compute_cohort_features(
+    session,
+    emails: Iterable[str],
+    names: Iterable[str],
+    as_of: date | None = None,
+    exclude_outliers: bool | None = None,
+    use_extract_store: bool = True,
+) -> dict[str, dict[str, float | None]]:
+    """
+    use_extract_store=False — всегда по БД, даже если задан FEATURES_EXTRACT_DIR
+    (выгрузка статична и не видит только что пришедших записей).
+    """
+    if exclude_outliers is None:
+        exclude_outliers = settings.FEATURES_EXCLUDE_OUTLIERS
+    plan = compile_features(tuple(names), exclude_outliers)
+    store = _extract_store(exclude_outliers) if use_extract_store else None
+    if store is not None:
+        return plan.execute_store(store, emails, as_of)
+    return plan.execute(session, emails, as_of)
+
+
+def compute_cohort_history(
+    session,
+    emails: Iterable[str],
+    names: Iterable[str],
+    as_of_dates: list[date],
+    exclude_outliers: bool | None = None,
+) -> dict[str, dict[str, list[float | None]]]:
+    if exclude_outliers is None:
+        exclude_outliers = settings.FEATURES_EXCLUDE_OUTLIERS
+    plan = compile_features(tuple(names), exclude_outliers)
+    store = _extract_store(exclude_outliers)
+    if store is not None:
+        return plan.execute_history_store(store, emails, as_of_dates)
+    return plan.execute_history(session, emails, as_of_dates)
+
+
+def check_feasibility(
+    session,
+    emails: Iterable[str],
+    groups: dict[str, Iterable[str]],
+    as_of: date | None = None,
+    exclude_outliers: bool | None = None,
+) -> dict[str, set[str]]:
+    """
+    email -> группы признаков (например, диагнозы), которые можно вычислить:
+    есть все обязательные данные. Один запрос EXISTS на пачку пользователей.
+    С ExtractStore проверка не нужна, и все группы считаются выполнимыми.
+    """
+    if exclude_outliers is None:
+        exclude_outliers = settings.FEATURES_EXCLUDE_OUTLIERS
+    emails = sorted(set(emails))
+    required = {
+        group: compile_features(tuple(names), exclude_outliers).requirements
+        for group, names in groups.items()
+    }
+    if _extract_store(exclude_outliers) is not None:
+        return {email: set(required) for email in emails}
+
+    available = available_requirements(
+        session, emails, set().union(*required.values()), as_of, exclude_outliers
+    )
+    return {
+        email: {group for group, needed in required.items() if needed <= available[email]}
+        for email in emails
+    }
+
+
+async def compute_features(
+    email: str,
+    names: Iterable[str],
+    as_of: date | None = None,
+    exclude_outliers: bool | None = None,
+) -> dict[str, float | None]:
+    """Признаки одного пользователя в потоке под records_db_limiter, в своей сессии."""
+    features = await records_db_limiter.run(
+        records_db_engine.in_session,
+        compute_cohort_features,
+        [email],
+        names,
+        as_of,
+        exclude_outliers,
+    )
+    return features[email]
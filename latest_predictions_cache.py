@@ -0,0 +1,228 @@
+"""
+Последние предсказания пользователей в Redis для чтения без обращения к records_db.
+
+    <ns><email> — hash: diagnosis_name -> JSON {result_value, result_probabilities,
+                  model_version, iteration_num, iteration_datetime}
+
+При каждой записи в канал REDIS_ML_PREDICTIONS_EVENTS_CHANNEL публикуется
+событие {email, diagnosis_name, iteration_num}.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+from sqlalchemy.future import select
+
+from metrics import metrics
+from records_db.engine import records_db_engine
+from records_db.schemas import LatestMLPredictions
+from redis import redis_client
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_YIELD_PER = 5000
+
+# записать значение, только если оно не старше уже лежащего (как upsert в latest_ml_predictions)
+PUBLISH_SCRIPT = """
+local current = redis.call("hget", KEYS[1], ARGV[1])
+if current then
+    local stored = cjson.decode(current)
+    if stored["iteration_datetime"] > ARGV[3] then
+        return 0
+    end
+end
+redis.call("hset", KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+# удалить hash пользователя, которого нет в latest_ml_predictions, если в нём
+# нет значений новее начала перезаливки (их мог записать идущий параллельно запуск)
+PRUNE_SCRIPT = """
+for _, value in ipairs(redis.call("hvals", KEYS[1])) do
+    if cjson.decode(value)["iteration_datetime"] >= ARGV[1] then
+        return 0
+    end
+end
+return redis.call("del", KEYS[1])
+"""
+
+
+def _utc_iso(moment: datetime) -> str:
+    """Одинаковый формат для сравнения строк: наивное время считается UTC."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _latest_key(email: str) -> str:
+    return f"{settings.REDIS_ML_PREDICTIONS_LATEST_NAMESPACE}{email}"
+
+
+def _encode(row) -> str:
+    return json.dumps(
+        {
+            "result_value": row["result_value"],
+            "result_probabilities": row["result_probabilities"],
+            "model_version": row["model_version"],
+            "iteration_num": row["iteration_num"],
+            "iteration_datetime": _utc_iso(row["iteration_datetime"]),
+        },
+        ensure_ascii=False,
+    )
+
+
+async def publish_latest_predictions(rows: Iterable[dict]):
+    """
+    Разложить строки prediction_row() по hash-ключам пользователей и
+    опубликовать событие для каждой реально обновлённой пары (email, диагноз).
+    """
+    await redis_client.connect()
+    for row in rows:
+        updated = await redis_client.eval(
+            PUBLISH_SCRIPT,
+            1,
+            _latest_key(row["email"]),
+            row["diagnosis_name"],
+            _encode(row),
+            _utc_iso(row["iteration_datetime"]),
+        )
+        if not updated:
+            metrics.incr("latest_predictions_cache.stale_skipped")
+            continue
+        await redis_client.publish(
+            settings.REDIS_ML_PREDICTIONS_EVENTS_CHANNEL,
+            json.dumps(
+                {
+                    "email": row["email"],
+                    "diagnosis_name": row["diagnosis_name"],
+                    "iteration_num": row["iteration_num"],
+                }
+            ),
+        )
+        metrics.incr("latest_predictions_cache.published")
+
+
+async def get_cached_latest_predictions(email: str) -> dict[str, dict]:
+    """Текущие результаты пользователя по всем диагнозам; {} если в Redis ничего нет."""
+    await redis_client.connect()
+    stored = await redis_client.hgetall(_latest_key(email))
+    return {diagnosis: json.loads(value) for diagnosis, value in stored.items()}
+
+
+async def get_cached_latest_prediction(email: str, diagnosis_name: str) -> dict | None:
+    await redis_client.connect()
+    stored = await redis_client.hget(_latest_key(email), diagnosis_name)
+    return json.loads(stored) if stored is not None else None
+
+
+def _latest_statements(emails: list[str] | None, yield_per: int) -> Iterator:
+    columns = (
+        LatestMLPredictions.email,
+        LatestMLPredictions.diagnosis_name,
+        LatestMLPredictions.result_value,
+        LatestMLPredictions.result_probabilities,
+        LatestMLPredictions.model_version,
+        LatestMLPredictions.iteration_num,
+        LatestMLPredictions.iteration_datetime,
+    )
+    if emails is None:
+        yield select(*columns).execution_options(
+            stream_results=True, yield_per=yield_per
+        )
+        return
+    for start in range(0, len(emails), yield_per):
+        chunk = emails[start : start + yield_per]
+        yield select(*columns).where(LatestMLPredictions.email.in_(chunk))
+
+
+async def prune_latest_predictions(known_emails: set[str], since: str) -> int:
+    """Удалить hash-ключи пользователей, которых нет в latest_ml_predictions."""
+    prefix = settings.REDIS_ML_PREDICTIONS_LATEST_NAMESPACE
+    pruned = 0
+    async for key in redis_client.scan_iter(match=f"{prefix}*"):
+        if key[len(prefix) :] not in known_emails:
+            pruned += await redis_client.eval(PRUNE_SCRIPT, 1, key, since)
+    if pruned:
+        metrics.incr("latest_predictions_cache.pruned", pruned)
+        logger.info(f"pruned {pruned} stale latest prediction keys")
+    return pruned
+
+
+async def warm_up_latest_predictions(
+    emails: Iterable[str] | None = None, yield_per: int = WARM_UP_YIELD_PER
+) -> int:
+    """
+    Перезалить Redis из latest_ml_predictions (источник истины — БД): всю
+    таблицу или только пользователей emails (после пакетного пересчёта).
+    Пишется конвейером по yield_per строк тем же скриптом сравнения, что и
+    при обычной записи, поэтому более новое значение, записанное во время
+    перезаливки, не откатывается; событий pub/sub нет. Полная перезаливка
+    удаляет ключи пользователей, которых больше нет в таблице.
+    """
+    await redis_client.connect()
+    started = _utc_iso(datetime.now(timezone.utc))
+    emails = None if emails is None else sorted(set(emails))
+    known_emails = set()
+    written = 0
+    with records_db_engine.create_session() as session:
+        for stmt in _latest_statements(emails, yield_per):
+            result = session.execute(stmt)
+            for partition in result.mappings().partitions(yield_per):
+                pipe = redis_client.pipeline(transaction=False)
+                for row in partition:
+                    pipe.eval(
+                        PUBLISH_SCRIPT,
+                        1,
+                        _latest_key(row["email"]),
+                        row["diagnosis_name"],
+                        _encode(row),
+                        _utc_iso(row["iteration_datetime"]),
+                    )
+                    if emails is None:
+                        known_emails.add(row["email"])
+                stale = len(partition) - sum(await pipe.execute())
+                if stale:
+                    metrics.incr("latest_predictions_cache.stale_skipped", stale)
+                written += len(partition)
+                logger.info(f"warmed up {written} latest predictions")
+    if emails is None:
+        await prune_latest_predictions(known_emails, started)
+    return written
+
+
+async def _refresh(emails: Iterable[str] | None):
+    try:
+        await warm_up_latest_predictions(emails)
+    finally:
+        # соединения привязаны к циклу событий, а каждый вызов asyncio.run — новый цикл
+        await redis_client.disconnect()
+
+
+def refresh_latest_predictions(emails: Iterable[str] | None = None):
+    """
+    Синхронная обёртка для пакетных скриптов (вызывается после каждой порции):
+    ошибка Redis не роняет запуск.
+    """
+    try:
+        asyncio.run(_refresh(emails))
+    except Exception as e:
+        logger.error(f"failed to refresh latest predictions in Redis: {e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Latest predictions in Redis.")
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        help="Rebuild Redis hashes from latest_ml_predictions",
+    )
+    args = parser.parse_args()
+
+    if args.warm_up:
+        asyncio.run(warm_up_latest_predictions())
@@ -0,0 +1,335 @@
+"""
+Пересчёт предсказаний по событиям о новых processed_records.
+
+Источник событий — Postgres LISTEN/NOTIFY (триггер ставится командой
+`python listener.py --install-trigger`) или канал Redis pub/sub, в который
+сервис сбора данных публикует email пользователя. События по одному
+пользователю склеиваются в окне RECORDS_EVENTS_DEBOUNCE_SECONDS; затем
+признаки всех «созревших» пользователей считаются одним пакетом, и run.main
+запускается только для тех, у кого отпечаток признаков изменился.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+import time
+
+from sqlalchemy import text
+
+from batch_predictions import ALL_FEATURES
+from features import compute_cohort_features
+from metrics import metrics
+from ml_models.registry import model_registry
+from records_db.engine import records_db_engine, records_db_limiter
+from records_db.predictions import (
+    PredictionsSchemaError,
+    check_predictions_schema,
+    saved_diagnoses,
+)
+from redis import redis_client
+from settings import settings
+
+import run
+
+
+logger = logging.getLogger(__name__)
+
+TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION notify_processed_records_inserted() RETURNS trigger AS $$
+DECLARE
+    row_email text;
+BEGIN
+    FOR row_email IN SELECT DISTINCT email FROM new_rows LOOP
+        PERFORM pg_notify('{channel}', row_email);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS processed_records_inserted ON processed_records;
+CREATE TRIGGER processed_records_inserted
+    AFTER INSERT ON processed_records
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_processed_records_inserted();
+"""
+
+
+def install_trigger(channel: str = settings.RECORDS_EVENTS_CHANNEL):
+    """Триггер уровня оператора: один NOTIFY на пользователя за INSERT, а не на строку."""
+    with records_db_engine.engine.begin() as conn:
+        conn.execute(text(TRIGGER_SQL.format(channel=channel)))
+    logger.info(f"installed processed_records trigger for channel {channel}")
+
+
+def features_fingerprint(features: dict[str, float | None]) -> str:
+    rounded = {
+        name: None if value is None else round(float(value), 6)
+        for name, value in sorted(features.items())
+    }
+    return hashlib.sha1(json.dumps(rounded).encode()).hexdigest()
+
+
+class Debouncer:
+    """
+    Окно склейки событий по пользователю: пользователь «созревает», когда
+    с последнего события прошло window_s, но не позже max_delay_s
+    после первого, чтобы непрерывный поток данных не откладывал пересчёт навсегда.
+    """
+
+    def __init__(self, window_s: float, max_delay_s: float):
+        self.window_s = window_s
+        self.max_delay_s = max_delay_s
+        self._pending: dict[str, tuple[float, float]] = {}
+
+    def touch(self, email: str, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        first_seen, _ = self._pending.get(email, (now, now))
+        self._pending[email] = (first_seen, now)
+        metrics.incr("listener.events")
+
+    def due(self, now: float | None = None, skip: set[str] = frozenset()) -> list[str]:
+        """Забрать созревших пользователей; skip (уже в очереди) остаются ждать."""
+        now = time.monotonic() if now is None else now
+        ready = [
+            email
+            for email, (first_seen, last_seen) in self._pending.items()
+            if email not in skip
+            and (now - last_seen >= self.window_s or now - first_seen >= self.max_delay_s)
+        ]
+        for email in ready:
+            del self._pending[email]
+        return ready
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class RecomputeListener:
+    def __init__(
+        self,
+        source: str = settings.RECORDS_EVENTS_SOURCE,
+        channel: str = settings.RECORDS_EVENTS_CHANNEL,
+        window_s: float = settings.RECORDS_EVENTS_DEBOUNCE_SECONDS,
+        max_delay_s: float = settings.RECORDS_EVENTS_MAX_DELAY_SECONDS,
+        concurrency: int = settings.RECORDS_EVENTS_CONCURRENCY,
+        namespace: str = settings.REDIS_ML_PREDICTIONS_FEATURES_NAMESPACE,
+        reconnect_min_s: float = 1.0,
+        reconnect_max_s: float = 30.0,
+    ):
+        if source not in ("postgres", "redis"):
+            raise ValueError("source must be 'postgres' or 'redis'")
+        self.source = source
+        self.channel = channel
+        self.debouncer = Debouncer(window_s, max_delay_s)
+        self.concurrency = concurrency
+        self.reconnect_min_s = reconnect_min_s
+        self.reconnect_max_s = reconnect_max_s
+        self.fingerprints_key = f"{namespace}fingerprints"
+        self.queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+        self._queued: set[str] = set()
+
+    def on_event(self, email: str):
+        email = email.strip()
+        if email:
+            self.debouncer.touch(email)
+
+    async def listen_postgres(self):
+        """
+        LISTEN на отдельном DBAPI-соединении psycopg2, уведомления читаются через
+        add_reader. Ошибка чтения (соединение потеряно) завершает метод исключением.
+        """
+        connection = records_db_engine.engine.raw_connection()
+        dbapi_connection = connection.dbapi_connection
+        loop = asyncio.get_running_loop()
+        lost = loop.create_future()
+        fileno = None
+        try:
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+
+            def read_notifies():
+                try:
+                    dbapi_connection.poll()
+                except Exception as e:
+                    if not lost.done():
+                        lost.set_exception(e)
+                    return
+                while dbapi_connection.notifies:
+                    self.on_event(dbapi_connection.notifies.pop(0).payload)
+
+            fileno = dbapi_connection.fileno()
+            loop.add_reader(fileno, read_notifies)
+            logger.info(f"listening to postgres channel {self.channel}")
+            await lost
+        except Exception:
+            connection.invalidate()
+            raise
+        finally:
+            if fileno is not None:
+                loop.remove_reader(fileno)
+            connection.close()
+
+    async def listen_redis(self):
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+            logger.info(f"listening to redis channel {self.channel}")
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    self.on_event(message["data"])
+        finally:
+            try:
+                await pubsub.close()
+            except Exception as e:
+                logger.warning(f"failed to close redis pubsub: {e}")
+
+    async def listen(self):
+        """
+        Подписка на канал с переподключением: при потере соединения LISTEN /
+        SUBSCRIBE выполняется заново с паузой от reconnect_min_s, удваивающейся
+        до reconnect_max_s. События за время разрыва теряются.
+        """
+        listen = self.listen_postgres if self.source == "postgres" else self.listen_redis
+        delay = self.reconnect_min_s
+        while True:
+            started = time.monotonic()
+            try:
+                await listen()
+                error = "subscription ended"
+            except Exception as e:
+                error = e
+            if time.monotonic() - started > self.reconnect_max_s:
+                delay = self.reconnect_min_s
+            metrics.incr("listener.reconnects")
+            logger.error(
+                f"lost {self.source} channel {self.channel} ({error}), "
+                f"reconnecting in {delay:g}s"
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max_s)
+
+    async def changed_users(self, emails: list[str]) -> dict[str, str]:
+        """
+        email -> новый отпечаток для пользователей, у которых признаки изменились.
+        Признаки всегда считаются по БД: ExtractStore не обновляется по событиям.
+        """
+        features = await records_db_limiter.run(
+            records_db_engine.in_session,
+            compute_cohort_features,
+            emails,
+            ALL_FEATURES,
+            use_extract_store=False,
+        )
+        stored = await redis_client.hmget(self.fingerprints_key, emails)
+        changed = {}
+        for email, previous in zip(emails, stored):
+            fingerprint = features_fingerprint(features[email])
+            if fingerprint != previous:
+                changed[email] = fingerprint
+        metrics.incr("listener.checked", len(emails))
+        metrics.incr("listener.unchanged", len(emails) - len(changed))
+        return changed
+
+    @staticmethod
+    async def saved_any(email: str, iteration: int) -> bool:
+        """Запуск записал хотя бы один диагноз в итерации iteration."""
+        saved = await records_db_limiter.run(
+            records_db_engine.in_session, saved_diagnoses, email, iteration
+        )
+        return bool(saved)
+
+    async def flush_loop(self):
+        tick = max(0.5, min(self.debouncer.window_s / 4, 5.0))
+        while True:
+            await asyncio.sleep(tick)
+            due = self.debouncer.due(skip=self._queued)
+            if not due:
+                continue
+            try:
+                changed = await self.changed_users(due)
+            except Exception as e:
+                # пользователи уже забраны из Debouncer: вернуть их на следующую попытку
+                metrics.incr("listener.flush_failed")
+                logger.error(f"failed to check {len(due)} users, retrying later: {e}")
+                for email in due:
+                    self.debouncer.touch(email)
+                continue
+            logger.info(
+                f"{len(due)} users due, {len(changed)} with changed features, "
+                f"{len(self.debouncer)} still pending"
+            )
+            for email, fingerprint in changed.items():
+                self._queued.add(email)
+                self.queue.put_nowait((email, fingerprint))
+
+    async def worker(self):
+        while True:
+            email, fingerprint = await self.queue.get()
+            try:
+                iteration = await run.main(email)
+                if iteration is None:
+                    # запуск отброшен single-flight: повторить после окна склейки
+                    metrics.incr("listener.dropped")
+                    self.debouncer.touch(email)
+                    continue
+                if not await self.saved_any(email, iteration):
+                    # отпечаток не сохраняется: следующее событие снова запустит пересчёт
+                    metrics.incr("listener.not_saved")
+                    logger.warning(f"no predictions saved for {email}")
+                    continue
+                await redis_client.hset(self.fingerprints_key, email, fingerprint)
+                metrics.incr("listener.recomputed")
+            except Exception as e:
+                metrics.incr("listener.failed")
+                logger.error(f"recompute failed for {email}: {e}")
+            finally:
+                self._queued.discard(email)
+                self.queue.task_done()
+
+    async def serve(self):
+        await redis_client.connect()
+        # долгоживущий процесс подхватывает новые версии моделей без перезапуска
+        model_registry.start_auto_reload()
+        await asyncio.gather(
+            self.listen(),
+            self.flush_loop(),
+            *(self.worker() for _ in range(max(1, self.concurrency))),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute predictions when new processed records arrive."
+    )
+    parser.add_argument("--source", choices=("postgres", "redis"))
+    parser.add_argument("--channel")
+    parser.add_argument("--window", type=float, help="Per-user debounce window, seconds")
+    parser.add_argument(
+        "--install-trigger",
+        action="store_true",
+        help="Create the processed_records NOTIFY trigger and exit",
+    )
+    args = parser.parse_args()
+
+    if args.install_trigger:
+        install_trigger(args.channel or settings.RECORDS_EVENTS_CHANNEL)
+    else:
+        try:
+            check_predictions_schema(records_db_engine.engine)
+        except PredictionsSchemaError as e:
+            logger.error(str(e))
+            sys.exit(1)
+        options = {
+            key: value
+            for key, value in (
+                ("source", args.source),
+                ("channel", args.channel),
+                ("window_s", args.window),
+            )
+            if value is not None
+        }
+        asyncio.run(RecomputeListener(**options).serve())
@@ -0,0 +1,321 @@
+"""
+Нагрузочный тест: M одновременных запусков run.py против локальной БД
+и заглушки Notifications API с пошаговым увеличением M.
+
+Пример:
+    RECORDS_DB_HOST=localhost USERS_DB_HOST=localhost \\
+    python loadtest.py --seed-users 200 --levels 1,2,4,8,16 --duration 60 --mode process
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from sqlalchemy import insert, text
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("loadtest")
+
+NOTIFICATIONS_PATH = "/notifications-api/api/v1/notifications"
+
+
+class StubNotificationsHandler(BaseHTTPRequestHandler):
+    """Отвечает 200 на любой запрос; задержка и доля ошибок задаются на сервере."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.server.latency_s)
+        if random.random() < self.server.error_rate:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_notifications(port: int, latency_s: float, error_rate: float) -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubNotificationsHandler)
+    server.latency_s = latency_s
+    server.error_rate = error_rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}{NOTIFICATIONS_PATH}"
+
+
+def seed_users(count: int, days: int = 90) -> list[str]:
+    """Создать таблицы и синтетических пользователей с историей записей в локальной БД."""
+    from records_db.engine import records_db_engine
+    from records_db.schemas import Base as RecordsBase, RawRecords, ProcessedRecords
+    from users_db.engine import users_db_engine
+    from users_db.schemas import Base as UsersBase, Users
+
+    RecordsBase.metadata.create_all(records_db_engine.engine)
+    UsersBase.metadata.create_all(users_db_engine.engine)
+
+    emails = [f"loadtest-{i}@example.com" for i in range(count)]
+    now = datetime.now(timezone.utc)
+    rng = np.random.default_rng(0)
+
+    with users_db_engine.engine.begin() as conn:
+        existing = set(
+            conn.execute(
+                text("SELECT email FROM users WHERE email LIKE 'loadtest-%'")
+            ).scalars()
+        )
+        new_users = [email for email in emails if email not in existing]
+        if new_users:
+            conn.execute(
+                insert(Users),
+                [
+                    {
+                        "google_sub": email,
+                        "email": email,
+                        "gender": random.choice(["male", "female"]),
+                        "birth_date": datetime(1960 + i % 40, 1 + i % 12, 1),
+                    }
+                    for i, email in enumerate(new_users)
+                ],
+            )
+
+    with records_db_engine.engine.begin() as conn:
+        for email in new_users:
+            moments = [now - timedelta(days=day) for day in range(days)]
+            conn.execute(
+                insert(RawRecords),
+                [
+                    {"email": email, "data_type": "HeartRateRecord", "time": moment,
+                     "value": str(int(rng.normal(72, 8)))}
+                    for moment in moments
+                ]
+                + [
+                    {"email": email, "data_type": "WeightRecord", "time": now,
+                     "value": str(round(rng.normal(75, 12), 1))},
+                    {"email": email, "data_type": "HeightRecord", "time": now,
+                     "value": str(round(rng.normal(1.74, 0.08), 2))},
+                ],
+            )
+            conn.execute(
+                insert(ProcessedRecords),
+                [
+                    {"email": email, "data_type": data_type, "time": moment,
+                     "value": str(max(0, int(rng.normal(mean, mean / 4))))}
+                    for data_type, mean in (
+                        ("SleepSessionTimeData", 420),
+                        ("ActiveMinutesRecord", 40),
+                        ("StepsRecord", 7000),
+                    )
+                    for moment in moments
+                ],
+            )
+    logger.info(f"seeded {len(new_users)} new users ({len(emails)} total)")
+    return emails
+
+
+class ConnectionSampler:
+    """Фоновый опрос pg_stat_activity: число соединений к базе records_db."""
+
+    def __init__(self, interval_s: float = 0.5):
+        self.interval_s = interval_s
+        self.samples: list[int] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        from records_db.engine import records_db_engine
+
+        if records_db_engine.engine.dialect.name != "postgresql":
+            return
+        with records_db_engine.engine.connect() as conn:
+            while not self._stop.is_set():
+                count = conn.execute(
+                    text(
+                        "SELECT count(*) FROM pg_stat_activity "
+                        "WHERE datname = current_database()"
+                    )
+                ).scalar()
+                self.samples.append(int(count))
+                conn.commit()
+                self._stop.wait(self.interval_s)
+
+    def __enter__(self):
+        self.samples = []
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def run_process_job(email: str) -> bool:
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "run.py",
+        "--email",
+        email,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await proc.communicate()
+    return proc.returncode == 0 and b"[ERROR]" not in stderr
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+async def run_asyncio_job(email: str, error_counter: ErrorCounter) -> bool:
+    import run
+
+    errors_before = error_counter.count
+    try:
+        await run.main(email)
+    except Exception as e:
+        logger.warning(f"job for {email} failed: {e}")
+        return False
+    return error_counter.count == errors_before
+
+
+async def run_level(concurrency: int, duration_s: float, emails: list[str], job) -> dict:
+    """Замкнутый цикл: concurrency слотов, каждый запускает новый job сразу после предыдущего."""
+    latencies, failures = [], 0
+    deadline = time.monotonic() + duration_s
+    started = time.monotonic()
+
+    async def slot():
+        nonlocal failures
+        while time.monotonic() < deadline:
+            job_started = time.monotonic()
+            ok = await job(random.choice(emails))
+            latencies.append(time.monotonic() - job_started)
+            failures += 0 if ok else 1
+
+    with ConnectionSampler() as sampler:
+        await asyncio.gather(*(slot() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    completed = len(latencies)
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "concurrency": concurrency,
+        "jobs": completed,
+        "throughput_per_s": round(completed / elapsed, 3),
+        "error_rate": round(failures / completed, 4) if completed else 0.0,
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies_ms, 50)), 1),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 1),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 1),
+            "max": round(float(latencies_ms.max()), 1),
+        },
+        "db_connections": {
+            "max": max(sampler.samples, default=None),
+            "avg": round(float(np.mean(sampler.samples)), 1) if sampler.samples else None,
+        },
+    }
+
+
+def find_knee(
+    results: list[dict],
+    min_gain: float = 0.1,
+    max_error_rate: float = 0.01,
+    max_p99_growth: float = 2.0,
+) -> int | None:
+    """
+    Последний уровень M, после которого рост нагрузки ещё окупался:
+    следующий уровень даёт прирост пропускной способности меньше min_gain,
+    долю ошибок выше max_error_rate или p99 больше чем в max_p99_growth раз.
+    """
+    knee = None
+    for previous, current in zip([None] + results[:-1], results):
+        if current["error_rate"] > max_error_rate:
+            break
+        if previous is not None:
+            gain = current["throughput_per_s"] / max(previous["throughput_per_s"], 1e-9) - 1
+            p99_growth = current["latency_ms"]["p99"] / max(previous["latency_ms"]["p99"], 1e-9)
+            if gain < min_gain or p99_growth > max_p99_growth:
+                break
+        knee = current["concurrency"]
+    return knee
+
+
+async def main(args):
+    base_url = start_stub_notifications(
+        args.stub_port, args.stub_latency_ms / 1000, args.stub_error_rate
+    )
+    os.environ["NOTIFICATIONS_API_BASE_URL"] = base_url
+    logger.info(f"stub notifications API at {base_url}")
+
+    if args.seed_users:
+        emails = seed_users(args.seed_users)
+    else:
+        with open(args.emails_file, encoding="utf-8") as f:
+            emails = [line.strip() for line in f if line.strip()]
+
+    if args.mode == "process":
+        job = run_process_job
+    else:
+        error_counter = ErrorCounter()
+        logging.getLogger().addHandler(error_counter)
+        job = lambda email: run_asyncio_job(email, error_counter)  # noqa: E731
+
+    results = []
+    for concurrency in args.levels:
+        logger.info(f"level M={concurrency} for {args.duration}s")
+        result = await run_level(concurrency, args.duration, emails, job)
+        logger.info(json.dumps(result))
+        results.append(result)
+
+    report = {"mode": args.mode, "levels": results, "knee_concurrency": find_knee(results)}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test concurrent per-user runs.")
+    parser.add_argument("--mode", choices=("process", "asyncio"), default="process")
+    parser.add_argument(
+        "--levels",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 2, 4, 8, 16],
+        help="Comma-separated concurrency levels to ramp through",
+    )
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per level")
+    cohort = parser.add_mutually_exclusive_group(required=True)
+    cohort.add_argument("--seed-users", type=int, help="Create N synthetic users")
+    cohort.add_argument("--emails-file", help="Existing users, one email per line")
+    parser.add_argument("--stub-port", type=int, default=0)
+    parser.add_argument("--stub-latency-ms", type=float, default=20)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    asyncio.run(main(parser.parse_args()))
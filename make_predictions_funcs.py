@@ -1,21 +1,83 @@
 import logging
-from datetime import datetime, date, timedelta
-
-from sqlalchemy.future import select
-from sqlalchemy import func, cast, Numeric
-
-from records_db.schemas import MLPredictionsRecords, RawRecords, ProcessedRecords
-from users_db.schemas import Users
+from datetime import date
+from typing import Iterable
 
+from deadlines import run_stage
+from features import check_feasibility, compute_features
+from latest_predictions_cache import publish_latest_predictions
+from records_db.predictions import save_prediction
+from users_db.demographics import UserDemographics, get_user_demographics
+from records_db.engine import records_db_engine, records_db_limiter
+from users_db.engine import users_db_engine, users_db_limiter
 
 from ml_models.insomnia_apnea import predict_sleep_disorder
 from ml_models.hypertension import predict_hypertension
 from ml_models.depression import predict_depression
-from models import SleepDisorderInput
+from ml_models.registry import model_registry
+from models import SleepDisorderInput, SleepDisorderOutput
+from prediction_cache import prediction_memo
+from stage_profiler import profile_stage
 
 
 logger = logging.getLogger(__name__)
 
+INSOMNIA_APNEA_FEATURES = (
+    "sleep_hours_mean_30d",
+    "physical_activity_mins_mean_30d",
+    "heart_rate_mean_30d",
+    "daily_steps_mean_30d",
+    "weight_kg_last",
+    "height_m_last",
+)
+HYPERTENSION_FEATURES = (
+    "heart_rate_mean_30d",
+    "sleep_hours_mean_30d",
+    "physical_activity_mins_mean_30d",
+    "weight_kg_last",
+    "height_m_last",
+)
+DEPRESSION_FEATURES = (
+    "heart_rate_mean_30d",
+    "sleep_hours_mean_30d",
+    "daily_steps_mean_30d",
+)
+DIAGNOSIS_FEATURES = {
+    "insomnia_apnea": INSOMNIA_APNEA_FEATURES,
+    "hypertension": HYPERTENSION_FEATURES,
+    "depression": DEPRESSION_FEATURES,
+}
+
+# шаг округления непрерывных входов — разрешение данных, на которых обучены модели;
+# входы, совпадающие после округления, дают один ключ prediction_memo
+# и одну строку в пакетном predict_proba
+INPUT_RESOLUTION = {
+    "insomnia_apnea": {"sleep_duration_hours": 0.1, "daily_steps": 100},
+    "hypertension": {"bmi": 0.1, "sleep_duration": 0.1},
+    "depression": {"sleep_duration": 0.1, "physical_activity_steps": 100},
+}
+
+
+def quantize(value: float, step: float) -> float:
+    """Ближайшее кратное step; целый шаг даёт int."""
+    quantized = round(value / step) * step
+    if float(step).is_integer():
+        return int(quantized)
+    return round(quantized, 6)
+
+
+def required_features(diagnoses: Iterable[str]) -> tuple[str, ...]:
+    """Объединение признаков диагнозов без повторов: один запрос признаков на запуск."""
+    return tuple(
+        dict.fromkeys(
+            name for diagnosis in diagnoses for name in DIAGNOSIS_FEATURES[diagnosis]
+        )
+    )
+
+
+def feasible_diagnoses(records_db_session, emails) -> dict[str, set[str]]:
+    """email -> диагнозы, для которых есть обязательные данные (вес, рост, ...)."""
+    return check_feasibility(records_db_session, emails, DIAGNOSIS_FEATURES)
+
 
 def get_bmi_category(weight_kg: int | float, height_meters: int | float):
     if weight_kg and height_meters:
@@ -33,112 +95,29 @@ def get_bmi_category(weight_kg: int | float, height_meters: int | float):
         raise Exception("not enough date for bmi")
 
 
-async def compute_avg_raw_records(session, data_type, email):
-    today = date.today()
-    last_30_days = today - timedelta(days=30)
-
-    result = session.execute(
-        select(func.avg(cast(RawRecords.value, Numeric))).where(
-            RawRecords.email == email,
-            RawRecords.data_type == data_type,
-            RawRecords.time >= last_30_days,
-        )
-    )
-    avg = result.scalar()
-    if avg is not None:
-        return float(avg)
-
-    result = session.execute(
-        select(RawRecords.value)
-        .where(RawRecords.email == email, RawRecords.data_type == data_type)
-        .order_by(RawRecords.time.desc())
-        .limit(30)
-    )
-    values = [float(row[0]) for row in result.fetchall()]
-    return float(sum(values) / len(values)) if values else 0.0
-
-
-async def compute_avg_processed_records(session, data_type, email):
-    today = date.today()
-    last_30_days = today - timedelta(days=30)
-
-    result = session.execute(
-        select(func.avg(cast(ProcessedRecords.value, Numeric))).where(
-            ProcessedRecords.email == email,
-            ProcessedRecords.data_type == data_type,
-            ProcessedRecords.time >= last_30_days,
-        )
-    )
-    avg = result.scalar()
-    if avg is not None:
-        return float(avg)
-
-    result = session.execute(
-        select(ProcessedRecords.value)
-        .where(ProcessedRecords.email == email, ProcessedRecords.data_type == data_type)
-        .order_by(ProcessedRecords.time.desc())
-        .limit(30)
-    )
-    values = [float(row[0]) for row in result.fetchall()]
-    return float(sum(values) / len(values)) if values else 0.0
-
+class InputError(ValueError):
+    """Недостаточно данных, чтобы собрать вход модели."""
 
-async def make_insomnia_apnea_predictions(
-    records_db_session, users_db_session, email: str, iteration: int
-):
-    result = users_db_session.execute(select(Users).where(Users.email == email))
-    user: Users | None = result.scalar_one_or_none()
-    if user is None:
-        logger.error(f"User with email '{email}' not found in users database")
-        return
 
+def build_insomnia_apnea_input(
+    user: UserDemographics, features: dict, today: date | None = None
+) -> SleepDisorderInput:
     gender = user.gender
-    birth_date: date = user.birth_date.date()
-    today = date.today()
-    age = (
-        today.year
-        - birth_date.year
-        - ((today.month, today.day) < (birth_date.month, birth_date.day))
-    )
+    age = user.age(today)
 
-    sleep_duration_hours = await compute_avg_processed_records(
-        records_db_session, "SleepSessionTimeData", email
-    )
-    if sleep_duration_hours:
-        sleep_duration_hours = sleep_duration_hours / 60
-    physical_activity_mins_daily = await compute_avg_processed_records(
-        records_db_session, "ActiveMinutesRecord", email
-    )
-    heart_rate = await compute_avg_raw_records(
-        records_db_session, "HeartRateRecord", email
-    )
-    daily_steps = await compute_avg_processed_records(
-        records_db_session, "StepsRecord", email
-    )
-
-    last_weight_record = records_db_session.execute(
-        select(RawRecords.value)
-        .where(RawRecords.email == email, RawRecords.data_type == "WeightRecord")
-        .order_by(RawRecords.time.desc())
-        .limit(1)
-    )
-    weight = last_weight_record.scalar_one_or_none()
-
-    last_height_record = records_db_session.execute(
-        select(RawRecords.value)
-        .where(RawRecords.email == email, RawRecords.data_type == "HeightRecord")
-        .order_by(RawRecords.time.desc())
-        .limit(1)
-    )
-    height = last_height_record.scalar_one_or_none()
+    sleep_duration_hours = features["sleep_hours_mean_30d"]
+    physical_activity_mins_daily = features["physical_activity_mins_mean_30d"]
+    heart_rate = features["heart_rate_mean_30d"]
+    daily_steps = features["daily_steps_mean_30d"]
+    weight = features["weight_kg_last"]
+    height = features["height_m_last"]
 
     try:
         weight = float(weight)
         height = float(height)
         bmi_category = get_bmi_category(weight, height)
     except Exception as e:
-        logger.error(f"Error during bmi calc: {e}")
-        return
+        raise InputError(f"Error during bmi calc: {e}")
 
     required_fields = {
         "gender": gender,
@@ -151,45 +130,21 @@ async def make_insomnia_apnea_predictions(
     }
     missing = [name for name, value in required_fields.items() if value is None]
     if missing:
-        logger.error(f"Missing required fields for ML input: {', '.join(missing)}")
-        return
+        raise InputError(f"Missing required fields for ML input: {', '.join(missing)}")
 
     gender = gender.capitalize()
-    input_data = SleepDisorderInput(
+    resolution = INPUT_RESOLUTION["insomnia_apnea"]
+    return SleepDisorderInput(
         gender=gender,
         age=age,
-        sleep_duration_hours=sleep_duration_hours,
+        sleep_duration_hours=quantize(
+            sleep_duration_hours, resolution["sleep_duration_hours"]
+        ),
         physical_activity_mins_daily=int(physical_activity_mins_daily),
         bmi_category=bmi_category,
         heart_rate=int(heart_rate),
-        daily_steps=int(daily_steps),
-    )
-    try:
-        predictions = predict_sleep_disorder(input_data)
-    except Exception as e:
-        logger.error(f"Error during prediction: {e}")
-        return
-
-    logger.info(f"predicted: {predictions}")
-
-    now = datetime.utcnow()
-    records = []
-
-    name = "insomnia_apnea"
-    result_value = predictions.model_dump_json()
-    rec = MLPredictionsRecords(
-        email=email,
-        result_value=result_value,
-        diagnosis_name=name,
-        iteration_num=iteration,
-        iteration_datetime=now,
+        daily_steps=quantize(daily_steps, resolution["daily_steps"]),
     )
-    records.append(rec)
-    logger.info(f"Generated {name}: result_value")
-
-    records_db_session.add_all(records)
-    records_db_session.commit()
-    logger.info(f"Committed {len(records)} ML predictions (insomnia/apnea) to DB")
 
 
 def categorize_physical_activity(minutes_per_day: float) -> str:
@@ -207,62 +162,24 @@ def categorize_physical_activity(minutes_per_day: float) -> str:
         return "High"
 
 
-async def make_hypertension_predictions(
-    records_db_session, users_db_session, email: str, iteration: int
-):
-
-    result = users_db_session.execute(select(Users).where(Users.email == email))
-    user: Users | None = result.scalar_one_or_none()
-    if user is None:
-        logger.error(f"User with email '{email}' not found in users database")
-        return
-
+def build_hypertension_input(
+    user: UserDemographics, features: dict, today: date | None = None
+) -> dict:
     gender = user.gender
-    birth_date: date = user.birth_date.date()
-    today = date.today()
-    age = (
-        today.year
-        - birth_date.year
-        - ((today.month, today.day) < (birth_date.month, birth_date.day))
-    )
-
-    heart_rate = await compute_avg_raw_records(
-        records_db_session, "HeartRateRecord", email
-    )
-    sleep_duration_minutes = await compute_avg_processed_records(
-        records_db_session, "SleepSessionTimeData", email
-    )
-
-    sleep_duration_hours = (
-        sleep_duration_minutes / 60 if sleep_duration_minutes is not None else None
-    )
-    physical_activity_mins_daily = await compute_avg_processed_records(
-        records_db_session, "ActiveMinutesRecord", email
-    )
-
-    last_weight_record = records_db_session.execute(
-        select(RawRecords.value)
-        .where(RawRecords.email == email, RawRecords.data_type == "WeightRecord")
-        .order_by(RawRecords.time.desc())
-        .limit(1)
-    )
-    weight = last_weight_record.scalar_one_or_none()
+    age = user.age(today)
 
-    last_height_record = records_db_session.execute(
-        select(RawRecords.value)
-        .where(RawRecords.email == email, RawRecords.data_type == "HeightRecord")
-        .order_by(RawRecords.time.desc())
-        .limit(1)
-    )
-    height = last_height_record.scalar_one_or_none()
+    heart_rate = features["heart_rate_mean_30d"]
+    sleep_duration_hours = features["sleep_hours_mean_30d"]
+    physical_activity_mins_daily = features["physical_activity_mins_mean_30d"]
+    weight = features["weight_kg_last"]
+    height = features["height_m_last"]
 
     try:
         weight = float(weight)
         height = float(height)
         bmi = weight / (height**2)
     except Exception as e:
-        logger.error(f"Error during bmi calc: {e}")
-        return
+        raise InputError(f"Error during bmi calc: {e}")
 
     country = "Russia"
     required_fields = {
@@ -276,111 +193,244 @@ async def make_hypertension_predictions(
     }
     missing = [name for name, value in required_fields.items() if value is None]
     if missing:
-        logger.error(f"Missing required fields for ML input: {', '.join(missing)}")
-        return
+        raise InputError(f"Missing required fields for ML input: {', '.join(missing)}")
 
     gender = gender.capitalize()
-    input_data = {
+    resolution = INPUT_RESOLUTION["hypertension"]
+    return {
         "country": required_fields["country"],
         "age": required_fields["age"],
-        "bmi": required_fields["bmi"],
+        "bmi": quantize(required_fields["bmi"], resolution["bmi"]),
         "physical_activity_level": categorize_physical_activity(
             int(required_fields["physical_activity_level"])
         ),
-        "sleep_duration": float(required_fields["sleep_duration"]),
+        "sleep_duration": quantize(
+            float(required_fields["sleep_duration"]), resolution["sleep_duration"]
+        ),
         "heart_rate": int(required_fields["heart_rate"]),
         "gender": gender,
     }
 
+
+def build_depression_input(
+    user: UserDemographics, features: dict, today: date | None = None
+) -> dict:
+    heart_rate = features["heart_rate_mean_30d"]
+    sleep_duration = features["sleep_hours_mean_30d"]
+    daily_steps = features["daily_steps_mean_30d"]
+
+    required = {
+        "heart_rate": heart_rate,
+        "sleep_duration": sleep_duration,
+        "physical_activity_steps": daily_steps,
+    }
+    missing = [k for k, v in required.items() if v is None]
+    if missing:
+        raise InputError(
+            f"Missing required fields for depression model: {', '.join(missing)}"
+        )
+
+    resolution = INPUT_RESOLUTION["depression"]
+    return {
+        "heart_rate": int(heart_rate),
+        "sleep_duration": quantize(float(sleep_duration), resolution["sleep_duration"]),
+        "physical_activity_steps": quantize(
+            daily_steps, resolution["physical_activity_steps"]
+        ),
+    }
+
+
+async def publish_saved_prediction(row: dict):
+    try:
+        await publish_latest_predictions([row])
+    except Exception as e:
+        logger.error(f"failed to publish latest prediction to Redis: {e}")
+
+
+async def make_insomnia_apnea_predictions(
+    email: str, iteration: int, features: dict[str, float | None] | None = None
+):
+    with profile_stage("insomnia_apnea.demographics"):
+        user: UserDemographics | None = await run_stage(
+            "user_lookup",
+            users_db_limiter.run(
+                users_db_engine.in_session, get_user_demographics, email
+            ),
+        )
+    if user is None:
+        logger.error(f"User with email '{email}' not found in users database")
+        return
+
+    if features is None:
+        with profile_stage("insomnia_apnea.features"):
+            features = await run_stage(
+                "features",
+                compute_features(email, INSOMNIA_APNEA_FEATURES),
+            )
     try:
-        predictions = predict_hypertension(**input_data)
+        with profile_stage("insomnia_apnea.build_input"):
+            input_data = build_insomnia_apnea_input(user, features)
+    except InputError as e:
+        logger.error(str(e))
+        return
+
+    try:
+        with profile_stage("insomnia_apnea.predict"):
+            model = model_registry.get("insomnia_apnea")
+            predictions_json = await run_stage(
+                "inference",
+                prediction_memo.get_or_compute(
+                    "insomnia_apnea",
+                    model.version,
+                    tuple(input_data.model_dump().values()),
+                    lambda: predict_sleep_disorder(input_data, model).model_dump_json(),
+                ),
+            )
+            predictions = SleepDisorderOutput.model_validate_json(predictions_json)
     except Exception as e:
         logger.error(f"Error during prediction: {e}")
         return
 
     logger.info(f"predicted: {predictions}")
 
-    now = datetime.utcnow()
-    records = []
-
-    name = "hypertension"
-    result_value = predictions
-    rec = MLPredictionsRecords(
-        email=email,
-        result_value=result_value,
-        diagnosis_name=name,
-        iteration_num=iteration,
-        iteration_datetime=now,
-    )
-    records_db_session.add(rec)
-    records_db_session.commit()
-
-    logger.info(f"Committed {len(records)} ML predictions (hypertension) to DB")
+    with profile_stage("insomnia_apnea.save"):
+        row = await run_stage(
+            "persist",
+            records_db_limiter.run(
+                records_db_engine.in_session,
+                save_prediction,
+                email,
+                "insomnia_apnea",
+                iteration,
+                predictions.model_dump_json(),
+                model_version=model.version,
+            ),
+        )
+    logger.info("Committed 1 ML prediction (insomnia/apnea) to DB")
+    await publish_saved_prediction(row)
 
 
-async def make_depression_predictions(
-    records_db_session, users_db_session, email: str, iteration: int
+async def make_hypertension_predictions(
+    email: str, iteration: int, features: dict[str, float | None] | None = None
 ):
 
-    result = users_db_session.execute(select(Users).where(Users.email == email))
-    user: Users | None = result.scalar_one_or_none()
+    with profile_stage("hypertension.demographics"):
+        user: UserDemographics | None = await run_stage(
+            "user_lookup",
+            users_db_limiter.run(
+                users_db_engine.in_session, get_user_demographics, email
+            ),
+        )
     if user is None:
-        logger.error(f"User with email '{email}' not found")
+        logger.error(f"User with email '{email}' not found in users database")
         return
 
-    birth_date: date = user.birth_date.date()
-    today = date.today()
-    age = (
-        today.year
-        - birth_date.year
-        - ((today.month, today.day) < (birth_date.month, birth_date.day))
-    )
+    if features is None:
+        with profile_stage("hypertension.features"):
+            features = await run_stage(
+                "features",
+                compute_features(email, HYPERTENSION_FEATURES),
+            )
+    try:
+        with profile_stage("hypertension.build_input"):
+            input_data = build_hypertension_input(user, features)
+    except InputError as e:
+        logger.error(str(e))
+        return
 
-    heart_rate = await compute_avg_raw_records(
-        records_db_session, "HeartRateRecord", email
-    )
+    try:
+        with profile_stage("hypertension.predict"):
+            model = model_registry.get("hypertension")
+            predictions = await run_stage(
+                "inference",
+                prediction_memo.get_or_compute(
+                    "hypertension",
+                    model.version,
+                    tuple(input_data.values()),
+                    lambda: predict_hypertension(**input_data, model=model),
+                ),
+            )
+    except Exception as e:
+        logger.error(f"Error during prediction: {e}")
+        return
 
-    sleep_minutes = await compute_avg_processed_records(
-        records_db_session, "SleepSessionTimeData", email
-    )
-    sleep_duration = (sleep_minutes / 60) if sleep_minutes is not None else None
+    logger.info(f"predicted: {predictions}")
 
-    daily_steps = await compute_avg_processed_records(
-        records_db_session, "StepsRecord", email
-    )
+    with profile_stage("hypertension.save"):
+        row = await run_stage(
+            "persist",
+            records_db_limiter.run(
+                records_db_engine.in_session,
+                save_prediction,
+                email,
+                "hypertension",
+                iteration,
+                predictions,
+                model_version=model.version,
+            ),
+        )
+    logger.info("Committed 1 ML prediction (hypertension) to DB")
+    await publish_saved_prediction(row)
 
-    required = {
-        "heart_rate": heart_rate,
-        "sleep_duration": sleep_duration,
-        "physical_activity_steps": daily_steps,
-    }
-    missing = [k for k, v in required.items() if v is None]
-    if missing:
-        logger.error(
-            f"Missing required fields for depression model: {', '.join(missing)}"
+
+async def make_depression_predictions(
+    email: str, iteration: int, features: dict[str, float | None] | None = None
+):
+
+    with profile_stage("depression.demographics"):
+        user: UserDemographics | None = await run_stage(
+            "user_lookup",
+            users_db_limiter.run(
+                users_db_engine.in_session, get_user_demographics, email
+            ),
         )
+    if user is None:
+        logger.error(f"User with email '{email}' not found")
         return
 
+    if features is None:
+        with profile_stage("depression.features"):
+            features = await run_stage(
+                "features",
+                compute_features(email, DEPRESSION_FEATURES),
+            )
     try:
-        result_json = predict_depression(
-            heart_rate=int(heart_rate),
-            sleep_duration=float(sleep_duration),
-            physical_activity_steps=int(daily_steps),
-        )
+        with profile_stage("depression.build_input"):
+            input_data = build_depression_input(user, features)
+    except InputError as e:
+        logger.error(str(e))
+        return
+
+    try:
+        with profile_stage("depression.predict"):
+            model = model_registry.get("depression")
+            result_json = await run_stage(
+                "inference",
+                prediction_memo.get_or_compute(
+                    "depression",
+                    model.version,
+                    tuple(input_data.values()),
+                    lambda: predict_depression(**input_data, model=model),
+                ),
+            )
     except Exception as e:
         logger.error(f"Error during depression prediction: {e}")
         return
 
     logger.info(f"Depression prediction for {email}: {result_json}")
 
-    now = datetime.utcnow()
-    rec = MLPredictionsRecords(
-        email=email,
-        result_value=result_json,
-        diagnosis_name="depression",
-        iteration_num=iteration,
-        iteration_datetime=now,
-    )
-    records_db_session.add(rec)
-    records_db_session.commit()
+    with profile_stage("depression.save"):
+        row = await run_stage(
+            "persist",
+            records_db_limiter.run(
+                records_db_engine.in_session,
+                save_prediction,
+                email,
+                "depression",
+                iteration,
+                result_json,
+                model_version=model.version,
+            ),
+        )
     logger.info("Committed 1 ML prediction (depression) to DB")
+    await publish_saved_prediction(row)
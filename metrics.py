@@ -0,0 +1,76 @@
+"""Метрики текущего процесса: счётчики, гейджи и таймеры."""
+
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRegistry:
+    """
+    Потокобезопасный реестр метрик. Значения живут в памяти процесса
+    и выводятся в лог в конце запуска.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._timers: dict[str, list[float]] = {}
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            timer = self._timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timers": {
+                    name: {
+                        "count": count,
+                        "total_s": round(total, 6),
+                        "avg_s": round(total / count, 6) if count else 0.0,
+                        "max_s": round(max_s, 6),
+                    }
+                    for name, (count, total, max_s) in self._timers.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timers.clear()
+
+    def log_summary(self):
+        snapshot = self.snapshot()
+        for name, value in sorted(snapshot["counters"].items()):
+            logger.info(f"metric {name}={value}")
+        for name, value in sorted(snapshot["gauges"].items()):
+            logger.info(f"metric {name}={value}")
+        for name, timer in sorted(snapshot["timers"].items()):
+            logger.info(
+                f"metric {name}: count={timer['count']} avg={timer['avg_s']}s "
+                f"max={timer['max_s']}s total={timer['total_s']}s"
+            )
+
+
+metrics = MetricsRegistry()
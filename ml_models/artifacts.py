@@ -0,0 +1,72 @@
+import os
+from dataclasses import dataclass
+
+
+INSOMNIA_APNEA_MODEL_PATH = "./ml_models_files/insomnia_apnea.pkl"
+HYPERTENSION_MODEL_PATH = "./ml_models_files/hypertension.pkl"
+DEPRESSION_MODEL_PATH = "./ml_models_files/depression.pkl"
+
+
+def artifact_version(path: str) -> str:
+    """
+    Версия артефакта модели: размер и время изменения файла.
+    Меняется при любой перезаписи pickle-файла.
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    Что код ожидает от артефакта: порядок признаков, в котором predict_*
+    собирают матрицу, обязательные энкодеры в pickle и энкодер целевой
+    переменной, которым декодируются классы классификатора.
+    """
+
+    legacy_path: str
+    feature_order: tuple[str, ...]
+    encoders: tuple[str, ...]
+    target_encoder: str | None = None
+
+
+MODEL_SPECS = {
+    "insomnia_apnea": ModelSpec(
+        legacy_path=INSOMNIA_APNEA_MODEL_PATH,
+        feature_order=(
+            "gender",
+            "age",
+            "sleep_duration_hours",
+            "physical_activity_mins_daily",
+            "bmi_category",
+            "heart_rate",
+            "daily_steps",
+        ),
+        encoders=("sleep_encoder", "gender_encoder", "bmi_encoder"),
+        target_encoder="sleep_encoder",
+    ),
+    "hypertension": ModelSpec(
+        legacy_path=HYPERTENSION_MODEL_PATH,
+        feature_order=(
+            "country",
+            "age",
+            "bmi",
+            "physical_activity_level",
+            "sleep_duration",
+            "heart_rate",
+            "gender",
+        ),
+        encoders=(
+            "hypertension_encoder",
+            "physical_activity_level_encoder",
+            "gender_encoder",
+            "country_encoder",
+        ),
+        target_encoder="hypertension_encoder",
+    ),
+    "depression": ModelSpec(
+        legacy_path=DEPRESSION_MODEL_PATH,
+        feature_order=("heart_rate", "sleep_duration", "physical_activity_steps"),
+        encoders=(),
+    ),
+}
@@ -1,24 +1,48 @@
 import json
-import pickle
 import numpy as np
 
+from ml_models.registry import LoadedModel, model_registry
 
-def predict_depression(heart_rate, sleep_duration, physical_activity_steps):
+
+def predict_depression(
+    heart_rate, sleep_duration, physical_activity_steps, model: LoadedModel | None = None
+):
     """
     Предсказание наличия депрессии по входным данным:
     - heart_rate: пульс (int)
     - sleep_duration: продолжительность сна (float)
     - physical_activity_steps: количество шагов (int)
+    - model: загруженная версия модели (по умолчанию текущая из model_registry)
     Возвращает вероятности классов в формате JSON.
     """
-    with open("./ml_models_files/depression.pkl", "rb") as f:
-        data = pickle.load(f)
-        model = data["model"]
+    loaded = model or model_registry.get("depression")
 
     features = [heart_rate, sleep_duration, physical_activity_steps]
     sample = np.array(features).reshape(1, -1)
 
-    probas = model.named_steps["clf"].predict_proba(sample)[0]
-    class_labels = model.named_steps["clf"].classes_
-    result = {int(label): float(prob) for label, prob in zip(class_labels, probas)}
+    probas = loaded.artifact["model"].named_steps["clf"].predict_proba(sample)[0]
+    result = {
+        int(label): float(prob) for label, prob in zip(loaded.class_names, probas)
+    }
     return json.dumps(result, ensure_ascii=False)
+
+
+def predict_depression_batch(rows, model: LoadedModel | None = None):
+    """
+    Пакетное предсказание депрессии.
+    rows — последовательность кортежей (heart_rate, sleep_duration, physical_activity_steps).
+    Возвращает список JSON с вероятностями классов, по одному на строку.
+    """
+    loaded = model or model_registry.get("depression")
+
+    samples = np.array(rows, dtype=float).reshape(-1, 3)
+
+    probas = loaded.artifact["model"].named_steps["clf"].predict_proba(samples)
+    class_labels = [int(label) for label in loaded.class_names]
+    return [
+        json.dumps(
+            {label: float(prob) for label, prob in zip(class_labels, row)},
+            ensure_ascii=False,
+        )
+        for row in probas
+    ]
@@ -0,0 +1,50 @@
+"""
+LabelEncoder, заранее развёрнутый в таблицы поиска: словарь для одной
+строки и отсортированный массив классов для пакетов.
+"""
+
+import numpy as np
+
+
+class CompiledEncoder:
+    """
+    Кодирует так же, как LabelEncoder.transform, включая приведение входа
+    к типу classes_ (строки фиксированной ширины <U обрезаются) и ошибку
+    "y contains previously unseen labels: ..." для неизвестной категории.
+    """
+
+    __slots__ = ("classes", "codes", "width")
+
+    def __init__(self, encoder):
+        self.classes = encoder.classes_
+        self.codes = {value: code for code, value in enumerate(self.classes.tolist())}
+        self.width = self.classes.dtype.itemsize // 4 if self.classes.dtype.kind == "U" else None
+
+    def _unseen(self, value) -> ValueError:
+        if self.width is not None:
+            value = np.str_(value)
+        return ValueError(f"y contains previously unseen labels: {KeyError(value)}")
+
+    def encode(self, value) -> int:
+        if self.width is not None:
+            value = str(value)[: self.width]
+        code = self.codes.get(value)
+        if code is None:
+            raise self._unseen(value)
+        return code
+
+    def encode_many(self, values) -> np.ndarray:
+        values = np.asarray(values, dtype=self.classes.dtype)
+        if values.size == 0:
+            return np.empty(0, dtype=np.int64)
+        try:
+            positions = np.searchsorted(self.classes, values)
+        except TypeError:
+            # несравнимые значения в object-массиве (например, None среди строк)
+            return np.fromiter(
+                (self.encode(value) for value in values), dtype=np.int64, count=values.size
+            )
+        unknown = self.classes[np.minimum(positions, self.classes.size - 1)] != values
+        if unknown.any():
+            raise self._unseen(values[np.argmax(unknown)])
+        return positions
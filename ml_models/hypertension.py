@@ -1,44 +1,84 @@
 import json
-import pickle
 import numpy as np
 
+from ml_models.registry import LoadedModel, model_registry
+
 
 def predict_hypertension(
-    country, age, bmi, physical_activity_level, sleep_duration, heart_rate, gender
+    country,
+    age,
+    bmi,
+    physical_activity_level,
+    sleep_duration,
+    heart_rate,
+    gender,
+    model: LoadedModel | None = None,
 ):
     """
     Предсказание наличия гипертонии по неэнкодированным входным данным.
+    model — загруженная версия модели (по умолчанию текущая из model_registry).
     Возвращает вероятности классов в формате JSON.
     """
-    with open("./ml_models_files/hypertension.pkl", "rb") as f:
-        data = pickle.load(f)
-        model = data["model"]
-        hypertension_encoder = data["hypertension_encoder"]
-        physical_activity_level_encoder = data["physical_activity_level_encoder"]
-        gender_encoder = data["gender_encoder"]
-        country_encoder = data["country_encoder"]
-
-    country_enc = country_encoder.transform([country])[0]
-    physical_activity_enc = physical_activity_level_encoder.transform(
-        [physical_activity_level]
-    )[0]
-    gender_enc = gender_encoder.transform([gender])[0]
+    loaded = model or model_registry.get("hypertension")
+    encoders = loaded.encoders
 
     features = [
-        country_enc,
+        encoders["country_encoder"].encode(country),
         age,
         bmi,
-        physical_activity_enc,
+        encoders["physical_activity_level_encoder"].encode(physical_activity_level),
         sleep_duration,
         heart_rate,
-        gender_enc,
+        encoders["gender_encoder"].encode(gender),
     ]
     sample = np.array(features).reshape(1, -1)
 
-    probas = model.named_steps["clf"].predict_proba(sample)[0]
-    class_labels = model.named_steps["clf"].classes_
-    diagnosis_names = hypertension_encoder.inverse_transform(class_labels)
+    probas = loaded.artifact["model"].named_steps["clf"].predict_proba(sample)[0]
     result = {
-        diagnosis: float(prob) for diagnosis, prob in zip(diagnosis_names, probas)
+        diagnosis: float(prob)
+        for diagnosis, prob in zip(loaded.class_names, probas)
     }
     return json.dumps(result, ensure_ascii=False)
+
+
+def predict_hypertension_batch(rows, model: LoadedModel | None = None):
+    """
+    Пакетное предсказание гипертонии.
+    rows — последовательность кортежей в порядке аргументов predict_hypertension.
+    Возвращает список JSON с вероятностями классов, по одному на строку.
+    """
+    loaded = model or model_registry.get("hypertension")
+    encoders = loaded.encoders
+
+    (
+        country,
+        age,
+        bmi,
+        physical_activity_level,
+        sleep_duration,
+        heart_rate,
+        gender,
+    ) = (list(column) for column in zip(*rows))
+
+    samples = np.column_stack(
+        [
+            encoders["country_encoder"].encode_many(country),
+            age,
+            bmi,
+            encoders["physical_activity_level_encoder"].encode_many(
+                physical_activity_level
+            ),
+            sleep_duration,
+            heart_rate,
+            encoders["gender_encoder"].encode_many(gender),
+        ]
+    ).astype(float)
+
+    probas = loaded.artifact["model"].named_steps["clf"].predict_proba(samples)
+    return [
+        json.dumps(
+            {diagnosis: float(prob) for diagnosis, prob in zip(loaded.class_names, row)},
+            ensure_ascii=False,
+        )
+        for row in probas
+    ]
@@ -1,24 +1,24 @@
-import pickle
 import numpy as np
+
+from ml_models.registry import LoadedModel, model_registry
 from models import SleepDisorderInput, SleepDisorderOutput
 
 
-def predict_sleep_disorder(input_data: SleepDisorderInput) -> SleepDisorderOutput:
+def predict_sleep_disorder(
+    input_data: SleepDisorderInput, model: LoadedModel | None = None
+) -> SleepDisorderOutput:
     """
     Predict sleep disorder probabilities using a pre-trained model.
 
     :param input_data: SleepDisorderInput Pydantic model instance
+    :param model: loaded model version, defaults to the current one in model_registry
     :return: SleepDisorderOutput Pydantic model instance with probabilities
     """
-    with open("./ml_models_files/insomnia_apnea.pkl", "rb") as f:
-        data = pickle.load(f)
-        pipeline = data["model"]
-        sleep_encoder = data["sleep_encoder"]
-        gender_encoder = data.get("gender_encoder")
-        bmi_encoder = data.get("bmi_encoder")
+    loaded = model or model_registry.get("insomnia_apnea")
+    pipeline = loaded.artifact["model"]
 
-    gender_code = gender_encoder.transform([input_data.gender])[0]
-    bmi_code = bmi_encoder.transform([input_data.bmi_category])[0]
+    gender_code = loaded.encoders["gender_encoder"].encode(input_data.gender)
+    bmi_code = loaded.encoders["bmi_encoder"].encode(input_data.bmi_category)
 
     age = input_data.age
     sleep_duration = input_data.sleep_duration_hours
@@ -44,11 +44,54 @@ def predict_sleep_disorder(input_data: SleepDisorderInput) -> SleepDisorderOutpu
 
     classifier = pipeline.named_steps["clf"]
     probabilities = classifier.predict_proba(sample)[0]
-    class_labels = classifier.classes_
-    diagnosis_names = sleep_encoder.inverse_transform(class_labels)
 
     result_dict = {
         str(name).replace(" ", "_"): float(prob)
-        for name, prob in zip(diagnosis_names, probabilities)
+        for name, prob in zip(loaded.class_names, probabilities)
     }
     return SleepDisorderOutput.model_validate(result_dict)
+
+
+def predict_sleep_disorder_batch(
+    rows, model: LoadedModel | None = None
+) -> list[SleepDisorderOutput]:
+    """
+    Batch variant of predict_sleep_disorder.
+
+    :param rows: tuples in SleepDisorderInput field order
+    :return: SleepDisorderOutput per row
+    """
+    loaded = model or model_registry.get("insomnia_apnea")
+    pipeline = loaded.artifact["model"]
+
+    (
+        gender,
+        age,
+        sleep_duration,
+        physical_activity,
+        bmi_category,
+        heart_rate,
+        daily_steps,
+    ) = (list(column) for column in zip(*rows))
+
+    samples = np.column_stack(
+        [
+            loaded.encoders["gender_encoder"].encode_many(gender),
+            age,
+            sleep_duration,
+            np.asarray(physical_activity, dtype=float),
+            loaded.encoders["bmi_encoder"].encode_many(bmi_category),
+            heart_rate,
+            daily_steps,
+        ]
+    ).astype(float)
+
+    classifier = pipeline.named_steps["clf"]
+    probabilities = classifier.predict_proba(samples)
+    diagnosis_names = [str(name).replace(" ", "_") for name in loaded.class_names]
+    return [
+        SleepDisorderOutput.model_validate(
+            {name: float(prob) for name, prob in zip(diagnosis_names, row)}
+        )
+        for row in probabilities
+    ]
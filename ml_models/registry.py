@@ -0,0 +1,236 @@
+"""
+Версионированные артефакты моделей и их горячая перезагрузка.
+
+Манифест `<MODELS_DIR>/manifest.json`:
+
+    {"models": {"depression": {"version": "2025-06-01",
+                               "path": "depression/2025-06-01.pkl",
+                               "sha256": "...",
+                               "feature_order": [...],
+                               "encoders": [...]}}}
+
+Модель без записи в манифесте читается по старому фиксированному пути
+(ml_models.artifacts), версия — "legacy-<размер>-<mtime>".
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+from dataclasses import dataclass
+
+from metrics import metrics
+from settings import settings
+
+from ml_models.artifacts import MODEL_SPECS, artifact_version
+from ml_models.encoders import CompiledEncoder
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+
+class ArtifactError(ValueError):
+    """Артефакт не совпадает с манифестом или с ожиданиями кода."""
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    """
+    Артефакт с подготовленными при загрузке таблицами: энкодеры признаков
+    (CompiledEncoder) и декодированные имена классов классификатора.
+    """
+
+    name: str
+    version: str
+    sha256: str
+    path: str
+    artifact: dict
+    encoders: dict[str, CompiledEncoder]
+    class_names: tuple
+
+
+def compile_artifact(name: str, artifact: dict) -> tuple[dict, tuple]:
+    spec = MODEL_SPECS[name]
+    encoders = {key: CompiledEncoder(artifact[key]) for key in spec.encoders}
+    class_labels = artifact["model"].named_steps["clf"].classes_
+    if spec.target_encoder is not None:
+        class_labels = artifact[spec.target_encoder].inverse_transform(class_labels)
+    return encoders, tuple(class_labels.tolist())
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Загруженные модели процесса. get() отдаёт текущую LoadedModel;
+    вызывающий код берёт её один раз на вызов/пакет и работает с ней до конца,
+    поэтому замена модели не затрагивает уже начатую работу.
+    reload() загружает новые версии и подменяет ссылку в словаре одной операцией;
+    start_auto_reload() делает это в фоновом потоке.
+    """
+
+    def __init__(self, models_dir: str = settings.MODELS_DIR):
+        self.models_dir = models_dir
+        self.manifest_path = os.path.join(models_dir, MANIFEST_NAME)
+        self._models: dict[str, LoadedModel] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reloader: threading.Thread | None = None
+
+    def read_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {"models": {}}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _resolve(self, name: str, manifest: dict) -> tuple[str, str, str | None]:
+        """(версия, путь, ожидаемый sha256) для модели по манифесту или старому пути."""
+        spec = MODEL_SPECS[name]
+        entry = manifest.get("models", {}).get(name)
+        if entry is None:
+            return f"legacy-{artifact_version(spec.legacy_path)}", spec.legacy_path, None
+
+        if tuple(entry.get("feature_order", ())) != spec.feature_order:
+            raise ArtifactError(
+                f"{name} {entry['version']}: feature order {entry.get('feature_order')} "
+                f"does not match {list(spec.feature_order)}"
+            )
+        # набор энкодеров манифеста сверяется с кодом здесь, а с ключами
+        # артефакта — при загрузке (_load)
+        if sorted(entry.get("encoders", ())) != sorted(spec.encoders):
+            raise ArtifactError(
+                f"{name} {entry['version']}: encoders {entry.get('encoders')} "
+                f"do not match {list(spec.encoders)}"
+            )
+        return entry["version"], os.path.join(self.models_dir, entry["path"]), entry["sha256"]
+
+    def _load(self, name: str, version: str, path: str, sha256: str | None) -> LoadedModel:
+        with open(path, "rb") as f:
+            payload = f.read()
+        digest = hashlib.sha256(payload).hexdigest()
+        if sha256 is not None and digest != sha256:
+            raise ArtifactError(f"{name} {version}: checksum mismatch for {path}")
+
+        artifact = pickle.loads(payload)
+        missing = [key for key in ("model", *MODEL_SPECS[name].encoders) if key not in artifact]
+        if missing:
+            raise ArtifactError(f"{name} {version}: missing {', '.join(missing)} in {path}")
+
+        encoders, class_names = compile_artifact(name, artifact)
+        metrics.incr(f"model_registry.{name}.loads")
+        logger.info(f"loaded model {name} version {version}")
+        return LoadedModel(name, version, digest, path, artifact, encoders, class_names)
+
+    def get(self, name: str) -> LoadedModel:
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._load(name, *self._resolve(name, self.read_manifest()))
+                    self._models[name] = model
+        return model
+
+    def version(self, name: str) -> str:
+        return self.get(name).version
+
+    def reload(self) -> list[str]:
+        """
+        Подгрузить изменившиеся версии уже используемых моделей.
+        Ошибка загрузки оставляет в работе прежнюю версию.
+        """
+        manifest = self.read_manifest()
+        swapped = []
+        for name, current in list(self._models.items()):
+            try:
+                version, path, sha256 = self._resolve(name, manifest)
+                if version == current.version:
+                    continue
+                model = self._load(name, version, path, sha256)
+            except Exception as e:
+                metrics.incr(f"model_registry.{name}.reload_errors")
+                logger.error(f"keeping {name} {current.version}: {e}")
+                continue
+            self._models[name] = model
+            swapped.append(name)
+            logger.info(f"switched {name}: {current.version} -> {model.version}")
+        return swapped
+
+    def start_auto_reload(self, interval_s: float = settings.MODEL_RELOAD_INTERVAL_SECONDS):
+        if self._reloader is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval_s):
+                self.reload()
+
+        self._reloader = threading.Thread(target=loop, name="model-reloader", daemon=True)
+        self._reloader.start()
+
+    def stop_auto_reload(self):
+        self._stop.set()
+        if self._reloader is not None:
+            self._reloader.join()
+            self._reloader = None
+
+    def publish(self, name: str, source_path: str, version: str) -> dict:
+        """
+        Скопировать артефакт в <models_dir>/<name>/<version>.pkl и атомарно
+        (через временный файл и os.replace) обновить манифест.
+        """
+        spec = MODEL_SPECS[name]
+        relative_path = os.path.join(name, f"{version}.pkl")
+        target_path = os.path.join(self.models_dir, relative_path)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.copyfile(source_path, target_path)
+
+        entry = {
+            "version": version,
+            "path": relative_path,
+            "sha256": file_sha256(target_path),
+            "feature_order": list(spec.feature_order),
+            "encoders": list(spec.encoders),
+        }
+        self._load(name, version, target_path, entry["sha256"])
+
+        manifest = self.read_manifest()
+        manifest.setdefault("models", {})[name] = entry
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+        return entry
+
+
+model_registry = ModelRegistry()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage versioned model artifacts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    publish = subparsers.add_parser("publish", help="Add a new model version")
+    publish.add_argument("name", choices=list(MODEL_SPECS))
+    publish.add_argument("path", help="Path to the new .pkl artifact")
+    publish.add_argument("--version", required=True)
+    subparsers.add_parser("show", help="Print the manifest")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        entry = model_registry.publish(args.name, args.path, args.version)
+        logger.info(f"published {args.name} {entry['version']} ({entry['sha256']})")
+    else:
+        print(json.dumps(model_registry.read_manifest(), indent=2, ensure_ascii=False))
@@ -1,8 +1,10 @@
+import asyncio
 import datetime
 from typing import List, Optional
 
 import httpx
 from pydantic import BaseModel
+from circuit_breaker import CircuitBreaker
 from settings import settings
 
 
@@ -20,16 +22,26 @@ class Notification(BaseModel):
     checked: bool
 
 
+def is_service_failure(error: BaseException) -> bool:
+    """Сбой сервиса (сеть, таймаут, 5xx, отмена по сроку этапа), а не ошибка запроса."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.CancelledError))
+
+
 class NotificationsAPIClient:
     """
     Асинхронный клиент для работы с Notifications API.
+    Все запросы идут через circuit breaker: после серии сбоев вызовы
+    сразу получают CircuitOpenError, не дожидаясь таймаута.
     """
 
     def __init__(
         self,
         base_url: str = settings.NOTIFICATIONS_API_BASE_URL,
         token: Optional[str] = None,
-        timeout: float = 10.0,
+        timeout: float = settings.NOTIFICATIONS_API_TIMEOUT_SECONDS,
+        breaker: CircuitBreaker | None = None,
     ):
         self.base_url = base_url.rstrip("/")
         self._headers = {}
@@ -40,6 +52,20 @@ class NotificationsAPIClient:
             headers=self._headers,
             timeout=timeout,
         )
+        self.breaker = breaker or CircuitBreaker(
+            "notifications_api",
+            failure_threshold=settings.NOTIFICATIONS_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout_s=settings.NOTIFICATIONS_BREAKER_RESET_SECONDS,
+            is_failure=is_service_failure,
+        )
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        async def send():
+            resp = await self._client.request(method, url, **kwargs)
+            resp.raise_for_status()
+            return resp
+
+        return await self.breaker.call(send)
 
     async def send_email(
         self,
@@ -53,8 +79,7 @@ class NotificationsAPIClient:
         payload = EmailNotificationRequest(
             to_email=to_email, subject=subject, message=message
         ).dict()
-        resp = await self._client.post("/send_email", json=payload)
-        resp.raise_for_status()
+        resp = await self._request("POST", "/send_email", json=payload)
         return resp.json()
 
     async def get_unchecked_notifications(self) -> List[Notification]:
@@ -62,8 +87,7 @@ class NotificationsAPIClient:
         Получить все непрочитанные уведомления текущего пользователя
         и одновременно пометить их как прочитанные.
         """
-        resp = await self._client.get("/get_unchecked_notifications")
-        resp.raise_for_status()
+        resp = await self._request("GET", "/get_unchecked_notifications")
         data = resp.json()
         return [Notification.parse_obj(item) for item in data]
 
@@ -71,8 +95,7 @@ class NotificationsAPIClient:
         """
         Получить все уведомления текущего пользователя (прочитанные и нет).
         """
-        resp = await self._client.get("/get_all_notifications")
-        resp.raise_for_status()
+        resp = await self._request("GET", "/get_all_notifications")
         data = resp.json()
         return [Notification.parse_obj(item) for item in data]
 
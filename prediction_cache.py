@@ -0,0 +1,136 @@
+"""Мемоизация результатов моделей по закодированному вектору признаков."""
+
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import Callable
+
+from metrics import metrics
+from redis import redis_client
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("off", "memory", "redis")
+
+
+class PredictionMemo:
+    """
+    LRU-кэш результатов predict_proba. Ключ — имя модели, её версия
+    и кортеж входных признаков, округлённых до разрешения модели
+    (make_predictions_funcs.INPUT_RESOLUTION): модель считает тот же
+    округлённый вход, поэтому результат точно соответствует ключу.
+    В режиме "redis" локальный LRU дополняется общим кэшем в Redis с TTL.
+    compute() выполняется в пуле потоков (offload), чтобы срок этапа
+    инференса мог прервать ожидание и не блокировал цикл событий.
+    """
+
+    def __init__(
+        self,
+        backend: str = settings.PREDICTION_CACHE_BACKEND,
+        max_size: int = settings.PREDICTION_CACHE_MAX_SIZE,
+        ttl_seconds: int = settings.PREDICTION_CACHE_TTL_SECONDS,
+        namespace: str = settings.REDIS_ML_PREDICTIONS_CACHE_NAMESPACE,
+        offload: bool = True,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {set(BACKENDS)}")
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.namespace = namespace
+        self.offload = offload
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_name: str, model_version: str, features: tuple) -> str:
+        return f"{model_name}:{model_version}:{json.dumps(list(features))}"
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _remember(self, key: str, value: str):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            metrics.incr("prediction_cache.evictions")
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+            metrics.incr("prediction_cache.hits")
+        else:
+            self.misses += 1
+            metrics.incr("prediction_cache.misses")
+        metrics.set_gauge("prediction_cache.hit_ratio", round(self.hit_ratio, 4))
+
+    async def _redis_get(self, key: str) -> str | None:
+        try:
+            await redis_client.connect()
+            return await redis_client.get(self.namespace + key)
+        except Exception as e:
+            logger.warning(f"prediction cache redis get failed: {e}")
+            return None
+
+    async def _redis_set(self, key: str, value: str):
+        try:
+            await redis_client.set(self.namespace + key, value, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"prediction cache redis set failed: {e}")
+
+    async def _compute(self, compute: Callable[[], str]) -> str:
+        if self.offload:
+            return await asyncio.to_thread(compute)
+        return compute()
+
+    async def get_or_compute(
+        self,
+        model_name: str,
+        model_version: str,
+        features: tuple,
+        compute: Callable[[], str],
+    ) -> str:
+        """
+        Вернуть закэшированный JSON-результат модели или вычислить его через compute().
+        """
+        if self.backend == "off":
+            return await self._compute(compute)
+
+        key = self.make_key(model_name, model_version, features)
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self._record(hit=True)
+            return value
+
+        if self.backend == "redis":
+            value = await self._redis_get(key)
+            if value is not None:
+                self._remember(key, value)
+                self._record(hit=True)
+                return value
+
+        self._record(hit=False)
+        value = await self._compute(compute)
+        self._remember(key, value)
+        if self.backend == "redis":
+            await self._redis_set(key, value)
+        return value
+
+    def log_stats(self):
+        logger.info(
+            f"prediction cache ({self.backend}): hits={self.hits} misses={self.misses} "
+            f"evictions={self.evictions} hit_ratio={self.hit_ratio:.2%}"
+        )
+
+
+prediction_memo = PredictionMemo()
@@ -0,0 +1,266 @@
+"""
+Профилировщик SQL-запросов на событиях Engine: число, время и строки
+по отпечатку запроса с разбивкой по пользователю и диагнозу.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+_current_email: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "sql_profiler_email", default=None
+)
+_current_diagnosis: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "sql_profiler_diagnosis", default=None
+)
+_active_budgets: contextvars.ContextVar[tuple] = contextvars.ContextVar(
+    "sql_profiler_budgets", default=()
+)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\([^)]+\)s|%s|\?|(?<!:):\w+|\$\d+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Текст запроса без литералов и параметров: `IN (?, ?, ?)` -> `IN (...)`."""
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _PLACEHOLDER.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _PLACEHOLDER_LIST.sub("(...)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Внутри query_budget выполнено больше запросов, чем разрешено."""
+
+
+class QueryBudget:
+    def __init__(self, max_queries: int, label: str = ""):
+        self.max_queries = max_queries
+        self.label = label
+        self.count = 0
+        self.fingerprints: list[str] = []
+
+
+class QueryProfiler:
+    """
+    Статистика запросов в памяти процесса. Ключ — (БД, email, диагноз, отпечаток),
+    значение — [count, total_s, max_s, rows]. email и диагноз берутся из
+    query_scope(); контекст переносится и в потоки asyncio.to_thread.
+    Обработчики событий вешаются на движок только при включённом профилировщике
+    или внутри query_budget(), поэтому в обычном запуске накладных расходов нет.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        slow_query_seconds: float = 0.5,
+        report_path: str | None = None,
+        top_n: int = 20,
+    ):
+        self.enabled = enabled
+        self.slow_query_seconds = slow_query_seconds
+        self.report_path = report_path
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._stats: dict[tuple, list] = {}
+        self._engines: dict[str, Engine] = {}
+        self._attached: set[str] = set()
+        self._report_registered = False
+        if enabled:
+            self.enable()
+
+    def register_engine(self, name: str, engine: Engine):
+        self._engines[name] = engine
+        if self.enabled:
+            self._attach(name)
+
+    def enable(self):
+        self.enabled = True
+        for name in self._engines:
+            self._attach(name)
+        if not self._report_registered:
+            atexit.register(self.log_report)
+            self._report_registered = True
+
+    def _attach(self, name: str):
+        if name in self._attached:
+            return
+        engine = self._engines[name]
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("sql_profiler_started", []).append(time.perf_counter())
+
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info["sql_profiler_started"].pop()
+            self._record(name, statement, time.perf_counter() - started, cursor.rowcount)
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        self._attached.add(name)
+
+    def _record(self, db: str, statement: str, duration: float, rowcount: int):
+        statement_fingerprint = fingerprint(statement)
+        budgets = _active_budgets.get()
+        email = _current_email.get()
+        diagnosis = _current_diagnosis.get()
+
+        with self._lock:
+            for budget in budgets:
+                budget.count += 1
+                budget.fingerprints.append(statement_fingerprint)
+            if not self.enabled:
+                return
+            stats = self._stats.setdefault(
+                (db, email, diagnosis, statement_fingerprint), [0, 0.0, 0.0, 0]
+            )
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            stats[3] += max(rowcount, 0)
+
+        if duration >= self.slow_query_seconds:
+            logger.warning(
+                f"slow query {duration:.3f}s on {db} "
+                f"(email={email}, diagnosis={diagnosis}): {statement_fingerprint[:500]}"
+            )
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def report(self) -> dict:
+        """
+        Сводка: запросы по пользователям, по диагнозам и top_n отпечатков
+        по суммарному времени. rows — cursor.rowcount там, где драйвер его знает.
+        """
+        with self._lock:
+            items = [(key, list(value)) for key, value in self._stats.items()]
+
+        by_user: dict[str, dict] = {}
+        by_diagnosis: dict[str, dict] = {}
+        by_fingerprint: dict[tuple, list] = {}
+        for (db, email, diagnosis, statement_fingerprint), (count, total, max_s, rows) in items:
+            for group, key in ((by_user, email), (by_diagnosis, diagnosis)):
+                entry = group.setdefault(
+                    str(key), {"queries": 0, "total_s": 0.0, "rows": 0}
+                )
+                entry["queries"] += count
+                entry["total_s"] += total
+                entry["rows"] += rows
+            stats = by_fingerprint.setdefault((db, statement_fingerprint), [0, 0.0, 0.0, 0])
+            stats[0] += count
+            stats[1] += total
+            stats[2] = max(stats[2], max_s)
+            stats[3] += rows
+
+        top = sorted(by_fingerprint.items(), key=lambda item: item[1][1], reverse=True)
+        for group in (by_user, by_diagnosis):
+            for entry in group.values():
+                entry["total_s"] = round(entry["total_s"], 6)
+        return {
+            "queries": sum(stats[0] for _, stats in items),
+            "by_user": by_user,
+            "by_diagnosis": by_diagnosis,
+            "top_statements": [
+                {
+                    "db": db,
+                    "fingerprint": statement_fingerprint,
+                    "count": count,
+                    "total_s": round(total, 6),
+                    "max_s": round(max_s, 6),
+                    "rows": rows,
+                }
+                for (db, statement_fingerprint), (count, total, max_s, rows) in top[: self.top_n]
+            ],
+        }
+
+    def log_report(self):
+        if not self.enabled:
+            return
+        report = self.report()
+        logger.info(f"sql profiler: {report['queries']} queries")
+        for email, entry in sorted(report["by_user"].items()):
+            logger.info(
+                f"sql user {email}: {entry['queries']} queries, "
+                f"{entry['total_s']}s, {entry['rows']} rows"
+            )
+        for diagnosis, entry in sorted(report["by_diagnosis"].items()):
+            logger.info(
+                f"sql diagnosis {diagnosis}: {entry['queries']} queries, "
+                f"{entry['total_s']}s, {entry['rows']} rows"
+            )
+        for statement in report["top_statements"]:
+            logger.info(
+                f"sql {statement['db']} count={statement['count']} "
+                f"total={statement['total_s']}s max={statement['max_s']}s "
+                f"rows={statement['rows']}: {statement['fingerprint'][:200]}"
+            )
+        if self.report_path:
+            with open(self.report_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+query_profiler = QueryProfiler(
+    enabled=settings.SQL_PROFILER_ENABLED,
+    slow_query_seconds=settings.SQL_PROFILER_SLOW_QUERY_SECONDS,
+    report_path=settings.SQL_PROFILER_REPORT_PATH,
+    top_n=settings.SQL_PROFILER_TOP_N,
+)
+
+
+@contextmanager
+def query_scope(email: str | None = None, diagnosis: str | None = None):
+    """Отнести запросы внутри блока к пользователю и/или диагнозу."""
+    tokens = []
+    if email is not None:
+        tokens.append((_current_email, _current_email.set(email)))
+    if diagnosis is not None:
+        tokens.append((_current_diagnosis, _current_diagnosis.set(diagnosis)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+@contextmanager
+def query_budget(max_queries: int, label: str = ""):
+    """
+    Проверка числа обращений к БД в блоке:
+
+        with query_budget(4, "one user"):
+            asyncio.run(run.main(email))
+
+    Если запросов больше max_queries — QueryBudgetExceeded со списком отпечатков.
+    """
+    for name in query_profiler._engines:
+        query_profiler._attach(name)
+    budget = QueryBudget(max_queries, label)
+    token = _active_budgets.set(_active_budgets.get() + (budget,))
+    try:
+        yield budget
+    finally:
+        _active_budgets.reset(token)
+
+    if budget.count > max_queries:
+        statements = "\n  ".join(budget.fingerprints)
+        raise QueryBudgetExceeded(
+            f"{label or 'query budget'}: {budget.count} queries > {max_queries}\n  {statements}"
+        )
@@ -2,23 +2,82 @@ import logging
 from typing import Any
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import text
 
+from adaptive_limiter import AdaptiveLimiter
+from db_pool import engine_options, watch_statement_timeouts
+from db_replicas import ReplicaRouter, RoutingSession, replica_urls
+from query_profiler import query_profiler
+
 from .settings import settings
 
 logger = logging.getLogger("database")
 
 
+def _create_engine(name: str, url: str):
+    engine = create_engine(
+        url,
+        **engine_options(
+            name,
+            driver=make_url(url).drivername,
+            mode=settings.RECORDS_DB_POOL_MODE,
+            pool_size=settings.RECORDS_DB_POOL_SIZE,
+            max_overflow=settings.RECORDS_DB_MAX_OVERFLOW,
+            pool_timeout=settings.RECORDS_DB_POOL_TIMEOUT_SECONDS,
+            pool_recycle=settings.RECORDS_DB_POOL_RECYCLE_SECONDS,
+            pre_ping=settings.RECORDS_DB_POOL_PRE_PING,
+            statement_timeout_ms=settings.RECORDS_DB_STATEMENT_TIMEOUT_MS,
+        ),
+    )
+    watch_statement_timeouts(
+        engine,
+        name,
+        settings.RECORDS_DB_POOL_MODE,
+        settings.RECORDS_DB_STATEMENT_TIMEOUT_MS,
+    )
+    return engine
+
+
 class DbEngine:
     def __init__(self):
-        self.url = f"{settings.RECORDS_DB_ENGINE}://{settings.RECORDS_DB_USER}:{settings.RECORDS_DB_PASSWORD}@{settings.RECORDS_DB_HOST}:{settings.RECORDS_DB_PORT}/{settings.RECORDS_DB_NAME}"
-        self.engine = create_engine(self.url, pool_pre_ping=True)
-        self.session = sessionmaker(bind=self.engine)
+        self.url = (
+            settings.RECORDS_DB_URL
+            or f"{settings.RECORDS_DB_ENGINE}://{settings.RECORDS_DB_USER}:{settings.RECORDS_DB_PASSWORD}@{settings.RECORDS_DB_HOST}:{settings.RECORDS_DB_PORT}/{settings.RECORDS_DB_NAME}"
+        )
+        self.engine = _create_engine("records_db", self.url)
+        self.replica_engines = [
+            _create_engine(f"records_db_replica{idx}", url)
+            for idx, url in enumerate(replica_urls(settings.RECORDS_DB_REPLICA_URLS), 1)
+        ]
+        self.router = ReplicaRouter(
+            "records_db",
+            self.replica_engines,
+            max_lag_s=settings.RECORDS_DB_REPLICA_MAX_LAG_SECONDS,
+            lag_check_interval_s=settings.RECORDS_DB_REPLICA_LAG_CHECK_SECONDS,
+            retry_after_s=settings.RECORDS_DB_REPLICA_RETRY_SECONDS,
+        )
+        self.session = sessionmaker(
+            bind=self.engine, class_=RoutingSession, router=self.router
+        )
+
+    def pool_status(self) -> str:
+        return self.engine.pool.status()
 
     def create_session(self):
         return self.session(bind=self.engine)
 
+    def in_session(self, fn, *args, **kwargs):
+        """
+        fn(session, *args, **kwargs) в собственной короткой сессии. Для вызовов
+        в потоке: поток может пережить ожидающего (срок этапа), и общая сессия
+        не должна закрываться под ним.
+        """
+        with self.create_session() as session:
+            return fn(session, *args, **kwargs)
+
     def request(self, db_request: str | Any) -> list:
         with self.create_session() as session:
             session.begin()
@@ -33,6 +92,19 @@ class DbEngine:
 
 
 records_db_engine = DbEngine()
+query_profiler.register_engine("records_db", records_db_engine.engine)
+for _idx, _replica_engine in enumerate(records_db_engine.replica_engines, 1):
+    query_profiler.register_engine(f"records_db_replica{_idx}", _replica_engine)
+
+records_db_limiter = AdaptiveLimiter(
+    "records_db",
+    initial_limit=settings.RECORDS_DB_LIMITER_INITIAL,
+    min_limit=settings.RECORDS_DB_LIMITER_MIN,
+    max_limit=settings.RECORDS_DB_LIMITER_MAX,
+    latency_target_s=settings.RECORDS_DB_LIMITER_LATENCY_TARGET_SECONDS,
+    overload_errors=(OperationalError, PoolTimeoutError, TimeoutError),
+    offload=settings.RECORDS_DB_LIMITER_OFFLOAD,
+)
 
 
 async def db_engine_check():
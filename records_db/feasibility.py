@@ -0,0 +1,141 @@
+"""
+Проверка наличия обязательных данных до тяжёлых запросов признаков:
+один запрос EXISTS по списку пользователей вместо агрегаций по всем рядам.
+"""
+
+import argparse
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable
+
+from sqlalchemy import String, column, exists, literal, text, union_all, values
+from sqlalchemy.future import select
+
+from .outliers import not_outlier
+from .schemas import ProcessedRecords, RawRecords
+
+
+logger = logging.getLogger(__name__)
+
+RECORD_TABLES = {
+    "raw_records": RawRecords,
+    "processed_records": ProcessedRecords,
+}
+# пользователей в одном запросе; SQLite ограничивает UNION ALL 500 ветками
+FEASIBILITY_CHUNK_SIZE = 500
+
+
+@dataclass(frozen=True, order=True)
+class Requirement:
+    """Хотя бы одна запись data_type в table (за последние window_days, если задано)."""
+
+    table: str
+    data_type: str
+    window_days: int | None = None
+
+
+def cohort_values(emails: list[str], dialect_name: str):
+    """Список email как таблица в FROM: VALUES в PostgreSQL, UNION ALL в остальных СУБД."""
+    if dialect_name == "postgresql":
+        return values(column("email", String), name="cohort").data(
+            [(email,) for email in emails]
+        )
+    # SQLite не поддерживает список колонок у VALUES в FROM
+    return union_all(
+        *(select(literal(email, String).label("email")) for email in emails)
+    ).subquery("cohort")
+
+
+def feasibility_statement(
+    emails: list[str],
+    requirements: list[Requirement],
+    dialect_name: str,
+    as_of: date | None = None,
+    exclude_outliers: bool = False,
+):
+    """
+    SELECT email, EXISTS(...) AS r0, EXISTS(...) AS r1, ... FROM (VALUES ...) —
+    каждый EXISTS останавливается на первой подходящей записи
+    (индекс (email, data_type, time)).
+    """
+    cohort = cohort_values(emails, dialect_name)
+    until = None
+    if as_of is None:
+        as_of = date.today()
+    else:
+        until = datetime.combine(
+            as_of + timedelta(days=1), time.min, tzinfo=timezone.utc
+        )
+
+    columns = []
+    for i, requirement in enumerate(requirements):
+        model = RECORD_TABLES[requirement.table]
+        where = [
+            model.email == cohort.c.email,
+            model.data_type == requirement.data_type,
+        ]
+        if until is not None:
+            where.append(model.time < until)
+        if requirement.window_days is not None:
+            where.append(model.time >= as_of - timedelta(days=requirement.window_days))
+        if exclude_outliers:
+            where.append(not_outlier(requirement.table))
+        columns.append(exists().where(*where).label(f"r{i}"))
+    return select(cohort.c.email, *columns).execution_options(use_replica=True)
+
+
+def available_requirements(
+    session,
+    emails: Iterable[str],
+    requirements: Iterable[Requirement],
+    as_of: date | None = None,
+    exclude_outliers: bool = False,
+) -> dict[str, set[Requirement]]:
+    """email -> выполненные требования; пачками по FEASIBILITY_CHUNK_SIZE пользователей."""
+    emails = sorted(set(emails))
+    requirements = sorted(set(requirements))
+    available = {email: set() for email in emails}
+    if not requirements:
+        return available
+
+    dialect_name = session.get_bind().dialect.name
+    for start in range(0, len(emails), FEASIBILITY_CHUNK_SIZE):
+        chunk = emails[start : start + FEASIBILITY_CHUNK_SIZE]
+        result = session.execute(
+            feasibility_statement(
+                chunk, requirements, dialect_name, as_of, exclude_outliers
+            )
+        )
+        for email, *flags in result:
+            available[email].update(
+                requirement
+                for requirement, present in zip(requirements, flags)
+                if present
+            )
+    return available
+
+
+def ensure_feasibility_indexes(engine):
+    """Индексы (email, data_type, time): EXISTS по паре — один поиск по индексу."""
+    with engine.begin() as conn:
+        for table in RECORD_TABLES:
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_email_data_type_time "
+                    f"ON {table} (email, data_type, time)"
+                )
+            )
+
+
+if __name__ == "__main__":
+    from .engine import records_db_engine
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage feasibility lookup indexes.")
+    parser.add_argument("--migrate", action="store_true", help="Create missing indexes")
+    args = parser.parse_args()
+
+    if args.migrate:
+        ensure_feasibility_indexes(records_db_engine.engine)
+        logger.info("feasibility indexes are up to date")
@@ -0,0 +1,79 @@
+"""Исключение выбросов из запросов признаков (последняя итерация поиска выбросов)."""
+
+import argparse
+import logging
+
+from sqlalchemy import exists, func, text
+from sqlalchemy.future import select
+
+from .schemas import (
+    OutliersRecords,
+    ProcessedRecords,
+    ProcessedRecordsOutliersRecords,
+    RawRecords,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# таблица записей -> (модель записи, таблица выбросов, ссылка на запись)
+OUTLIER_TABLES = {
+    "raw_records": (RawRecords, OutliersRecords, OutliersRecords.raw_record_id),
+    "processed_records": (
+        ProcessedRecords,
+        ProcessedRecordsOutliersRecords,
+        ProcessedRecordsOutliersRecords.processed_record_id,
+    ),
+}
+
+
+def latest_outliers_iteration(table: str):
+    """Номер последней итерации поиска выбросов (скалярный подзапрос)."""
+    _, outliers, _ = OUTLIER_TABLES[table]
+    return select(func.max(outliers.outliers_search_iteration_num)).scalar_subquery()
+
+
+def not_outlier(table: str):
+    """
+    Условие NOT EXISTS для WHERE: запись не отмечена выбросом в последней
+    итерации. Планировщик выполняет его как anti-join по индексу
+    (outliers_search_iteration_num, <record>_id); пока поиск выбросов
+    не запускался, max() даёт NULL и ничего не исключается.
+    """
+    model, outliers, record_id = OUTLIER_TABLES[table]
+    return ~exists().where(
+        record_id == model.id,
+        outliers.outliers_search_iteration_num == latest_outliers_iteration(table),
+    )
+
+
+def ensure_outliers_indexes(engine):
+    """Индексы для max(итерации) и поиска записи внутри итерации."""
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_outliers_records_iteration_record "
+                "ON outliers_records (outliers_search_iteration_num, raw_record_id)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "ix_processed_records_outliers_records_iteration_record "
+                "ON processed_records_outliers_records "
+                "(outliers_search_iteration_num, processed_record_id)"
+            )
+        )
+
+
+if __name__ == "__main__":
+    from .engine import records_db_engine
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage outliers lookup indexes.")
+    parser.add_argument("--migrate", action="store_true", help="Create missing indexes")
+    args = parser.parse_args()
+
+    if args.migrate:
+        ensure_outliers_indexes(records_db_engine.engine)
+        logger.info("outliers indexes are up to date")
@@ -0,0 +1,339 @@
+"""Запись результатов моделей и таблица последних предсказаний."""
+
+import argparse
+import json
+import logging
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import func, insert, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.future import select
+
+from .schemas import (
+    Base,
+    LatestMLPredictions,
+    MLPredictionIterations,
+    MLPredictionsRecords,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_probabilities(result_value: str) -> dict | None:
+    try:
+        probabilities = json.loads(result_value)
+    except (TypeError, ValueError):
+        return None
+    return probabilities if isinstance(probabilities, dict) else None
+
+
+def prediction_row(
+    email: str,
+    diagnosis_name: str,
+    iteration_num: int,
+    result_value: str,
+    iteration_datetime: datetime | None = None,
+    model_version: str | None = None,
+) -> dict:
+    return {
+        "email": email,
+        "diagnosis_name": diagnosis_name,
+        "iteration_num": iteration_num,
+        "iteration_datetime": iteration_datetime or datetime.utcnow(),
+        "result_value": result_value,
+        "result_probabilities": parse_probabilities(result_value),
+        "model_version": model_version,
+    }
+
+
+def _dialect_insert(table, dialect_name: str):
+    if dialect_name == "postgresql":
+        return postgresql.insert(table)
+    if dialect_name == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"upsert into {table.__tablename__} for {dialect_name}")
+
+
+def _upsert_statement(dialect_name: str):
+    stmt = _dialect_insert(LatestMLPredictions, dialect_name)
+    return stmt.on_conflict_do_update(
+        index_elements=[LatestMLPredictions.email, LatestMLPredictions.diagnosis_name],
+        set_={
+            "result_value": stmt.excluded.result_value,
+            "result_probabilities": stmt.excluded.result_probabilities,
+            "model_version": stmt.excluded.model_version,
+            "iteration_num": stmt.excluded.iteration_num,
+            "iteration_datetime": stmt.excluded.iteration_datetime,
+        },
+        where=LatestMLPredictions.iteration_datetime
+        <= stmt.excluded.iteration_datetime,
+    )
+
+
+def upsert_latest_predictions(session, rows: list[dict]):
+    """
+    Обновить latest_ml_predictions. Более старая по iteration_datetime
+    запись (например, из исторического пересчёта) не затирает новую.
+    """
+    latest = {}
+    for row in rows:
+        key = (row["email"], row["diagnosis_name"])
+        if key not in latest or latest[key]["iteration_datetime"] <= row["iteration_datetime"]:
+            latest[key] = row
+    if latest:
+        dialect_name = session.get_bind().dialect.name
+        session.execute(_upsert_statement(dialect_name), list(latest.values()))
+
+
+def save_predictions(session, rows: Iterable[dict]) -> list[dict]:
+    """
+    Сохранить строки prediction_row() в ml_predictions_records
+    и обновить latest_ml_predictions в той же транзакции.
+    """
+    rows = list(rows)
+    if not rows:
+        return rows
+    session.execute(insert(MLPredictionsRecords), rows)
+    upsert_latest_predictions(session, rows)
+    session.commit()
+    return rows
+
+
+def save_prediction(
+    session,
+    email: str,
+    diagnosis_name: str,
+    iteration_num: int,
+    result_value: str,
+    iteration_datetime: datetime | None = None,
+    model_version: str | None = None,
+) -> dict:
+    row = prediction_row(
+        email,
+        diagnosis_name,
+        iteration_num,
+        result_value,
+        iteration_datetime,
+        model_version,
+    )
+    save_predictions(session, [row])
+    return row
+
+
+def _allocate_statement(email: str, count: int, backfill: bool, dialect_name: str):
+    records = MLPredictionsRecords
+    # первая выдача продолжает уже записанную историю пользователя
+    live = func.coalesce(
+        select(func.max(records.iteration_num))
+        .where(records.email == email, records.iteration_num > 0)
+        .scalar_subquery(),
+        0,
+    )
+    past = func.coalesce(
+        select(func.min(records.iteration_num))
+        .where(records.email == email, records.iteration_num < 0)
+        .scalar_subquery(),
+        0,
+    )
+    counter = (
+        MLPredictionIterations.last_backfill_iteration
+        if backfill
+        else MLPredictionIterations.last_iteration
+    )
+    delta = -count if backfill else count
+    stmt = _dialect_insert(MLPredictionIterations, dialect_name).values(
+        email=email,
+        last_iteration=live if backfill else live + count,
+        last_backfill_iteration=past - count if backfill else past,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[MLPredictionIterations.email],
+        set_={counter.key: counter + delta},
+    ).returning(counter)
+
+
+def allocate_iterations(
+    session, counts: dict[str, int], backfill: bool = False
+) -> dict[str, list[int]]:
+    """
+    Выдать пользователям counts[email] новых номеров итераций. Номер берётся
+    обновлением строки ml_prediction_iterations (блокировка строки до commit),
+    поэтому параллельные запуски, когорты и пересчёты не получают одинаковых
+    номеров. Обычные запуски нумеруются 1, 2, ...; исторический пересчёт
+    (backfill=True) — -1, -2, ... по возрастанию дат внутри одной выдачи,
+    чтобы прошлые даты не обгоняли обычные итерации по max(iteration_num).
+    Сессия фиксируется сразу, чтобы блокировки не держались до записи результатов.
+    """
+    dialect_name = session.get_bind().dialect.name
+    allocated = {}
+    for email, count in counts.items():
+        if count <= 0:
+            continue
+        last = session.execute(
+            _allocate_statement(email, count, backfill, dialect_name)
+        ).scalar_one()
+        if backfill:
+            allocated[email] = list(range(last, last + count))
+        else:
+            allocated[email] = list(range(last - count + 1, last + 1))
+    session.commit()
+    return allocated
+
+
+def next_iteration_number(session, email: str) -> int:
+    return allocate_iterations(session, {email: 1})[email][0]
+
+
+def saved_diagnoses(session, email: str, iteration_num: int) -> set[str]:
+    """Диагнозы, уже записанные в данной итерации (для возобновления запуска)."""
+    result = session.execute(
+        select(MLPredictionsRecords.diagnosis_name)
+        .where(
+            MLPredictionsRecords.email == email,
+            MLPredictionsRecords.iteration_num == iteration_num,
+        )
+        .distinct()
+    )
+    return set(result.scalars())
+
+
+def recent_iteration(
+    session, email: str, since: datetime, until: datetime
+) -> int | None:
+    """Номер последнего обычного запуска пользователя с датой в [since, until]."""
+    result = session.execute(
+        select(func.max(MLPredictionsRecords.iteration_num)).where(
+            MLPredictionsRecords.email == email,
+            MLPredictionsRecords.iteration_num > 0,
+            MLPredictionsRecords.iteration_datetime.between(since, until),
+        )
+    )
+    return result.scalar()
+
+
+def get_latest_predictions(session, email: str) -> dict[str, LatestMLPredictions]:
+    """Текущие результаты пользователя по всем диагнозам — один поиск по первичному ключу."""
+    result = session.execute(
+        select(LatestMLPredictions).where(LatestMLPredictions.email == email)
+    )
+    return {row.diagnosis_name: row for row in result.scalars()}
+
+
+def get_latest_prediction(
+    session, email: str, diagnosis_name: str
+) -> LatestMLPredictions | None:
+    return session.get(LatestMLPredictions, (email, diagnosis_name))
+
+
+PREDICTION_TABLES = (MLPredictionsRecords, LatestMLPredictions, MLPredictionIterations)
+
+
+class PredictionsSchemaError(RuntimeError):
+    """В records_db не применена миграция таблиц предсказаний."""
+
+
+def missing_predictions_schema(engine) -> list[str]:
+    """Отсутствующие таблицы и колонки ("table" / "table.column"), которые пишет этот модуль."""
+    inspector = inspect(engine)
+    missing = []
+    for model in PREDICTION_TABLES:
+        table = model.__table__
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [
+            f"{table.name}.{column.name}"
+            for column in table.columns
+            if column.name not in existing
+        ]
+    return missing
+
+
+def check_predictions_schema(engine):
+    """
+    Проверка при старте: без миграции каждая запись предсказания падала бы
+    на отсутствующих колонках (result_probabilities, model_version) или таблицах.
+    """
+    missing = missing_predictions_schema(engine)
+    if missing:
+        raise PredictionsSchemaError(
+            f"records_db schema is outdated, missing: {', '.join(missing)}; "
+            "run `python -m records_db.predictions --migrate`"
+        )
+
+
+def ensure_predictions_schema(engine):
+    """
+    Создать latest_ml_predictions, ml_prediction_iterations, недостающие
+    колонки (result_probabilities, model_version) и индекс.
+    """
+    LatestMLPredictions.__table__.create(engine, checkfirst=True)
+    MLPredictionIterations.__table__.create(engine, checkfirst=True)
+    columns = [name for name in missing_predictions_schema(engine) if "." in name]
+    with engine.begin() as conn:
+        for name in columns:
+            table_name, column_name = name.split(".")
+            column = Base.metadata.tables[table_name].columns[column_name]
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(
+                text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+            )
+        if engine.dialect.name == "postgresql":
+            conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS "
+                    "ix_ml_predictions_records_email_diagnosis_iteration "
+                    "ON ml_predictions_records (email, diagnosis_name, iteration_num)"
+                )
+            )
+
+
+def rebuild_latest_predictions(engine):
+    """Заполнить latest_ml_predictions и result_probabilities по истории."""
+    if engine.dialect.name != "postgresql":
+        raise NotImplementedError("rebuild is implemented for PostgreSQL only")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "UPDATE ml_predictions_records "
+                "SET result_probabilities = result_value::jsonb "
+                "WHERE result_probabilities IS NULL AND result_value LIKE '{%'"
+            )
+        )
+        conn.execute(text("DELETE FROM latest_ml_predictions"))
+        conn.execute(
+            text(
+                "INSERT INTO latest_ml_predictions "
+                "(email, diagnosis_name, result_value, result_probabilities, "
+                "model_version, iteration_num, iteration_datetime) "
+                "SELECT DISTINCT ON (email, diagnosis_name) "
+                "email, diagnosis_name, result_value, result_probabilities, "
+                "model_version, iteration_num, iteration_datetime "
+                "FROM ml_predictions_records "
+                "ORDER BY email, diagnosis_name, iteration_datetime DESC, iteration_num DESC"
+            )
+        )
+
+
+if __name__ == "__main__":
+    from .engine import records_db_engine
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage ML predictions storage.")
+    parser.add_argument("--migrate", action="store_true", help="Create missing schema")
+    parser.add_argument(
+        "--rebuild-latest",
+        action="store_true",
+        help="Refill latest_ml_predictions from ml_predictions_records",
+    )
+    args = parser.parse_args()
+
+    if args.migrate:
+        ensure_predictions_schema(records_db_engine.engine)
+        logger.info("predictions schema is up to date")
+    if args.rebuild_latest:
+        rebuild_latest_predictions(records_db_engine.engine)
+        logger.info("latest_ml_predictions rebuilt")
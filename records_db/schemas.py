@@ -1,17 +1,22 @@
 
 from sqlalchemy import (
+    JSON,
     Column,
     Integer,
     String,
     DateTime,
     Text,
     ForeignKey,
+    Index,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base, relationship
 
 
 Base = declarative_base()
 
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 
 class RawRecords(Base):
     __tablename__ = "raw_records"
@@ -22,6 +27,10 @@ class RawRecords(Base):
     time = Column(DateTime(timezone=True), nullable=False, index=True)
     value = Column(Text, nullable=False)
 
+    __table_args__ = (
+        Index("ix_raw_records_email_data_type_time", "email", "data_type", "time"),
+    )
+
     def __repr__(self):
         return (
             f"<SampleRecord(id={self.id}, data_type={self.data_type.name}, "
@@ -40,6 +49,14 @@ class OutliersRecords(Base):
 
     raw_record = relationship("RawRecords", backref="outlier_record", uselist=False)
 
+    __table_args__ = (
+        Index(
+            "ix_outliers_records_iteration_record",
+            "outliers_search_iteration_num",
+            "raw_record_id",
+        ),
+    )
+
 
 class MLPredictionsRecords(Base):
     __tablename__ = "ml_predictions_records"
@@ -48,12 +65,54 @@ class MLPredictionsRecords(Base):
     email = Column(String, nullable=False)
 
     result_value = Column(Text, nullable=False)
+    result_probabilities = Column(JSONType, nullable=True)
     diagnosis_name = Column(Text, nullable=False)
+    model_version = Column(Text, nullable=True)
+
+    iteration_num = Column(Integer, nullable=False)
+    iteration_datetime = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_ml_predictions_records_email_diagnosis_iteration",
+            "email",
+            "diagnosis_name",
+            "iteration_num",
+        ),
+    )
+
+
+class LatestMLPredictions(Base):
+    """Последний результат по паре (email, diagnosis_name), обновляется при записи."""
+
+    __tablename__ = "latest_ml_predictions"
+
+    email = Column(String, primary_key=True)
+    diagnosis_name = Column(Text, primary_key=True)
+
+    result_value = Column(Text, nullable=False)
+    result_probabilities = Column(JSONType, nullable=True)
+    model_version = Column(Text, nullable=True)
 
     iteration_num = Column(Integer, nullable=False)
     iteration_datetime = Column(DateTime(timezone=True), nullable=False)
 
 
+class MLPredictionIterations(Base):
+    """
+    Счётчик номеров итераций пользователя: номера выдаются обновлением этой
+    строки (records_db.predictions.allocate_iterations), а не по max(iteration_num).
+    """
+
+    __tablename__ = "ml_prediction_iterations"
+
+    email = Column(String, primary_key=True)
+    # последний номер обычного запуска (1, 2, ...)
+    last_iteration = Column(Integer, nullable=False)
+    # последний номер исторического пересчёта (-1, -2, ...), 0 — ещё не было
+    last_backfill_iteration = Column(Integer, nullable=False)
+
+
 class ProcessedRecords(Base):
     __tablename__ = "processed_records"
 
@@ -63,6 +122,12 @@ class ProcessedRecords(Base):
     time = Column(DateTime(timezone=True), nullable=False, index=True)
     value = Column(Text, nullable=False)
 
+    __table_args__ = (
+        Index(
+            "ix_processed_records_email_data_type_time", "email", "data_type", "time"
+        ),
+    )
+
 
 class ProcessedRecordsOutliersRecords(Base):
     __tablename__ = "processed_records_outliers_records"
@@ -78,3 +143,11 @@ class ProcessedRecordsOutliersRecords(Base):
     processed_records = relationship(
         "ProcessedRecords", backref="processed_records_outliers_records", uselist=False
     )
+
+    __table_args__ = (
+        Index(
+            "ix_processed_records_outliers_records_iteration_record",
+            "outliers_search_iteration_num",
+            "processed_record_id",
+        ),
+    )
@@ -14,6 +14,32 @@ class DbSettings(BaseSettings):
     RECORDS_DB_USER: str | None = "postgres"
     RECORDS_DB_PASSWORD: str | None = "postgres"
     RECORDS_DB_NAME: str | None = "records"
+    # полный URL вместо полей выше (например, sqlite:///records.db для локальной проверки)
+    RECORDS_DB_URL: str | None = None
+
+    # реплики для читающих запросов признаков (URL через запятую, см. db_replicas.py);
+    # допустимое отставание должно быть меньше окна RECORDS_EVENTS_DEBOUNCE_SECONDS
+    RECORDS_DB_REPLICA_URLS: str | None = None
+    RECORDS_DB_REPLICA_MAX_LAG_SECONDS: float = 30
+    RECORDS_DB_REPLICA_LAG_CHECK_SECONDS: float = 5
+    RECORDS_DB_REPLICA_RETRY_SECONDS: float = 30
+
+    # queue / null / pgbouncer (см. db_pool.engine_options)
+    RECORDS_DB_POOL_MODE: str = "queue"
+    RECORDS_DB_POOL_SIZE: int = 5
+    RECORDS_DB_MAX_OVERFLOW: int = 10
+    RECORDS_DB_POOL_TIMEOUT_SECONDS: float = 30
+    RECORDS_DB_POOL_RECYCLE_SECONDS: int = 1800
+    RECORDS_DB_POOL_PRE_PING: bool = True
+    # отмена запросов дольше заданного времени (PostgreSQL), 0 — без ограничения
+    RECORDS_DB_STATEMENT_TIMEOUT_MS: int = 30000
+
+    # адаптивный лимит одновременных запросов (см. adaptive_limiter.py)
+    RECORDS_DB_LIMITER_INITIAL: int = 4
+    RECORDS_DB_LIMITER_MIN: int = 1
+    RECORDS_DB_LIMITER_MAX: int = 16
+    RECORDS_DB_LIMITER_LATENCY_TARGET_SECONDS: float = 0.5
+    RECORDS_DB_LIMITER_OFFLOAD: bool = True
 
     class Config:
         env_file = ".env"
@@ -1,7 +1,11 @@
-import aioredis
 import logging
+from typing import TYPE_CHECKING
+
 from settings import settings
 
+if TYPE_CHECKING:
+    import aioredis
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,6 +23,9 @@ class RedisClient:
         Подключение к Redis. Если клиент ещё не проинициализирован, создаём его.
         """
         if self._redis is None:
+            # импорт при подключении: запуски без Redis не требуют aioredis
+            import aioredis
+
             try:
                 self._redis = await aioredis.from_url(
                     f"redis://{settings.REDIS_HOST}",
@@ -53,4 +60,4 @@ class RedisClient:
         return f"<RedisClient connected={self._redis is not None}>"
 
 
-redis_client: aioredis.Redis = RedisClient()
+redis_client: "aioredis.Redis" = RedisClient()
@@ -3,19 +3,35 @@ import argparse
 import logging
 import re
 import sys
+import time
 from datetime import datetime
 
-from sqlalchemy.future import select
-from sqlalchemy import func
-
+from cohort import load_cohort_emails, run_cohort
+from cohort_priority import prioritize_cohort, write_deferred_report
+from deadlines import DB_STAGES, StageDeadlineExceeded, run_stage
+from metrics import metrics
+from ml_models.registry import model_registry
 from notifications import notifications_api
-from records_db.schemas import MLPredictionsRecords
+from prediction_cache import prediction_memo
+from query_profiler import query_scope
+from single_flight import single_flight
+from stage_profiler import profile_stage, stage_profiler
+from records_db.predictions import (
+    PredictionsSchemaError,
+    check_predictions_schema,
+    next_iteration_number,
+    saved_diagnoses,
+)
 from records_db.db_session import get_records_db_session
-from users_db.db_session import get_users_db_session
+from records_db.engine import records_db_engine, records_db_limiter
+from users_db.engine import users_db_limiter
 
 from settings import Settings
 
+from features import compute_features
 from make_predictions_funcs import (
+    feasible_diagnoses,
+    required_features,
     make_insomnia_apnea_predictions,
     make_hypertension_predictions,
     make_depression_predictions,
@@ -65,65 +81,268 @@ async def send_ml_completion_notification(
     logger.info("Sent ML completion notification email")
 
 
-async def main(email: str):
-    logger.info(f"launch for user {email}")
+DIAGNOSIS_STEPS = (
+    ("insomnia_apnea", make_insomnia_apnea_predictions),
+    ("hypertension", make_hypertension_predictions),
+    ("depression", make_depression_predictions),
+)
 
-    records_db_session = await get_records_db_session().__anext__()
-    users_db_session = await get_users_db_session().__anext__()
 
-    result = records_db_session.execute(
-        select(func.max(MLPredictionsRecords.iteration_num)).where(
-            MLPredictionsRecords.email == email
-        )
+async def main(
+    email: str,
+    iteration_number: int | None = None,
+    diagnoses: set[str] | None = None,
+) -> int | None:
+    """
+    Запуск всех диагнозов для пользователя. Если iteration_number передан
+    (возобновление когорты), уже записанные в этой итерации диагнозы пропускаются.
+    diagnoses — заранее проверенные выполнимые диагнозы (когорта); без него
+    проверка наличия данных выполняется для пользователя отдельно.
+    Параллельные запуски для одного email склеиваются (single_flight);
+    возвращается номер итерации.
+    """
+    return await single_flight.run(
+        email, lambda: run_for_user(email, iteration_number, diagnoses)
     )
-    max_iter = result.scalar() or 0
-    iteration_number = max_iter + 1
 
-    start_time = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
+
+async def run_for_user(
+    email: str,
+    iteration_number: int | None = None,
+    diagnoses: set[str] | None = None,
+) -> int:
+    logger.info(f"launch for user {email}")
+
+    # сессия только для коротких запросов в основном потоке; вызовы в потоках
+    # (со сроками этапов) открывают свои сессии и могут пережить этот запуск
+    records_db_session = await get_records_db_session().__anext__()
     try:
-        await send_ml_start_notification(email, iteration_number, start_time)
-    except Exception as e:
-        logger.error(f"failed to send notification: {e}")
+        with query_scope(email=email):
+            return await run_predictions(
+                records_db_session, email, iteration_number, diagnoses
+            )
+    finally:
+        records_db_session.close()
 
+
+async def check_user_feasibility(email: str) -> set[str]:
+    """
+    Выполнимые диагнозы пользователя; при ошибке проверки — все диагнозы.
+    Срок проверки истёк — records_db не успевает, и остальные запросы только
+    нагрузят её: StageDeadlineExceeded пробрасывается, запуск считается неудавшимся.
+    """
     try:
-        await make_insomnia_apnea_predictions(
-            records_db_session, users_db_session, email, iteration_number
+        feasible = await run_stage(
+            "feasibility",
+            records_db_limiter.run(
+                records_db_engine.in_session, feasible_diagnoses, [email]
+            ),
         )
+        return feasible[email]
+    except StageDeadlineExceeded as e:
+        logger.error(f"{e}; run for {email} failed")
+        raise
     except Exception as e:
-        logger.error(f"error during make_insomnia_apnea_predictions: {e}")
+        logger.error(f"feasibility check failed for {email}: {e}")
+        return {name for name, _ in DIAGNOSIS_STEPS}
 
-    try:
-        await make_hypertension_predictions(
-            records_db_session, users_db_session, email, iteration_number
+
+def check_cohort_feasibility(emails: list[str]) -> dict[str, set[str]]:
+    """Выполнимые диагнозы всей когорты — запросами EXISTS по пачкам пользователей."""
+    with records_db_engine.create_session() as session:
+        feasible = feasible_diagnoses(session, emails)
+    for name, _ in DIAGNOSIS_STEPS:
+        skipped = sum(name not in diagnoses for diagnoses in feasible.values())
+        logger.info(f"feasibility: {name} skipped for {skipped}/{len(emails)} users")
+    return feasible
+
+
+async def compute_run_features(
+    email: str, diagnoses: list[str]
+) -> dict[str, float | None] | None:
+    """
+    Признаки всех выполняемых диагнозов одним вызовом: общие ряды (пульс, сон, ...)
+    читаются один раз на запуск, а не для каждого диагноза. Ошибка пробрасывается:
+    без признаков запуск не выполняет ни одного диагноза и считается неудавшимся.
+    """
+    if not diagnoses:
+        return {}
+    with profile_stage("features"):
+        return await run_stage(
+            "features", compute_features(email, required_features(diagnoses))
         )
-    except Exception as e:
-        logger.error(f"error during make_hypertension_predictions: {e}")
 
+
+async def run_predictions(
+    records_db_session,
+    email: str,
+    iteration_number: int | None,
+    diagnoses: set[str] | None = None,
+) -> int:
+    done = set()
+    if iteration_number is None:
+        iteration_number = next_iteration_number(records_db_session, email)
+    else:
+        done = saved_diagnoses(records_db_session, email, iteration_number)
+
+    # проверки до письма о старте: неудавшийся запуск не шлёт уведомлений
+    if diagnoses is None:
+        diagnoses = await check_user_feasibility(email)
+    pending = [
+        name for name, _ in DIAGNOSIS_STEPS if name in diagnoses and name not in done
+    ]
+    features = await compute_run_features(email, pending)
+
+    start_time = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
     try:
-        await make_depression_predictions(
-            records_db_session, users_db_session, email, iteration_number
+        await run_stage(
+            "notify", send_ml_start_notification(email, iteration_number, start_time)
         )
     except Exception as e:
-        logger.error(f"error during make_depression_predictions: {e}")
+        logger.error(f"failed to send notification: {e}")
+
+    for diagnosis_name, make_predictions in DIAGNOSIS_STEPS:
+        if diagnosis_name in done:
+            logger.info(f"{diagnosis_name} already saved in iteration #{iteration_number}")
+            continue
+        if diagnosis_name not in diagnoses:
+            logger.info(f"{diagnosis_name} skipped for {email}: required data is missing")
+            metrics.incr(f"feasibility.{diagnosis_name}.skipped")
+            continue
+        try:
+            with query_scope(diagnosis=diagnosis_name):
+                await make_predictions(email, iteration_number, features)
+        except StageDeadlineExceeded as e:
+            logger.error(f"{diagnosis_name} for {email}: {e}")
+            if e.stage in DB_STAGES:
+                # БД не успевает: запрос ещё идёт в потоке (до statement timeout),
+                # остальные диагнозы пользователя только добавят нагрузки
+                logger.error(f"skipping remaining diagnoses for {email}")
+                break
+        except Exception as e:
+            logger.error(f"error during {make_predictions.__name__}: {e}")
 
     finish_time = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
     try:
-        await send_ml_completion_notification(
-            email, iteration_number, start_time, finish_time
+        await run_stage(
+            "notify",
+            send_ml_completion_notification(
+                email, iteration_number, start_time, finish_time
+            ),
         )
     except Exception as e:
         logger.error(f"failed to send notification: {e}")
+    return iteration_number
+
+
+def enable_profiling(output_dir: str):
+    """cProfile видит только основной поток: запросы к БД и модели выполняются в нём же."""
+    stage_profiler.enable(output_dir)
+    records_db_limiter.offload = False
+    users_db_limiter.offload = False
+    prediction_memo.offload = False
+
+
+def log_run_summary():
+    prediction_memo.log_stats()
+    metrics.log_summary()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate ML predictions for user.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("-e", "--email", help="Email address of the user")
+    target.add_argument(
+        "--cohort-file", help="Run for every email in the file (one per line)"
+    )
+    target.add_argument(
+        "--all-users", action="store_true", help="Run for every registered user"
+    )
+    parser.add_argument(
+        "--run-id",
+        help="Cohort run ID; reuse it to resume a crashed run from its checkpoint",
+    )
     parser.add_argument(
-        "-e", "--email", required=True, help="Email address of the user"
+        "--concurrency", type=int, default=1, help="Users processed at once"
+    )
+    parser.add_argument(
+        "--prioritize",
+        action="store_true",
+        help="Process never-predicted users, then those with most new data and "
+        "oldest predictions first",
+    )
+    parser.add_argument(
+        "--budget-minutes",
+        type=float,
+        help="Stop starting new users when the budget runs out (implies --prioritize)",
+    )
+    parser.add_argument(
+        "--deferred-report",
+        metavar="PATH",
+        help="Write users deferred by --budget-minutes to a JSON report",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Write per-stage pstats and collapsed stacks to DIR (forces concurrency 1)",
     )
     args = parser.parse_args()
 
-    if not EMAIL_REGEX.fullmatch(args.email):
-        logger.error(f"Invalid email format: {args.email}")
+    try:
+        check_predictions_schema(records_db_engine.engine)
+    except PredictionsSchemaError as e:
+        logger.error(str(e))
         sys.exit(1)
 
-    asyncio.run(main(args.email))
+    if args.profile:
+        enable_profiling(args.profile)
+        args.concurrency = 1
+
+    if args.email:
+        if not EMAIL_REGEX.fullmatch(args.email):
+            logger.error(f"Invalid email format: {args.email}")
+            sys.exit(1)
+        # разовый запуск из CLI не должен зависеть от Redis
+        single_flight.backend = settings.SINGLE_FLIGHT_CLI_BACKEND
+        try:
+            asyncio.run(main(args.email))
+        except Exception as e:
+            logger.error(f"run for {args.email} failed: {e}")
+            sys.exit(1)
+    else:
+        deadline = None
+        if args.budget_minutes:
+            deadline = time.monotonic() + args.budget_minutes * 60
+        emails = load_cohort_emails(args.cohort_file)
+        invalid = [email for email in emails if not EMAIL_REGEX.fullmatch(email)]
+        if invalid:
+            logger.error(f"Invalid email format: {', '.join(invalid)}")
+            sys.exit(1)
+        priorities = []
+        if args.prioritize or deadline is not None:
+            priorities = prioritize_cohort(emails)
+            emails = [priority.email for priority in priorities]
+        feasible = check_cohort_feasibility(emails)
+        # запуск когорты долгий: новые версии моделей подхватываются без перезапуска
+        model_registry.start_auto_reload()
+        result = asyncio.run(
+            run_cohort(
+                emails,
+                lambda email, iteration: main(email, iteration, feasible[email]),
+                args.run_id,
+                args.concurrency,
+                deadline,
+            )
+        )
+        if result.deferred:
+            logger.warning(
+                f"{len(result.deferred)} users deferred by the time budget, "
+                f"first: {', '.join(result.deferred[:10])}"
+            )
+            if args.deferred_report:
+                write_deferred_report(
+                    args.deferred_report, result.run_id, priorities, result.deferred
+                )
+
+    stage_profiler.finish()
+    log_run_summary()
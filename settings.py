@@ -15,6 +15,56 @@ class Settings(BaseSettings):
         "REDIS_DATA_COLLECTION_GOOGLE_FITNESS_API_PROGRESS_BAR_NAMESPACE-"
     )
 
+    REDIS_ML_PREDICTIONS_PROGRESS_BAR_NAMESPACE: str = (
+        "REDIS_ML_PREDICTIONS_PROGRESS_BAR_NAMESPACE-"
+    )
+    COHORT_CHECKPOINT_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    # приоритет когорты (cohort_priority.py): дни давности + вес * новые записи
+    COHORT_PRIORITY_NEW_RECORD_WEIGHT: float = 0.01
+
+    REDIS_ML_PREDICTIONS_CACHE_NAMESPACE: str = "REDIS_ML_PREDICTIONS_CACHE_NAMESPACE-"
+
+    # последние предсказания в Redis (latest_predictions_cache.py)
+    REDIS_ML_PREDICTIONS_LATEST_NAMESPACE: str = "REDIS_ML_PREDICTIONS_LATEST_NAMESPACE-"
+    REDIS_ML_PREDICTIONS_EVENTS_CHANNEL: str = "ml_predictions_updated"
+
+    PREDICTION_CACHE_BACKEND: str = "memory"  # off / memory / redis
+    PREDICTION_CACHE_MAX_SIZE: int = 10_000
+    PREDICTION_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+
+    # каталог локального ExtractStore; если задан, признаки считаются без обращения к БД
+    FEATURES_EXTRACT_DIR: str | None = None
+    # не учитывать в признаках записи, отмеченные выбросами в последней итерации поиска
+    FEATURES_EXCLUDE_OUTLIERS: bool = False
+
+    # один запуск на пользователя одновременно (single_flight.py)
+    SINGLE_FLIGHT_BACKEND: str = "redis"  # off / redis / postgres (advisory lock)
+    SINGLE_FLIGHT_CLI_BACKEND: str = "postgres"  # для run.py --email: без Redis
+    SINGLE_FLIGHT_LOCK_TTL_SECONDS: float = 300
+    SINGLE_FLIGHT_REUSE_WINDOW_SECONDS: float = 60
+    SINGLE_FLIGHT_ON_DUPLICATE: str = "attach"  # attach / drop
+    REDIS_ML_PREDICTIONS_LOCK_NAMESPACE: str = "REDIS_ML_PREDICTIONS_LOCK_NAMESPACE-"
+
+    # пересчёт по событиям о новых processed_records (listener.py)
+    RECORDS_EVENTS_SOURCE: str = "postgres"  # postgres (LISTEN/NOTIFY) / redis (pub/sub)
+    RECORDS_EVENTS_CHANNEL: str = "processed_records_inserted"
+    RECORDS_EVENTS_DEBOUNCE_SECONDS: float = 60
+    RECORDS_EVENTS_MAX_DELAY_SECONDS: float = 600
+    RECORDS_EVENTS_CONCURRENCY: int = 2
+    REDIS_ML_PREDICTIONS_FEATURES_NAMESPACE: str = (
+        "REDIS_ML_PREDICTIONS_FEATURES_NAMESPACE-"
+    )
+
+    # версии моделей: <MODELS_DIR>/manifest.json (ml_models/registry.py)
+    MODELS_DIR: str = "./ml_models_files"
+    MODEL_RELOAD_INTERVAL_SECONDS: float = 60
+
+    # профилировщик SQL: отчёт по запросам в лог (и в JSON-файл) при выходе
+    SQL_PROFILER_ENABLED: bool = False
+    SQL_PROFILER_SLOW_QUERY_SECONDS: float = 0.5
+    SQL_PROFILER_REPORT_PATH: str | None = None
+    SQL_PROFILER_TOP_N: int = 20
+
     START_MS: int | None = int((time.time() - 360 * 24 * 60 * 60) * 1000)
 
     END_MS: int | None = int(time.time() * 1000)
@@ -26,6 +76,18 @@ class Settings(BaseSettings):
     NOTIFICATIONS_API_BASE_URL: str = (
         "http://notifications-api:8083/notifications-api/api/v1/notifications"
     )
+    NOTIFICATIONS_API_TIMEOUT_SECONDS: float = 10
+    # circuit breaker клиента уведомлений (circuit_breaker.py)
+    NOTIFICATIONS_BREAKER_FAILURE_THRESHOLD: int = 5
+    NOTIFICATIONS_BREAKER_RESET_SECONDS: float = 30
+
+    # сроки этапов запуска для одного пользователя и диагноза, секунды; 0 — без срока
+    STAGE_DEADLINE_USER_LOOKUP_SECONDS: float = 10
+    STAGE_DEADLINE_FEASIBILITY_SECONDS: float = 10
+    STAGE_DEADLINE_FEATURES_SECONDS: float = 30
+    STAGE_DEADLINE_INFERENCE_SECONDS: float = 10
+    STAGE_DEADLINE_PERSIST_SECONDS: float = 15
+    STAGE_DEADLINE_NOTIFY_SECONDS: float = 10
 
     model_config = SettingsConfigDict(
         env_file=".env.prod",
@@ -0,0 +1,230 @@
+"""Один запуск предсказаний на пользователя одновременно (single-flight)."""
+
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import text
+
+from metrics import metrics
+from records_db.engine import records_db_engine
+from records_db.predictions import recent_iteration
+from redis import redis_client
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+# снять блокировку, только если она всё ещё наша
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# записать результат и снять блокировку одной операцией: ожидающий дубликат
+# не может увидеть снятую блокировку раньше результата
+FINISH_SCRIPT = """
+if tonumber(ARGV[3]) > 0 then
+    redis.call("set", KEYS[2], ARGV[2], "px", ARGV[3])
+end
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# продлить блокировку, только если она всё ещё наша
+EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Защита от параллельных запусков для одного ключа (email):
+      - в процессе: повторный вызов ждёт уже идущий (asyncio.Future);
+      - между процессами: блокировка Redis SET NX PX с продлением,
+        а при недоступном Redis — pg_try_advisory_lock в records_db;
+      - дубликат либо ждёт результат (on_duplicate="attach"), либо сразу
+        получает None ("drop");
+      - результат хранится reuse_window_s, и запросы, пришедшие сразу
+        после завершения, получают его без повторного расчёта.
+    fn должна возвращать JSON-сериализуемый результат (номер итерации).
+    """
+
+    def __init__(
+        self,
+        backend: str = settings.SINGLE_FLIGHT_BACKEND,
+        lock_ttl_s: float = settings.SINGLE_FLIGHT_LOCK_TTL_SECONDS,
+        reuse_window_s: float = settings.SINGLE_FLIGHT_REUSE_WINDOW_SECONDS,
+        on_duplicate: str = settings.SINGLE_FLIGHT_ON_DUPLICATE,
+        namespace: str = settings.REDIS_ML_PREDICTIONS_LOCK_NAMESPACE,
+        poll_interval_s: float = 0.5,
+        result_retries: int = 3,
+    ):
+        if backend not in ("off", "redis", "postgres"):
+            raise ValueError("backend must be 'off', 'redis' or 'postgres'")
+        if on_duplicate not in ("attach", "drop"):
+            raise ValueError("on_duplicate must be 'attach' or 'drop'")
+        self.backend = backend
+        self.lock_ttl_ms = int(lock_ttl_s * 1000)
+        self.reuse_window_s = reuse_window_s
+        self.on_duplicate = on_duplicate
+        self.namespace = namespace
+        self.poll_interval_s = poll_interval_s
+        self.result_retries = result_retries
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if self.backend == "off":
+            return await fn()
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            metrics.incr("single_flight.duplicates")
+            if self.on_duplicate == "drop":
+                logger.info(f"run for {key} already in flight, dropping duplicate")
+                return None
+            logger.info(f"run for {key} already in flight, attaching")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        # исключение забирается здесь, чтобы без ожидающих не было предупреждения
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            result = await self._run_guarded(key, fn)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    async def _run_guarded(self, key: str, fn) -> Any:
+        if self.backend == "redis":
+            try:
+                await redis_client.connect()
+                reused = await redis_client.get(f"{self.namespace}{key}:result")
+            except Exception as e:
+                logger.warning(f"redis unavailable for single-flight ({e}), using advisory lock")
+            else:
+                if reused is not None:
+                    return self._reuse(key, json.loads(reused))
+                return await self._run_redis(key, fn)
+        return await self._run_postgres(key, fn)
+
+    def _reuse(self, key: str, result: Any) -> Any:
+        metrics.incr("single_flight.reused")
+        logger.info(f"reusing recent result for {key}: {result}")
+        return result
+
+    async def _heartbeat(self, lock_key: str, token: str):
+        while True:
+            await asyncio.sleep(self.lock_ttl_ms / 3000)
+            await redis_client.eval(EXTEND_SCRIPT, 1, lock_key, token, self.lock_ttl_ms)
+
+    async def _run_redis(self, key: str, fn) -> Any:
+        lock_key = f"{self.namespace}{key}:lock"
+        result_key = f"{self.namespace}{key}:result"
+        token = uuid.uuid4().hex
+
+        while not await redis_client.set(lock_key, token, nx=True, px=self.lock_ttl_ms):
+            metrics.incr("single_flight.duplicates")
+            if self.on_duplicate == "drop":
+                logger.info(f"run for {key} is held by another worker, dropping")
+                return None
+            logger.info(f"run for {key} is held by another worker, waiting")
+            while await redis_client.exists(lock_key):
+                await asyncio.sleep(self.poll_interval_s)
+            reused = await self._wait_result(result_key)
+            if reused is not None:
+                return self._reuse(key, json.loads(reused))
+
+        heartbeat = asyncio.create_task(self._heartbeat(lock_key, token))
+        try:
+            result = await fn()
+        except BaseException:
+            heartbeat.cancel()
+            await redis_client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+            raise
+        heartbeat.cancel()
+        await redis_client.eval(
+            FINISH_SCRIPT,
+            2,
+            lock_key,
+            result_key,
+            token,
+            json.dumps(result),
+            int(self.reuse_window_s * 1000),
+        )
+        return result
+
+    async def _wait_result(self, result_key: str) -> str | None:
+        """
+        Блокировка снята, а результата нет: владелец упал или блокировка истекла.
+        Несколько коротких повторов, прежде чем брать блокировку самим.
+        """
+        for attempt in range(self.result_retries + 1):
+            reused = await redis_client.get(result_key)
+            if reused is not None or self.reuse_window_s <= 0:
+                return reused
+            if attempt < self.result_retries:
+                await asyncio.sleep(self.poll_interval_s)
+        return None
+
+    def _recent_result(self, key: str) -> int | None:
+        if self.reuse_window_s <= 0:
+            return None
+        now = datetime.utcnow()
+        with records_db_engine.create_session() as session:
+            return recent_iteration(
+                session, key, now - timedelta(seconds=self.reuse_window_s), now
+            )
+
+    async def _run_postgres(self, key: str, fn) -> Any:
+        """
+        Advisory lock на выделенном соединении records_db в режиме autocommit
+        (соединение не висит «idle in transaction» весь запуск). Занятая блокировка
+        ожидается повторами pg_try_advisory_lock, а не блокирующим pg_advisory_lock,
+        который оборвал бы statement_timeout. Результат переиспользуется (по времени
+        последней записанной итерации) только после ожидания дубликата.
+        """
+        if records_db_engine.engine.dialect.name != "postgresql":
+            return await fn()
+
+        lock_id = {"key": f"ml_predictions:{key}"}
+        try_lock = text("SELECT pg_try_advisory_lock(hashtextextended(:key, 0))")
+        with records_db_engine.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as conn:
+            waited = False
+            while not conn.execute(try_lock, lock_id).scalar():
+                if not waited:
+                    metrics.incr("single_flight.duplicates")
+                    if self.on_duplicate == "drop":
+                        logger.info(f"run for {key} is held by another worker, dropping")
+                        return None
+                    logger.info(f"run for {key} is held by another worker, waiting")
+                    waited = True
+                await asyncio.sleep(self.poll_interval_s)
+            try:
+                if waited:
+                    recent = self._recent_result(key)
+                    if recent is not None:
+                        return self._reuse(key, recent)
+                return await fn()
+            finally:
+                conn.execute(
+                    text("SELECT pg_advisory_unlock(hashtextextended(:key, 0))"), lock_id
+                )
+
+single_flight = SingleFlight()
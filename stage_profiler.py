@@ -0,0 +1,127 @@
+"""
+CPU-профиль по стадиям конвейера: pstats (cProfile) и свёрнутые стеки
+для флеймграфа (семплирование стека основного потока).
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+logger = logging.getLogger(__name__)
+
+_DISABLED = nullcontext()
+
+
+class StageProfiler:
+    """
+    Пока профилировщик выключен, stage() возвращает общий nullcontext
+    и ничего не стоит. После enable() каждая стадия получает свой
+    cProfile.Profile (накапливается по всем пользователям), а фоновый поток
+    раз в sample_interval_s снимает стек основного потока и относит его
+    к текущей стадии. Вложенные стадии учитываются во внешней.
+
+    cProfile видит только поток, в котором включён, поэтому в режиме
+    профилирования запросы к БД нужно выполнять без asyncio.to_thread,
+    а пользователей — по одному.
+    """
+
+    def __init__(self, top_n: int = 15, sample_interval_s: float = 0.005):
+        self.top_n = top_n
+        self.sample_interval_s = sample_interval_s
+        self.enabled = False
+        self.output_dir: str | None = None
+        self._profiles: dict[str, cProfile.Profile] = {}
+        self._stacks: dict[str, dict[str, int]] = {}
+        self._active: str | None = None
+        self._thread_id: int | None = None
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def enable(self, output_dir: str):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.enabled = True
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _DISABLED
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str):
+        if self._active is not None:
+            yield
+            return
+        profile = self._profiles.setdefault(name, cProfile.Profile())
+        self._active = name
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._active = None
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval_s):
+            stage = self._active
+            frame = sys._current_frames().get(self._thread_id)
+            if stage is None or frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            collapsed = ";".join(reversed(stack))
+            counts = self._stacks.setdefault(stage, {})
+            counts[collapsed] = counts.get(collapsed, 0) + 1
+
+    def hotspots(self, stage: str) -> list[tuple[float, float, int, str]]:
+        """top_n функций стадии по собственному времени: (self_s, cum_s, calls, func)."""
+        stats = pstats.Stats(self._profiles[stage], stream=io.StringIO())
+        rows = [
+            (tottime, cumtime, calls, f"{func} ({os.path.basename(filename)}:{line})")
+            for (filename, line, func), (_, calls, tottime, cumtime, _) in stats.stats.items()
+        ]
+        return sorted(rows, reverse=True)[: self.top_n]
+
+    def finish(self):
+        """Остановить семплирование, записать <stage>.pstats, <stage>.collapsed и all.collapsed."""
+        if not self.enabled:
+            return
+        self._stop.set()
+        self._sampler.join()
+        self.enabled = False
+
+        with open(os.path.join(self.output_dir, "all.collapsed"), "w") as all_stacks:
+            for stage, profile in sorted(self._profiles.items()):
+                profile.dump_stats(os.path.join(self.output_dir, f"{stage}.pstats"))
+                counts = self._stacks.get(stage, {})
+                with open(os.path.join(self.output_dir, f"{stage}.collapsed"), "w") as f:
+                    for stack, count in sorted(counts.items()):
+                        f.write(f"{stack} {count}\n")
+                        all_stacks.write(f"{stage};{stack} {count}\n")
+
+                total = pstats.Stats(profile, stream=io.StringIO()).total_tt
+                logger.info(f"profile stage {stage}: {total:.3f}s")
+                for self_s, cum_s, calls, func in self.hotspots(stage):
+                    logger.info(
+                        f"  {self_s:8.3f}s self {cum_s:8.3f}s cum {calls:>8} calls  {func}"
+                    )
+        logger.info(f"profile written to {self.output_dir}")
+
+
+stage_profiler = StageProfiler()
+profile_stage = stage_profiler.stage
@@ -0,0 +1,246 @@
+"""
+Потоковый пересчёт когорты с ограниченной памятью: пользователи читаются
+серверным курсором порциями по chunk_size, признаки порции лежат
+в одном заранее выделенном NumPy-блоке, предсказания пишутся пакетом на порцию.
+"""
+
+import argparse
+import json
+import logging
+import resource
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+from typing import Iterator
+
+import numpy as np
+from sqlalchemy.future import select
+
+from batch_predictions import ALL_FEATURES, DIAGNOSES, build_row, score_rows
+from features import compute_cohort_features
+from latest_predictions_cache import refresh_latest_predictions
+from ml_models.registry import model_registry
+from records_db.engine import records_db_engine
+from records_db.predictions import (
+    PredictionsSchemaError,
+    allocate_iterations,
+    check_predictions_schema,
+    prediction_row,
+    save_predictions,
+)
+from users_db.demographics import UserDemographics
+from users_db.engine import users_db_engine
+from users_db.schemas import Users
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+class FeatureBlock:
+    """
+    Признаки порции пользователей: матрица float64 (capacity x число признаков),
+    отсутствующее значение — NaN. Выделяется один раз и переиспользуется.
+    """
+
+    __slots__ = ("names", "emails", "values")
+
+    def __init__(self, names: tuple[str, ...], capacity: int):
+        self.names = names
+        self.emails: list[str] = []
+        self.values = np.full((capacity, len(names)), np.nan)
+
+    def load(self, emails: list[str], features: dict[str, dict[str, float | None]]):
+        self.emails = emails
+        self.values[: len(emails)] = np.nan
+        for row, email in enumerate(emails):
+            user_features = features.get(email, {})
+            for column, name in enumerate(self.names):
+                value = user_features.get(name)
+                if value is not None:
+                    self.values[row, column] = value
+
+    def features(self, row: int) -> dict[str, float | None]:
+        return {
+            name: None if np.isnan(value) else float(value)
+            for name, value in zip(self.names, self.values[row])
+        }
+
+
+def stream_users(
+    session, chunk_size: int, limit: int | None = None
+) -> Iterator[list[UserDemographics]]:
+    """Демография пользователей порциями через серверный курсор (stream_results)."""
+    statement = select(Users.email, Users.gender, Users.birth_date).order_by(Users.email)
+    if limit:
+        statement = statement.limit(limit)
+    result = session.execute(
+        statement.execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    for partition in result.partitions():
+        yield [
+            UserDemographics(email, gender, birth_date)
+            for email, gender, birth_date in partition
+        ]
+
+
+def process_chunk(
+    records_db_session,
+    users: list[UserDemographics],
+    block: FeatureBlock,
+    today: date,
+    dry_run: bool = False,
+) -> int:
+    """Признаки, один predict_proba на диагноз и одна вставка для порции. Возвращает число строк."""
+    emails = [user.email for user in users]
+    block.load(emails, compute_cohort_features(records_db_session, emails, block.names))
+
+    pending = {diagnosis.name: ([], []) for diagnosis in DIAGNOSES}
+    for row, user in enumerate(users):
+        user_features = block.features(row)
+        for diagnosis in DIAGNOSES:
+            model_row = build_row(diagnosis, user, user_features, today)
+            if model_row is not None:
+                rows, owners = pending[diagnosis.name]
+                rows.append(model_row)
+                owners.append(user.email)
+
+    scored = []
+    for diagnosis in DIAGNOSES:
+        rows, owners = pending[diagnosis.name]
+        model = model_registry.get(diagnosis.name)
+        for email, result in zip(owners, score_rows(diagnosis, rows, model)):
+            scored.append((email, diagnosis.name, result, model.version))
+    if not scored:
+        return 0
+
+    # номер итерации выдаётся тем же счётчиком, что и обычным запускам:
+    # параллельный run.py / когорта / listener не получат такой же номер
+    owners = dict.fromkeys(email for email, _, _, _ in scored)
+    if dry_run:
+        iterations = {email: 0 for email in owners}
+    else:
+        allocated = allocate_iterations(records_db_session, dict.fromkeys(owners, 1))
+        iterations = {email: numbers[0] for email, numbers in allocated.items()}
+    iteration_datetime = datetime.utcnow()
+    records = [
+        prediction_row(
+            email,
+            diagnosis_name,
+            iterations[email],
+            result,
+            iteration_datetime,
+            model_version,
+        )
+        for email, diagnosis_name, result, model_version in scored
+    ]
+    if not dry_run:
+        save_predictions(records_db_session, records)
+    return len(records)
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(args) -> dict:
+    block = FeatureBlock(ALL_FEATURES, args.chunk_size)
+    today = date.today()
+    started = time.monotonic()
+    users_count = written = 0
+
+    users_db_session = users_db_engine.create_session()
+    records_db_session = records_db_engine.create_session()
+    try:
+        for users in stream_users(users_db_session, args.chunk_size, args.limit):
+            # новая опубликованная версия модели подхватывается со следующей порции
+            model_registry.reload()
+            chunk_written = process_chunk(
+                records_db_session, users, block, today, args.dry_run
+            )
+            if chunk_written and not args.dry_run:
+                refresh_latest_predictions([user.email for user in users])
+            written += chunk_written
+            users_count += len(users)
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"streamed {users_count} users, {written} predictions, "
+                f"{users_count / elapsed if elapsed else 0:.1f} users/s, "
+                f"peak RSS {peak_rss_mb():.1f} MB"
+            )
+    finally:
+        records_db_session.close()
+        users_db_session.close()
+
+    return {
+        "users": users_count,
+        "predictions": written,
+        "seconds": round(time.monotonic() - started, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def benchmark(sizes: list[int], chunk_size: int) -> list[dict]:
+    """Пиковый RSS для разных размеров когорты: каждый прогон — отдельный процесс без записи в БД."""
+    results = []
+    for size in sizes:
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--limit",
+                str(size),
+                "--chunk-size",
+                str(chunk_size),
+                "--dry-run",
+                "--json",
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["cohort_size"] = size
+        logger.info(f"benchmark: {result}")
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score the whole cohort with bounded memory."
+    )
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--limit", type=int, help="Only the first N users by email")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Compute without writing to DB"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the run summary as JSON"
+    )
+    parser.add_argument(
+        "--benchmark",
+        type=lambda value: [int(size) for size in value.split(",")],
+        help="Comma-separated cohort sizes; report peak RSS for each",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.benchmark, args.chunk_size), indent=2))
+    else:
+        if not args.dry_run:
+            try:
+                check_predictions_schema(records_db_engine.engine)
+            except PredictionsSchemaError as e:
+                logger.error(str(e))
+                sys.exit(1)
+        summary = main(args)
+        if args.json:
+            print(json.dumps(summary))
+        else:
+            logger.info(f"done: {summary}")
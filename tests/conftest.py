@@ -0,0 +1,105 @@
+import itertools
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import records_db.schemas as records_schemas  # noqa: E402
+import users_db.schemas as users_schemas  # noqa: E402
+from db_replicas import ReplicaRouter, RoutingSession  # noqa: E402
+from query_profiler import query_profiler  # noqa: E402
+from records_db.engine import records_db_engine  # noqa: E402
+from users_db.engine import users_db_engine  # noqa: E402
+
+_engine_ids = itertools.count()
+
+
+def sqlite_engine(path) -> object:
+    return create_engine(f"sqlite:///{path}")
+
+
+@pytest.fixture
+def sqlite_dbs(tmp_path, monkeypatch):
+    """records_db и users_db на файлах SQLite; движки видны query_budget()."""
+    records = sqlite_engine(tmp_path / "records.db")
+    users = sqlite_engine(tmp_path / "users.db")
+    records_schemas.Base.metadata.create_all(records)
+    users_schemas.Base.metadata.create_all(users)
+
+    router = ReplicaRouter(
+        "records_db", [], max_lag_s=1, lag_check_interval_s=60, retry_after_s=30
+    )
+    monkeypatch.setattr(records_db_engine, "engine", records)
+    monkeypatch.setattr(records_db_engine, "router", router)
+    monkeypatch.setattr(
+        records_db_engine,
+        "session",
+        sessionmaker(bind=records, class_=RoutingSession, router=router),
+    )
+    monkeypatch.setattr(users_db_engine, "engine", users)
+    monkeypatch.setattr(users_db_engine, "session", sessionmaker(bind=users))
+
+    suffix = next(_engine_ids)
+    query_profiler.register_engine(f"test_records_db_{suffix}", records)
+    query_profiler.register_engine(f"test_users_db_{suffix}", users)
+    yield records, users
+    records.dispose()
+    users.dispose()
+
+
+def seed_user(records_engine, users_engine, email: str, days: int = 40):
+    """Пользователь с данными для всех трёх диагнозов."""
+    now = datetime.now(timezone.utc)
+    with sessionmaker(bind=users_engine)() as session:
+        session.add(
+            users_schemas.Users(
+                google_sub=email,
+                email=email,
+                gender="male",
+                birth_date=datetime(1990, 1, 1),
+            )
+        )
+        session.commit()
+    with sessionmaker(bind=records_engine)() as session:
+        for day in range(days):
+            moment = now - timedelta(days=day, hours=1)
+            session.add_all(
+                [
+                    records_schemas.RawRecords(
+                        data_type="HeartRateRecord",
+                        email=email,
+                        time=moment,
+                        value=str(60 + day % 20),
+                    ),
+                    records_schemas.ProcessedRecords(
+                        data_type="StepsRecord", email=email, time=moment, value="6000"
+                    ),
+                    records_schemas.ProcessedRecords(
+                        data_type="SleepSessionTimeData",
+                        email=email,
+                        time=moment,
+                        value="420",
+                    ),
+                    records_schemas.ProcessedRecords(
+                        data_type="ActiveMinutesRecord",
+                        email=email,
+                        time=moment,
+                        value="45",
+                    ),
+                ]
+            )
+        for data_type, value in (("WeightRecord", "80"), ("HeightRecord", "1.8")):
+            session.add(
+                records_schemas.RawRecords(
+                    data_type=data_type,
+                    email=email,
+                    time=now - timedelta(days=5),
+                    value=value,
+                )
+            )
+        session.commit()
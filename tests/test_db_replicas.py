@@ -0,0 +1,58 @@
+from sqlalchemy import column, select, table, text
+from sqlalchemy.orm import sessionmaker
+
+from conftest import sqlite_engine
+from db_replicas import ReplicaRouter, RoutingSession
+
+ITEMS = table("items", column("source"))
+
+
+def make_db(path, source: str | None):
+    engine = sqlite_engine(path)
+    if source is not None:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE items (source TEXT)"))
+            conn.execute(text("INSERT INTO items VALUES (:source)"), {"source": source})
+    return engine
+
+
+def make_session(tmp_path, replica_source: str | None):
+    primary = make_db(tmp_path / "primary.db", "primary")
+    replica = make_db(tmp_path / "replica.db", replica_source)
+    router = ReplicaRouter(
+        "test_db", [replica], max_lag_s=1, lag_check_interval_s=60, retry_after_s=60
+    )
+    return sessionmaker(bind=primary, class_=RoutingSession, router=router)(), router
+
+
+def read(session, use_replica: bool = True) -> str:
+    stmt = select(ITEMS.c.source).execution_options(use_replica=use_replica)
+    return session.execute(stmt).scalar_one()
+
+
+def test_reads_with_option_go_to_replica(tmp_path):
+    session, _ = make_session(tmp_path, "replica")
+    with session:
+        assert read(session) == "replica"
+        assert read(session, use_replica=False) == "primary"
+
+
+def test_writes_go_to_primary(tmp_path):
+    session, _ = make_session(tmp_path, "replica")
+    with session:
+        session.execute(text("INSERT INTO items VALUES ('written')"))
+        session.commit()
+        assert session.execute(
+            text("SELECT count(*) FROM items WHERE source = 'written'")
+        ).scalar_one() == 1
+        assert read(session) == "replica"
+
+
+def test_replica_error_falls_back_to_primary_and_marks_it_down(tmp_path):
+    # на «реплике» нет таблицы: SQLite отвечает OperationalError
+    session, router = make_session(tmp_path, None)
+    with session:
+        assert read(session) == "primary"
+        assert router.replicas[0].down_until > 0
+        assert router.pick() is None
+        assert read(session) == "primary"
@@ -0,0 +1,80 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+import make_predictions_funcs
+import run
+from conftest import seed_user
+from query_profiler import QueryBudgetExceeded, query_budget
+from records_db.schemas import MLPredictionsRecords
+
+EMAIL = "budget@example.com"
+# records_db: номер итерации, выполнимость, признаки одним запросом на таблицу,
+# по две вставки на диагноз; users_db: демография (дальше — из DemographicsCache)
+ONE_USER_RUN_QUERIES = 11
+
+
+@pytest.fixture
+def offline_run(sqlite_dbs, monkeypatch):
+    """run.main без моделей, уведомлений, Redis и single-flight."""
+
+    async def skip(*args, **kwargs):
+        return None
+
+    probabilities = json.dumps({"0": 0.7, "1": 0.3})
+    monkeypatch.setattr(run, "send_ml_start_notification", skip)
+    monkeypatch.setattr(run, "send_ml_completion_notification", skip)
+    monkeypatch.setattr(run.single_flight, "backend", "off")
+    monkeypatch.setattr(make_predictions_funcs, "publish_latest_predictions", skip)
+    monkeypatch.setattr(make_predictions_funcs.prediction_memo, "backend", "off")
+    monkeypatch.setattr(
+        make_predictions_funcs.model_registry,
+        "get",
+        lambda name: SimpleNamespace(version="test"),
+    )
+    monkeypatch.setattr(
+        make_predictions_funcs,
+        "predict_sleep_disorder",
+        lambda input_data, model: make_predictions_funcs.SleepDisorderOutput(
+            Insomnia=0.1, Sleep_Apnea=0.2, nan=0.7
+        ),
+    )
+    monkeypatch.setattr(
+        make_predictions_funcs,
+        "predict_hypertension",
+        lambda **kwargs: probabilities,
+    )
+    monkeypatch.setattr(
+        make_predictions_funcs,
+        "predict_depression",
+        lambda **kwargs: probabilities,
+    )
+    records, users = sqlite_dbs
+    seed_user(records, users, EMAIL)
+    return records
+
+
+def saved_rows(records_engine) -> int:
+    with sessionmaker(bind=records_engine)() as session:
+        return session.execute(
+            select(func.count()).select_from(MLPredictionsRecords)
+        ).scalar()
+
+
+def test_one_user_run_fits_query_budget(offline_run):
+    with query_budget(ONE_USER_RUN_QUERIES, "one user run") as budget:
+        iteration = asyncio.run(run.main(EMAIL))
+
+    assert iteration == 1
+    assert saved_rows(offline_run) == 3
+    assert budget.count <= ONE_USER_RUN_QUERIES, budget.fingerprints
+
+
+def test_query_budget_reports_extra_queries(offline_run):
+    with pytest.raises(QueryBudgetExceeded, match="one user run"):
+        with query_budget(1, "one user run"):
+            asyncio.run(run.main(EMAIL))
@@ -0,0 +1,110 @@
+"""Облегчённое чтение демографии пользователей (без joined-загрузки токенов)."""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Iterable
+
+from sqlalchemy.future import select
+
+from .schemas import Users
+from .settings import settings
+
+
+IN_CHUNK_SIZE = 1000
+
+
+@dataclass(frozen=True, slots=True)
+class UserDemographics:
+    email: str
+    gender: str
+    birth_date: datetime
+
+    def age(self, today: date | None = None) -> int:
+        today = today or date.today()
+        birth_date = self.birth_date.date()
+        return (
+            today.year
+            - birth_date.year
+            - ((today.month, today.day) < (birth_date.month, birth_date.day))
+        )
+
+
+class DemographicsCache:
+    """
+    Кэш демографии в памяти процесса с TTL. Промахи добираются
+    одним запросом `email IN (...)` на каждые IN_CHUNK_SIZE адресов.
+    Размер ограничен max_size записями (LRU): в долгоживущем listener
+    или когорте кэш не растёт с каждым встреченным пользователем.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = settings.USERS_DEMOGRAPHICS_CACHE_TTL_SECONDS,
+        max_size: int = settings.USERS_DEMOGRAPHICS_CACHE_MAX_SIZE,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, UserDemographics]] = OrderedDict()
+
+    def _lookup(self, email: str, now: float) -> UserDemographics | None:
+        entry = self._entries.get(email)
+        if entry is None:
+            return None
+        expires_at, demographics = entry
+        if expires_at < now:
+            self._entries.pop(email, None)
+            return None
+        self._entries.move_to_end(email)
+        return demographics
+
+    def _remember(self, demographics: UserDemographics, expires_at: float):
+        self._entries[demographics.email] = (expires_at, demographics)
+        self._entries.move_to_end(demographics.email)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_many(self, session, emails: Iterable[str]) -> dict[str, UserDemographics]:
+        now = time.monotonic()
+        found, missing = {}, []
+        for email in dict.fromkeys(emails):
+            demographics = self._lookup(email, now)
+            if demographics is None:
+                missing.append(email)
+            else:
+                found[email] = demographics
+
+        for start in range(0, len(missing), IN_CHUNK_SIZE):
+            chunk = missing[start : start + IN_CHUNK_SIZE]
+            rows = session.execute(
+                select(Users.email, Users.gender, Users.birth_date).where(
+                    Users.email.in_(chunk)
+                )
+            )
+            expires_at = time.monotonic() + self.ttl_seconds
+            for email, gender, birth_date in rows:
+                demographics = UserDemographics(email, gender, birth_date)
+                self._remember(demographics, expires_at)
+                found[email] = demographics
+        return found
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, email: str | None = None):
+        if email is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(email, None)
+
+
+demographics_cache = DemographicsCache()
+
+
+def get_users_demographics(session, emails: Iterable[str]) -> dict[str, UserDemographics]:
+    return demographics_cache.get_many(session, emails)
+
+
+def get_user_demographics(session, email: str) -> UserDemographics | None:
+    return demographics_cache.get_many(session, [email]).get(email)
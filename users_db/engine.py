@@ -2,9 +2,14 @@ import logging
 from typing import Any
 
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import text
 
+from adaptive_limiter import AdaptiveLimiter
+from db_pool import engine_options, watch_statement_timeouts
+from query_profiler import query_profiler
+
 from .settings import settings
 
 logger = logging.getLogger("database")
@@ -13,12 +18,43 @@ logger = logging.getLogger("database")
 class DbEngine:
     def __init__(self):
         self.url = f"{settings.USERS_DB_ENGINE}://{settings.USERS_DB_USER}:{settings.USERS_DB_PASSWORD}@{settings.USERS_DB_HOST}:{settings.USERS_DB_PORT}/{settings.USERS_DB_NAME}"
-        self.engine = create_engine(self.url, pool_pre_ping=True)
+        self.engine = create_engine(
+            self.url,
+            **engine_options(
+                "users_db",
+                driver=settings.USERS_DB_ENGINE,
+                mode=settings.USERS_DB_POOL_MODE,
+                pool_size=settings.USERS_DB_POOL_SIZE,
+                max_overflow=settings.USERS_DB_MAX_OVERFLOW,
+                pool_timeout=settings.USERS_DB_POOL_TIMEOUT_SECONDS,
+                pool_recycle=settings.USERS_DB_POOL_RECYCLE_SECONDS,
+                pre_ping=settings.USERS_DB_POOL_PRE_PING,
+                statement_timeout_ms=settings.USERS_DB_STATEMENT_TIMEOUT_MS,
+            ),
+        )
+        watch_statement_timeouts(
+            self.engine,
+            "users_db",
+            settings.USERS_DB_POOL_MODE,
+            settings.USERS_DB_STATEMENT_TIMEOUT_MS,
+        )
         self.session = sessionmaker(bind=self.engine)
 
+    def pool_status(self) -> str:
+        return self.engine.pool.status()
+
     def create_session(self):
         return self.session(bind=self.engine)
 
+    def in_session(self, fn, *args, **kwargs):
+        """
+        fn(session, *args, **kwargs) в собственной короткой сессии. Для вызовов
+        в потоке: поток может пережить ожидающего (срок этапа), и общая сессия
+        не должна закрываться под ним.
+        """
+        with self.create_session() as session:
+            return fn(session, *args, **kwargs)
+
     def request(self, db_request: str | Any) -> list:
         with self.create_session() as session:
             session.begin()
@@ -33,6 +69,17 @@ class DbEngine:
 
 
 users_db_engine = DbEngine()
+query_profiler.register_engine("users_db", users_db_engine.engine)
+
+users_db_limiter = AdaptiveLimiter(
+    "users_db",
+    initial_limit=settings.USERS_DB_LIMITER_INITIAL,
+    min_limit=settings.USERS_DB_LIMITER_MIN,
+    max_limit=settings.USERS_DB_LIMITER_MAX,
+    latency_target_s=settings.USERS_DB_LIMITER_LATENCY_TARGET_SECONDS,
+    overload_errors=(OperationalError, PoolTimeoutError, TimeoutError),
+    offload=settings.USERS_DB_LIMITER_OFFLOAD,
+)
 
 
 async def db_engine_check():
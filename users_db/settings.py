@@ -15,6 +15,26 @@ class DbSettings(BaseSettings):
     USERS_DB_PASSWORD: str | None = "postgres"
     USERS_DB_NAME: str | None = "postgres"
 
+    # queue / null / pgbouncer (см. db_pool.engine_options)
+    USERS_DB_POOL_MODE: str = "queue"
+    USERS_DB_POOL_SIZE: int = 5
+    USERS_DB_MAX_OVERFLOW: int = 10
+    USERS_DB_POOL_TIMEOUT_SECONDS: float = 30
+    USERS_DB_POOL_RECYCLE_SECONDS: int = 1800
+    USERS_DB_POOL_PRE_PING: bool = True
+    # отмена запросов дольше заданного времени (PostgreSQL), 0 — без ограничения
+    USERS_DB_STATEMENT_TIMEOUT_MS: int = 10000
+
+    # адаптивный лимит одновременных запросов (см. adaptive_limiter.py)
+    USERS_DB_LIMITER_INITIAL: int = 4
+    USERS_DB_LIMITER_MIN: int = 1
+    USERS_DB_LIMITER_MAX: int = 16
+    USERS_DB_LIMITER_LATENCY_TARGET_SECONDS: float = 0.5
+    USERS_DB_LIMITER_OFFLOAD: bool = True
+
+    USERS_DEMOGRAPHICS_CACHE_TTL_SECONDS: int = 300
+    USERS_DEMOGRAPHICS_CACHE_MAX_SIZE: int = 50_000
+
     class Config:
         env_file = ".env"
         # env_file = ".env.development"